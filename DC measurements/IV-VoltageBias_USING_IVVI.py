@@ -19,14 +19,16 @@
 
 import stlab
 import stlabutils
+from dmm_buffer import DMM_buffer
 from stlab.devices.IVVI import IVVI_DAC
 import numpy as np
 import time
-from pygame.locals import *
-import pygame, sys
 import matplotlib.pyplot as plt
 import os
 import sys
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'Tools')) # shared helpers
+from run_control import RunControl
+from gate_ramp import GateRamp
 
 
 
@@ -43,7 +45,6 @@ V_bias_ofset = 0 #[V] offset
 delta_V_bias = V_bias_max/5 # [V]
 
 measure_average = 10 # number of the measurements per each bias Voltage for averaging
-time_sleep_measure = 0.05 # slee time in between measurements
 calibrate = True # Calibrate for the internal resistances of the measurement units
 
 Vgmax = 1 # Maximum gate voltage [V]
@@ -52,7 +53,9 @@ deltaVg = 0.2 # Gate voltage steps [V]
 
 
 gate_ramp_speed = 1 # Gate ramp speed [V/s], proposed: 0.5
-time_sleep_gate = 5 #sleep time to stablize the gate [s], proposed: 5
+gate_resolution = 0.01 # largest gate step of a single DAC write [V]
+gate_tau = 0.5 # time constant of the gate settling [s]; the wait after each ramp follows from it (was a fixed 5 s)
+gate_tolerance = 1e-3 # the gate is settled when within this error [V]
 measure_gate_leakage = True
 
 # DACs
@@ -91,8 +94,7 @@ if calibrate:
 else:
     prefix += '_no-calib'
 
-pygame.init()
-pygame.display.set_mode((100,100))
+control = RunControl(keys = {'e': 'stop', 'p': 'pause'}) # key window in a background thread
 
 
 ## Output setting
@@ -112,7 +114,6 @@ Vg_ini = Vglist[0]
 # V_bias_list = np.linspace(V_bias_max, V_bias_min, int((V_bias_max-V_bias_min)/delta_V_bias)+1)+V_bias_ofset
 V_bias_list = np.linspace(V_bias_max, V_bias_min, int((V_bias_max-V_bias_min)/delta_V_bias)+1)+V_bias_ofset
 
-END = False
 
 if S3b_range >= 1e-3:
     coeff = 1e3
@@ -128,8 +129,10 @@ palette = plt.get_cmap('Set1') # create a color palette
 ##Inititalizing the devices
 ivvi = IVVI_DAC(addr='COM3', verb=True)
 ivvi.RampAllZero(tt=2., steps = 20)
+gate = GateRamp.ivvi(ivvi, S1h_dac, S1h_gain, voltage = 0, max_rate = gate_ramp_speed, resolution = gate_resolution, tau = gate_tau, tolerance = gate_tolerance)
 
 Imeas = stlab.adi(addr='TCPIP::192.168.1.105::INSTR') #for measuring the current converted to Voltage at M0 output
+Imeas_buffer = DMM_buffer(Imeas, count=measure_average) # all readings of a bias point in one transfer
 
 if Vgmax !=0 and measure_gate_leakage:
     v_gateleakage = stlab.adi(addr='TCPIP::192.168.1.106::INSTR') #for measuring the leakage current
@@ -156,12 +159,8 @@ if calibrate:
 
     for V_bias in V_bias_list:
         ivvi.RampVoltage(S3b_dac, V_bias/S3b_range*1e3,tt=0.1, steps = 5)
-        i_cal = 0
-        for cnt in range(measure_average):
-            Iread = float(Imeas.query('READ?'))
-            i_cal += Iread / M1b_total_gain
-            time.sleep(time_sleep_measure)
-        I_cal = np.append(I_cal,i_cal/measure_average)
+        i_cal = np.mean(Imeas_buffer.read()) / M1b_total_gain
+        I_cal = np.append(I_cal,i_cal)
 
     R_int = np.average(np.diff(V_bias_list)/np.diff(I_cal))
     print ('Calibration Finished: total internal resistance is {:.1f}kOhms.'.format(1e-3*R_int))
@@ -178,9 +177,9 @@ else:
 ## Ramping up the gate to the first point
 if Vgmax !=0:
     print('############# Initialize back-gate to',Vg_ini,'V #############')
-    ivvi.RampVoltage(S1h_dac,Vg_ini/S1h_gain*1000.,tt=np.abs(Vg_ini)/gate_ramp_speed) ##ramping to the Vg_ini
-    print('Wait {:.0f}s for back-gate satbility at {:.1f}V'.format(time_sleep_gate,Vg_ini))
-    time.sleep(time_sleep_gate)
+    gate.RampVoltage(Vg_ini) ##ramping to the Vg_ini
+    print('Wait {:.1f}s for back-gate satbility at {:.1f}V'.format(gate.SettleTime(),Vg_ini))
+    gate.Settle()
 last_time = time.time()
 
 
@@ -192,17 +191,18 @@ plt.plot(V_bias_list*coeff,(V_bias_list/R_int)*1e9, '--b', linewidth=0.3, alpha=
 plt.legend()
 
 
+control.start()
 for gate_count,Vg in enumerate(Vglist):
 
     ivvi.RampVoltage(S3b_dac, V_bias_list[0]/S3b_range*1e3,tt=0.1, steps = 20)  #ramping up to the first bias point
 
-    if END:
+    if control.stopped:
           break
 
     if Vgmax !=0:
-        ivvi.RampVoltage(S1h_dac,Vg/S1h_gain*1000.,tt=deltaVg/gate_ramp_speed, steps = 20) ##ramping this gate voltage
-        print('Wait {:.0f}s for back-gate stability at {:.1f}'.format(time_sleep_gate, Vg))
-        time.sleep(time_sleep_gate)
+        gate.RampVoltage(Vg) ##ramping this gate voltage
+        print('Wait {:.1f}s for back-gate stability at {:.1f}'.format(gate.SettleTime(), Vg))
+        gate.Settle()
 
         if measure_gate_leakage:
             I_leakage = float(v_gateleakage.query('READ?'))*1e3 #the factor 1e3 is used to convert the current to [nA]
@@ -218,27 +218,18 @@ for gate_count,Vg in enumerate(Vglist):
 
     for count, V_bias in enumerate(V_bias_list):
 
-        for event in pygame.event.get():
-          if event.type == QUIT:sys.exit()
-          elif event.type == KEYDOWN and event.dict['key'] == 101: # corresponding to the letter 'e'
-            END = True
+        if not control.wait_if_paused(): # 'e' pressed
             if np.abs(Vg) > 1:
-                ivvi.RampVoltage(S1h_dac,0.,tt=30.)
-
-        if END:
-          break
+                gate.RampVoltage(0.)
+            break
 
         ivvi.RampVoltage(S3b_dac, V_bias/S3b_range*1e3,tt=0.1, steps = 5)  #biasing
 
-        I_tot = 0
-        for cnt in range(measure_average):
-            Iread = float(Imeas.query('READ?'))
-            if Iread > 4:
-                overshoot = True
-            I_tot += Iread / M1b_total_gain
-            time.sleep(time_sleep_measure)
+        Iread = Imeas_buffer.read()
+        if np.max(Iread) > 4:
+            overshoot = True
 
-        I = I_tot/measure_average
+        I = np.mean(Iread) / M1b_total_gain
 
         current_array = np.append(current_array,I)
         V_bias_array = np.append(V_bias_array,V_bias)
@@ -281,10 +272,10 @@ for gate_count,Vg in enumerate(Vglist):
 
     myfile.write('\n')
 
-    if END:
+    if control.stopped:
           break
 
-    if (Vgmax != Vgmin) and (not END):
+    if (Vgmax != Vgmin) and (not control.stopped):
         plt.subplot(2,1,1)
         plt.title(prefix)
         plt.plot(V_bias_list*coeff,current_array*1e9+gate_count*0.2, '--', marker='.', color=palette(gate_count), markersize = 1, linewidth=1, alpha=0.9, label='{:.0f}Vg'.format(Vg))
@@ -318,8 +309,9 @@ for gate_count,Vg in enumerate(Vglist):
 
 stlab.metagen.fromarrays(myfile,V_bias_list,Vglist[0:gate_count+1],zarray=[],xtitle='bias current (A)',ytitle='gate Voltage (V)',ztitle='',colnames=colnames)
 plt.savefig(os.path.dirname(myfile.name)+'\\'+prefix)
-if Vgmax !=0 and (not END):
-    ivvi.RampVoltage(S1h_dac,0.,tt=60.)
+control.close()
+if Vgmax !=0 and (not control.stopped):
+    gate.RampVoltage(0.)
 ivvi.RampAllZero(tt=5.)
 Imeas.close()
 ivvi.close()
@@ -19,6 +19,7 @@
 
 import stlab
 import stlabutils
+from dmm_buffer import DMM_buffer
 from stlab.devices.IVVI import IVVI_DAC
 import numpy as np
 import time
@@ -28,6 +29,10 @@ import matplotlib.pyplot as plt
 import os
 import sys
 import datetime
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'Tools')) # shared helpers
+from sweep_data import SweepBuffer
+from gate_ramp import GateRamp
+from sweep_order import sweep_order, row_runs
 
 
 
@@ -49,7 +54,6 @@ delta_V_bias = V_bias_max/10 # [V]
 # measure_average = 50 # number of the measurements per each bias Voltage for averaging
 measure_average = 1 # number of the measurements per each bias Voltage for averaging
 
-time_sleep_measure = 0.05 # sleep time in between measurements
 calibrate = False # Calibrate for the internal resistances of the measurement units
 
 # Vgmax = 60 # Maximum gate voltage [V]
@@ -57,10 +61,13 @@ Vgmax = 2 # Maximum gate voltage [V]
 
 Vgmin = -Vgmax # Minimum gate voltage [V]
 deltaVg = 0.5 # Gate voltage steps [V]
+sweep_mode = 'serpentine' # 'serpentine': every other gate sweeps the bias backwards, no return ramp; 'raster': always from V_bias_list[0]
 
 
 gate_ramp_speed = 1 # Gate ramp speed [V/s], proposed: 0.5
-time_sleep_gate = 5 #sleep time to stablize the gate [s], proposed: 5
+gate_resolution = 0.01 # largest gate step of a single DAC write [V]
+gate_tau = 0.5 # time constant of the gate settling [s]; the wait after each ramp follows from it (was a fixed 5 s)
+gate_tolerance = 1e-3 # the gate is settled when within this error [V]
 measure_gate_leakage = True
 
 # DACs
@@ -88,6 +95,10 @@ if Vgmax > 2*S1h_gain:
     print ('Maximum gate voltage exceeds the range on S1h.')
     EXIT = True
 
+if sweep_mode not in ['raster', 'serpentine']: # the gate rows have to stay whole for dV/dI
+    print ('sweep_mode should be raster or serpentine.')
+    EXIT = True
+
 if EXIT:
     sys.exit(0)
 
@@ -135,8 +146,10 @@ palette = plt.get_cmap('Set1') # create a color palette
 ##Inititalizing the devices
 ivvi = IVVI_DAC(addr='COM3', verb=True)
 ivvi.RampAllZero(tt=2., steps = 20)
+gate = GateRamp.ivvi(ivvi, S1h_dac, S1h_gain, voltage = 0, max_rate = gate_ramp_speed, resolution = gate_resolution, tau = gate_tau, tolerance = gate_tolerance)
 
 Imeas = stlab.adi(addr='TCPIP::192.168.1.105::INSTR') #for measuring the current converted to Voltage at M0 output
+Imeas_buffer = DMM_buffer(Imeas, count=measure_average) # all readings of a bias point in one transfer
 
 if Vgmax !=0 and measure_gate_leakage:
     v_gateleakage = stlab.adi(addr='TCPIP::192.168.1.106::INSTR') #for measuring the leakage current
@@ -163,12 +176,8 @@ if calibrate:
 
     for V_bias in V_bias_list:
         ivvi.RampVoltage(S3b_dac, V_bias/S3b_range*1e3,tt=0.1, steps = 5)
-        i_cal = 0
-        for cnt in range(measure_average):
-            Iread = float(Imeas.query('READ?'))
-            i_cal += Iread / M1b_total_gain
-            time.sleep(time_sleep_measure)
-        I_cal = np.append(I_cal,i_cal/measure_average)
+        i_cal = np.mean(Imeas_buffer.read()) / M1b_total_gain
+        I_cal = np.append(I_cal,i_cal)
 
     R_int = np.average(np.diff(V_bias_list)/np.diff(I_cal))
     print ('Calibration Finished: total internal resistance is {:.1f}kOhms.'.format(1e-3*R_int))
@@ -184,9 +193,9 @@ else:
 
 ## Ramping up the gate to the first point
 print('############# Initialize back-gate to',Vg_ini,'V #############')
-ivvi.RampVoltage(S1h_dac,Vg_ini/S1h_gain*1000.,tt=np.abs(Vg_ini)/gate_ramp_speed) ##ramping to the Vg_ini
-print('Wait {:.0f}s for back-gate satbility at {:.1f}V'.format(time_sleep_gate,Vg_ini))
-time.sleep(time_sleep_gate)
+gate.RampVoltage(Vg_ini) ##ramping to the Vg_ini
+print('Wait {:.1f}s for back-gate satbility at {:.1f}V'.format(gate.SettleTime(),Vg_ini))
+gate.Settle()
 last_time = time.time()
 
 
@@ -196,77 +205,75 @@ plt.plot(V_bias_list*coeff,(V_bias_list/R_int)*1e9, '--b', linewidth=0.3, alpha=
 plt.legend()
 start_time = time.time()
 
+R_map = SweepBuffer(steps = Vglist.size) # (gate steps x bias steps-1)
 
-for gate_count,Vg in enumerate(Vglist):
+order = sweep_order(len(Vglist), len(V_bias_list), sweep_mode)
+
+for gate_count, bias_indices in row_runs(order):
+    Vg = Vglist[gate_count]
     if END:
           break
 
-    ivvi.RampVoltage(S3b_dac, V_bias_list[0]/S3b_range*1e3,tt=0.1, steps = 20)  #ramping up to the first bias point
+    ivvi.RampVoltage(S3b_dac, V_bias_list[bias_indices[0]]/S3b_range*1e3,tt=0.1, steps = 20)  #ramping up to the first bias point of this row (no-op in serpentine mode)
 
-    ivvi.RampVoltage(S1h_dac,Vg/S1h_gain*1000.,tt=deltaVg/gate_ramp_speed, steps = 20) ##ramping this gate voltage
-    print('Wait {:.0f}s for back-gate stability at {:.1f}'.format(time_sleep_gate, Vg))
-    time.sleep(time_sleep_gate)
+    gate.RampVoltage(Vg) ##ramping this gate voltage
+    print('Wait {:.1f}s for back-gate stability at {:.1f}'.format(gate.SettleTime(), Vg))
+    gate.Settle()
 
     if measure_gate_leakage:
         I_leakage = float(v_gateleakage.query('READ?'))*1e3 #the factor 1e3 is used to convert the current to [nA]
     else:
         I_leakage = -1
 
-    current_array = np.array([])
-    V_bias_array = np.array([])
-    R_array = np.array([])
+    current_array = np.full(len(V_bias_list), np.nan) # by bias index, whatever the direction of the row
+    lines = [None]*len(V_bias_list)
 
 
 
     ## Sweeping the bias voltage
 
-    for count, V_bias in enumerate(V_bias_list):
+    for count in bias_indices:
+        V_bias = V_bias_list[count]
 
         for event in pygame.event.get():
           if event.type == QUIT:sys.exit()
           elif event.type == KEYDOWN and event.dict['key'] == 101: # corresponding to the letter 'e'
             END = True
             if np.abs(Vg) > 1:
-                ivvi.RampVoltage(S1h_dac,0.,tt=30.)
+                gate.RampVoltage(0.)
 
         if END:
           break
 
         ivvi.RampVoltage(S3b_dac, V_bias/S3b_range*1e3,tt=0.1, steps = 5)  #biasing
 
-        I_tot = 0
-        for cnt in range(measure_average):
-            Iread = float(Imeas.query('READ?'))
-            if Iread > 4:
-                overshoot = True
-            I_tot += Iread / M1b_total_gain
-            time.sleep(time_sleep_measure)
+        Iread = Imeas_buffer.read()
+        if np.max(Iread) > 4:
+            overshoot = True
 
-        I_tot = I_tot/measure_average
+        I_tot = np.mean(Iread) / M1b_total_gain
 
         if calibrate:
             I = I_cal[count]*I_tot/(I_cal[count]-I_tot)
         else:
             I = I_tot
 
-        current_array = np.append(current_array,I)
-        V_bias_array = np.append(V_bias_array,V_bias)
-        R_array = np.diff(V_bias_array)/np.diff(current_array)
+        current_array[count] = I
 
         current_time = time.time()
 
-        line = [V_bias, I, V_bias/I, Vg, T, I_leakage]
-        stlab.writeline(myfile, line)
+        lines[count] = [V_bias, I, V_bias/I, Vg, T, I_leakage]
 
+    for line in lines: # in the order of V_bias_list, so that the blocks of the file stay aligned
+        if line is not None:
+            stlab.writeline(myfile, line)
     myfile.write('\n')
 
     if END:
           break
 
-    if gate_count == 0:
-        R_map = R_array
-    else:
-        R_map = np.vstack((R_map,R_array))
+    R_array = np.diff(V_bias_list)/np.diff(current_array) # once per gate step, not on every bias point
+    R_map.append(R_array)
 
     elapsed_time = time.time()- start_time
     remaning_time = (Vglist.size-gate_count-1)*elapsed_time/(gate_count+1)
@@ -282,7 +289,7 @@ for gate_count,Vg in enumerate(Vglist):
     plt.subplot(2,1,2)
     if gate_count > 0:
         extent = [V_bias_min*coeff,V_bias_max*coeff, Vglist[0], Vglist[gate_count]]
-        plt.imshow(R_map, origin = 'lower', aspect='auto', extent=extent, cmap='seismic', vmin = 0.5*R_int, vmax = R_int+2000)
+        plt.imshow(R_map.data, origin = 'lower', aspect='auto', extent=extent, cmap='seismic', vmin = 0.5*R_int, vmax = R_int+2000)
 
         plt.title('Elapsed time: '+ str(datetime.timedelta(seconds=elapsed_time)).split(".")[0]+ ',    remaning time: <'+ str(datetime.timedelta(seconds=remaning_time)).split(".")[0] )
         plt.ylabel('$V_g$ (V)')
@@ -302,7 +309,7 @@ plt.savefig(os.path.dirname(myfile.name)+'\\'+prefix)
 stlab.metagen.fromarrays(myfile,V_bias_list,Vglist[0:gate_count+1],zarray=[],xtitle='bias current (A)',ytitle='gate Voltage (V)',ztitle='',colnames=colnames)
 
 if not END:
-    ivvi.RampVoltage(S1h_dac,0.,tt=60.)
+    gate.RampVoltage(0.)
 ivvi.RampAllZero(tt=5.)
 Imeas.close()
 ivvi.close()
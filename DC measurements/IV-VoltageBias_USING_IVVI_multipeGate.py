@@ -19,6 +19,7 @@
 
 import stlab
 import stlabutils
+from dmm_buffer import DMM_buffer
 from stlab.devices.IVVI import IVVI_DAC
 import numpy as np
 import time
@@ -28,6 +29,9 @@ import matplotlib.pyplot as plt
 import os
 import sys
 import datetime
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'Tools')) # shared helpers
+from sweep_data import SweepBuffer
+from sweep_order import sweep_order, row_runs
 
 
 
@@ -46,7 +50,6 @@ delta_V_bias = V_bias_max/200 # [V]
 
 
 measure_average = 2 # number of the measurements per each bias Voltage for averaging
-time_sleep_measure = 0.05 # slee time in between measurements
 
 Vgmax = 90 #Maximum gate voltage [V]
 Vgmin = -Vgmax # Minimum gate voltage [V]
@@ -54,6 +57,7 @@ deltaVg = 1 # Gate voltage steps [V]
 
 Vglist = np.linspace(Vgmax, Vgmin, int((Vgmax-Vgmin)/deltaVg)+1)
 # Vglist = np.array([90,80,70,50,20,0,-20,-70,-80,-90])
+sweep_mode = 'serpentine' # 'serpentine': every other gate sweeps the bias backwards, no return ramp; 'raster': always from V_bias_list[0]
 
 gate_ramp_speed = 1 # Gate ramp speed [V/s], proposed: 0.5
 time_sleep_gate = 5 #sleep time to stablize the gate [s], proposed: 5
@@ -134,6 +138,7 @@ ivvi = IVVI_DAC(addr='COM3', verb=True)
 ivvi.RampAllZero(tt=2., steps = 20)
 
 Imeas = stlab.adi(addr='TCPIP::192.168.1.105::INSTR',verb=True,read_termination='\n') #for measuring the current converted to Voltage at M0 output
+Imeas_buffer = DMM_buffer(Imeas, count=measure_average) # all readings of a bias point in one transfer
 Imeas.SetRangeAuto(False)
 Imeas.SetRange(10)
 Imeas.write('VOLT:NPLC 12')
@@ -210,10 +215,13 @@ start_time = time.time()
 Max_R_plot = 0
 Min_R_plot = 1000
 R_plot = 0
+R_map = SweepBuffer(steps = Vglist.size) # (gate steps x bias steps-1)
 # plt.figure(figsize = (30, 10))
-for gate_count,Vg in enumerate(Vglist):
+order = sweep_order(Vglist.size, len(V_bias_list), sweep_mode)
+for gate_count, bias_indices in row_runs(order):
+    Vg = Vglist[gate_count]
 
-    ivvi.RampVoltage(S3b_dac, V_bias_list[0]/S3b_range*1e3,tt=0.1, steps = 20)  #ramping up to the first bias point
+    ivvi.RampVoltage(S3b_dac, V_bias_list[bias_indices[0]]/S3b_range*1e3,tt=0.1, steps = 20)  #ramping up to the first bias point of this row (no-op in serpentine mode)
 
     if END:
           break
@@ -231,13 +239,16 @@ for gate_count,Vg in enumerate(Vglist):
         else:
             I_leakage = -1
 
-    current_array = []
-    V_bias_array = []
+    current_array = np.full(len(V_bias_list), np.nan) # by bias index, whatever the direction of the row
+    R_array = np.full(len(V_bias_list)-1, np.nan) # R_array[i]: between V_bias_list[i] and V_bias_list[i+1]
+    lines = [None]*len(V_bias_list)
+    previous = None
 
 
     ## Sweeping the bias voltage
 
-    for count, V_bias in enumerate(V_bias_list):
+    for count in bias_indices:
+        V_bias = V_bias_list[count]
 
         for event in pygame.event.get():
           if event.type == QUIT:sys.exit()
@@ -251,34 +262,31 @@ for gate_count,Vg in enumerate(Vglist):
 
         ivvi.RampVoltage(S3b_dac, V_bias/S3b_range*1e3,tt=0.1, steps = 3)  #biasing
 
-        I_tot = 0
-        for cnt in range(measure_average):
-            Iread = float(Imeas.query('READ?'))
-            if Iread > 4:
-                overshoot = True
-            I_tot += Iread / M1b_total_gain
-            time.sleep(time_sleep_measure)
+        Iread = Imeas_buffer.read()
+        if np.max(Iread) > 4:
+            overshoot = True
 
-        I = I_tot/measure_average
+        I = np.mean(Iread) / M1b_total_gain
 
-        current_array = np.append(current_array,I)
-        V_bias_array = np.append(V_bias_array,V_bias)
-
-        if count == 0:
+        if previous is None:
             R = V_bias/I - R_int
-            R_array = []
 
         else:
-            R = np.diff(V_bias_array)/np.diff(current_array)- R_int
-            R = float(R[count-1])
-            R_array = np.append(R_array,R)
+            R = (V_bias - V_bias_list[previous])/(I - current_array[previous]) - R_int # differential resistance to the previous point
+            R_array[min(count, previous)] = R
+
+        current_array[count] = I
+        previous = count
 
         print ('R = ', R)
 
-        line = [V_bias, I, R, Vg, T, I_leakage]
-        stlab.writeline(myfile, line)
+        lines[count] = [V_bias, I, R, Vg, T, I_leakage]
 
 
+    for count, line in enumerate(lines): # in the order of V_bias_list, so that the blocks of the file stay aligned
+        if line is not None:
+            line[2] = V_bias_list[0]/current_array[0] - R_int if count == 0 else R_array[count-1] # to the point below, whatever the direction of the row
+            stlab.writeline(myfile, line)
     myfile.write('\n')
 
     if END:
@@ -299,7 +307,7 @@ for gate_count,Vg in enumerate(Vglist):
 
     color=palette(int(gate_count*256/Vglist.size))
 
-    plt.plot(V_bias_array*coeff,(current_array+shift)*1e6, marker='.', color=color, markersize = 1.5, linewidth=0.75, alpha=0.9, label='{:.0f}Vg'.format(Vg))
+    plt.plot(V_bias_list*coeff,(current_array+shift)*1e6, marker='.', color=color, markersize = 1.5, linewidth=0.75, alpha=0.9, label='{:.0f}Vg'.format(Vg))
 
     if Vglist.size < 6:
         plt.legend()
@@ -324,20 +332,17 @@ for gate_count,Vg in enumerate(Vglist):
     plt.subplot(2,2,3)
 
     if map_it:
-        if gate_count == 0:
-            R_map = R_array
-        else:
-            R_map = np.vstack((R_map,R_array))
+        R_map.append(R_array)
 
         if gate_count > 0:
             extent = [V_bias_min*coeff,V_bias_max*coeff, Vglist[0], Vglist[gate_count]]
-            plt.imshow(1e-3*R_map, origin = 'lower', aspect='auto', extent=extent, cmap='seismic', vmin = vmin, vmax = vmax)
+            plt.imshow(1e-3*R_map.data, origin = 'lower', aspect='auto', extent=extent, cmap='seismic', vmin = vmin, vmax = vmax)
             plt.title (r'range: {:.1f} k$\Omega$ - {:.1f} k$\Omega$'.format(vmin, vmax))
             plt.ylabel('Vg [V]')
 
 
     else:
-        plt.plot((V_bias_array[1:]+delta_V_bias/2)*coeff,1e-3*R_array, color=color, marker='.', markersize = 1.5, linewidth=0.75, alpha=0.9, label='{:.0f}Vg'.format(Vg))
+        plt.plot((V_bias_list[1:]+delta_V_bias/2)*coeff,1e-3*R_array, color=color, marker='.', markersize = 1.5, linewidth=0.75, alpha=0.9, label='{:.0f}Vg'.format(Vg))
         plt.ylim (0.5*Min_R_plot, Max_R_plot* 1.5)
         plt.ylabel('dV/dI - R$_{int}$ [k$\Omega$]')
 
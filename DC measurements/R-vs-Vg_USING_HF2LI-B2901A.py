@@ -20,12 +20,17 @@ from gate_pattern import gate_pattern
 
 import time
 from my_poll_v2 import R_measure as R_measure
+from my_poll_v2 import HF2LI_session
+from demod_stream import HF2LI_stream
 import stlab
 import os
 from stlab.devices.Keysight_B2901A import Keysight_B2901A
 import matplotlib.pyplot as plt
 import pygame, sys
 from pygame.locals import *
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'Tools')) # shared helpers
+from live_view import LiveDisplay
+from adaptive_gate import AdaptiveGate
 import math
 
 
@@ -42,6 +47,7 @@ ramp_speed = 500 # the safe speed for ramping the gate voltage [mV/s]
 target_gate = 42
 shift_voltage= 0 #in the case the intended gate pattern in not symmetrical around 0.
 gate_points = 80
+adaptive_gate = False # True: the gate points are chosen while measuring, a coarse pass then passes refining where R shifts or bends the most (Dirac peak)
 safe_gate_current = 1e-6 # [A], safe current leakage limit. With in this limit, the oxide resistance below 4MOhm at 10Vg (400KOhm at 1Vg)) to be considerred not leacky!
 
 # HF2LI settings
@@ -51,6 +57,8 @@ measure_input_channnel = 1
 measure_frequency = 9413 #[Hz]
 demodulation_time_constant = 0.1
 deamodulation_duration = 0.18
+target_error = None # relative uncertainty on R: demodulates from 3 time constants on until it is reached, up to max_demodulation_duration (None: fixed deamodulation_duration)
+max_demodulation_duration = 2 # [s] upper limit of the adaptive demodulation
 
 
 bias_resistor = 1e6
@@ -73,6 +81,7 @@ ac = False
 do_plot = True
 watch_gate_leakage = True # monitors the gate leakage and stops above the safe leakage limit
 save_data =True
+stream_demod = True # keeps the lock-in recording in a background thread while the gate ramps
 
 pygame.init()
 pygame.display.set_mode((100,100))
@@ -86,6 +95,7 @@ apilevel_example = 6  # The API level supported by this example.
 zhinst.utils.api_server_version_check(daq)
 zhinst.utils.disable_everything(daq, device)
 out_mixer_channel = zhinst.utils.default_output_mixer_channel(props)
+session = HF2LI_session(daq, device) # keeps the demodulator subscribed during the whole sweep
 
 
 # Keysight setting
@@ -100,6 +110,11 @@ gate_dev.SetComplianceCurrent(safe_gate_current)
 
 # generating gate pattern
 pattern = gate_pattern(target_gate=target_gate, mode='double', data_points=gate_points, shift_voltage= shift_voltage )
+if adaptive_gate: # -target_gate to target_gate only, all the passes in the same direction
+	sweep = AdaptiveGate(-target_gate+shift_voltage, target_gate+shift_voltage, points = gate_points)
+	adaptive_phase = []
+else:
+	sweep = pattern['ramp_pattern']
 
 
 # Resistance measurement while modulating the gate voltage
@@ -117,9 +132,10 @@ gate_dev.RampVoltage(shift_voltage,tt=10*ramp_time, steps = 100)
 gate_voltage_step = pattern['ramp_pattern'][1]-pattern['ramp_pattern'][0]
 # ramp_time = np.abs(np.floor(gate_voltage_step/ramp_speed))
 ramp_time = 0.5
-plt_Vg=np.array([])
-plt_resistance=np.array([])
-plt_phase=np.array([])
+display = LiveDisplay(figsize = [16,9])
+display.trace('R', (2, 1, 1), pattern['ramp_pattern'], style = {'linestyle': '--', 'color': 'b', 'marker': '.', 'markersize': 1, 'linewidth': 0.2}, ylabel = 'Resistance ($\\Omega$)', title = prefix+ " f = {:.2f}kHz, offset = {:.1f}V, amp = {:.1f}V, R(bias) = {:.1f}M$\\Omega$, ".format(measure_frequency/1e3, offset, measure_amplitude, bias_resistor/1e6))
+display.trace('phase', (2, 1, 2), pattern['ramp_pattern'], style = {'linestyle': '--', 'color': 'b', 'marker': '.', 'markersize': 1, 'linewidth': 0.2}, ylabel = 'Phase ($\\degree$)', xlabel = 'Gate Voltage (V)')
+display.start()
 
 
 END = False
@@ -129,7 +145,7 @@ for i in range (3):
 		amplitude = measure_amplitude,
 		out_channel = measure_output_channnel,
 		in_channel = measure_input_channnel,
-		time_constant = demodulation_time_constant,
+		BW = 0.1/demodulation_time_constant,
 		frequency = measure_frequency,
 		poll_length = deamodulation_duration,
 		device = device,
@@ -141,9 +157,14 @@ for i in range (3):
 		diff = diff,
 		add = add,
 		offset = offset,
-		ac = ac)
+		ac = ac,
+		session = session)
 
-for count,gate_voltage in enumerate(pattern['ramp_pattern']): # ramping up the gate voltage
+if stream_demod:
+	stream = HF2LI_stream(session)
+	stream.start()
+
+for count,gate_voltage in enumerate(sweep): # ramping up the gate voltage
 
 	gate_voltage *=1
 	for event in pygame.event.get():
@@ -155,6 +176,8 @@ for count,gate_voltage in enumerate(pattern['ramp_pattern']): # ramping up the g
 		break
 
 	gate_dev.RampVoltage(gate_voltage,tt=ramp_time, steps = 5)
+	if stream_demod:
+		t_start = stream.mark() # the samples of this gate step start here
 
 	leakage_current = float(gate_dev.GetCurrent()) # in the units of [A]
 
@@ -173,23 +196,30 @@ for count,gate_voltage in enumerate(pattern['ramp_pattern']): # ramping up the g
 
 	# time.sleep(time_step)
 
-	measured = R_measure(device_id = 'dev352',
-		amplitude = measure_amplitude,
-		out_channel = measure_output_channnel,
-		in_channel = measure_input_channnel,
-		time_constant = demodulation_time_constant,
-		frequency = measure_frequency,
-		poll_length = deamodulation_duration,
-		device = device,
-		daq = daq,
-		out_mixer_channel = out_mixer_channel,
-		bias_resistor = bias_resistor,
-		in_range = in_range,
-		out_range = out_range,
-		diff = diff,
-		add = add,
-		offset = offset,
-		ac = ac)
+	if stream_demod:
+		measured = stream.R_measure(t_start, deamodulation_duration, measure_amplitude, bias_resistor,
+			time_constant = demodulation_time_constant, target_error = target_error, max_duration = max_demodulation_duration)
+	else:
+		measured = R_measure(device_id = 'dev352',
+			amplitude = measure_amplitude,
+			out_channel = measure_output_channnel,
+			in_channel = measure_input_channnel,
+			BW = 0.1/demodulation_time_constant,
+			frequency = measure_frequency,
+			poll_length = deamodulation_duration,
+			device = device,
+			daq = daq,
+			out_mixer_channel = out_mixer_channel,
+			bias_resistor = bias_resistor,
+			in_range = in_range,
+			out_range = out_range,
+			diff = diff,
+			add = add,
+			offset = offset,
+			ac = ac,
+			session = session,
+			target_error = target_error,
+			max_duration = max_demodulation_duration)
 
 	measured[0] = calibration_factor * np.abs(measured[0]) + shift
 
@@ -210,27 +240,16 @@ for count,gate_voltage in enumerate(pattern['ramp_pattern']): # ramping up the g
 
 	print('PHASE {:4.2f}'.format(measured[1]))
 
-	plt_Vg = np.append(plt_Vg,gate_voltage)
-	plt_resistance = np.append(plt_resistance,r)
-	plt_phase = np.append(plt_phase,measured[2])
-
-
-	plt.rcParams["figure.figsize"] = [16,9]
-	plt.subplot(2, 1, 1)
-	plt.plot(plt_Vg,plt_resistance, '--b',marker='.', markersize = 1, linewidth= 0.2)
-	# plt.yscale ('log')
-	plt.ylabel('Resistance ($\Omega$)')
-	# plt.ylim(1, 1000)
-	plt.title(prefix+ " f = {:.2f}kHz, offset = {:.1f}V, amp = {:.1f}V, R(bias) = {:.1f}M$\Omega$, ".format(measure_frequency/1e3, offset, measure_amplitude, bias_resistor/1e6))
-
-
-	plt.subplot(2, 1, 2)
-	plt.plot(plt_Vg,plt_phase, '--b', marker='.',markersize = 1, linewidth= 0.2)
-	plt.ylabel('Phase ($\degree$)')
-	plt.xlabel('Gate Voltage (V)')
-	plt.title("Resistance = %4.2f k$\Omega$, Leackage Current = %4.2f nA" %(measured[0], 1e9*leakage_current))
-
-	plt.pause(0.1)
+	if adaptive_gate:
+		sweep.add(r)
+		adaptive_phase.append(measured[2])
+		order = np.argsort([g for g, v in sweep.measured])
+		display.set_data('R', sweep.values, sweep.gates)
+		display.set_data('phase', np.array(adaptive_phase)[order], sweep.gates)
+	else:
+		display.set_point('R', count, r) # drawn by the display process, no plt.pause here
+		display.set_point('phase', count, measured[2])
+	display.set_title('phase', "Resistance = %4.2f k$\\Omega$, Leackage Current = %4.2f nA" %(measured[0], 1e9*leakage_current))
 
 
 print('RAMPING FINISHED')
@@ -238,6 +257,9 @@ print('RAMPING FINISHED')
 gate_dev.RampVoltage(0,tt=ramp_time*10) # to safely return back the gate voltage
 
 
+if stream_demod:
+	stream.stop()
+session.close()
 zhinst.utils.disable_everything(daq, device)
 gate_dev.SetOutputOff()
 
@@ -251,7 +273,7 @@ if save_data:
 
 
 	# saving the metafile
-	plt.savefig(os.path.dirname(my_file_2.name)+'\\'+prefix)
+	display.savefig(os.path.dirname(my_file_2.name)+'\\'+prefix)
 	my_file_2.close()
 
 	parameters = ['target gate (V)',
@@ -292,7 +314,4 @@ if save_data:
 	caption = ''
 	stlab.autoplot(my_file_2,'gate voltage (V)','leakage current (nA)',title=title,caption=caption)
 
-
-
-
-
+display.close()
@@ -18,12 +18,16 @@ from gate_pattern import gate_pattern
 
 import time
 from my_poll_v2 import R_measure as R_measure
+from my_poll_v2 import HF2LI_session
+from demod_stream import HF2LI_stream
 import stlab
 import os
 from stlab.devices.IVVI import IVVI_DAC
 import matplotlib.pyplot as plt
 import pygame, sys
 from pygame.locals import *
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'Tools')) # shared helpers
+from live_view import LiveDisplay
 import math
 
 
@@ -53,6 +57,8 @@ measure_input_channnel = 1
 measure_frequency = 77 #[Hz]
 demodulation_time_constant = 0.9
 deamodulation_duration = 3
+target_error = None # relative uncertainty on R: demodulates from 3 time constants on until it is reached, up to max_demodulation_duration (None: fixed deamodulation_duration)
+max_demodulation_duration = 10 # [s] upper limit of the adaptive demodulation
 
 
 bias_resistor = 1e8
@@ -66,6 +72,7 @@ shift = 400
 # output setting
 watch_gate_leakage = True # monitors the gate leakage and stops above the safe leakage limit
 save_data = True
+stream_demod = True # keeps the lock-in recording in a background thread while the gate ramps
 
 pygame.init()
 pygame.display.set_mode((100,100))
@@ -79,6 +86,7 @@ apilevel_example = 6  # The API level supported by this example.
 zhinst.utils.api_server_version_check(daq)
 zhinst.utils.disable_everything(daq, device)
 out_mixer_channel = zhinst.utils.default_output_mixer_channel(props)
+session = HF2LI_session(daq, device) # keeps the demodulator subscribed during the whole sweep
 
 # resetting the IVVI
 dev = IVVI_DAC('COM4') # IVVI
@@ -123,13 +131,37 @@ dev.RampVoltage(DAC,1000*shift_voltage/s1h_gain,tt=ramp_time, steps = 20) # the
 gate_voltage_step = pattern['ramp_pattern'][1]-pattern['ramp_pattern'][0]
 # ramp_time = np.abs(np.floor(gate_voltage_step/ramp_speed))
 ramp_time = 0.5
-plt_Vg=np.array([])
-plt_resistance=np.array([])
-plt_leak_curr=np.array([])
+display = LiveDisplay(figsize = [16,9])
+display.trace('R', (2, 1, 1), pattern['ramp_pattern'], style = {'linestyle': '--', 'color': 'b', 'marker': '.', 'markersize': 1, 'linewidth': 0.2}, ylabel = 'Resistance ($\\Omega$)', title = prefix)
+display.trace('leak', (2, 1, 2), pattern['ramp_pattern'], style = {'linestyle': '--', 'color': 'b', 'marker': '.', 'markersize': 1, 'linewidth': 0.2}, ylabel = 'Leakage Current (nA)', xlabel = 'Gate Voltage (V)')
+display.start()
 
 
 END = False
 
+if stream_demod:
+	# pushing the lock-in settings once, the stream only records
+	R_measure(device_id = 'dev352', 
+		amplitude = measure_amplitude, 
+		out_channel = measure_output_channnel, 
+		in_channel = measure_input_channnel, 
+		BW = 0.1/demodulation_time_constant, 
+		frequency = measure_frequency, 
+		poll_length = deamodulation_duration, 
+		device = device, 
+		daq = daq, 
+		out_mixer_channel = out_mixer_channel, 
+		bias_resistor = bias_resistor, 
+		in_range = 4e-3, 
+		out_range = 100e-3, 
+		diff = False, 
+		add = False, 
+		offset = 0, 
+		ac = False,
+		session = session)
+	stream = HF2LI_stream(session)
+	stream.start()
+
 for count,gate_voltage in enumerate(pattern['ramp_pattern']): # ramping up the gate voltage
 
 	for event in pygame.event.get():
@@ -142,6 +174,8 @@ for count,gate_voltage in enumerate(pattern['ramp_pattern']): # ramping up the g
 
 	
 	dev.RampVoltage(DAC,1000*gate_voltage/s1h_gain,tt=ramp_time) # the factor 1000 is applied as the unit reads in mV.
+	if stream_demod:
+		t_start = stream.mark() # the samples of this gate step start here
 
 
 	if watch_gate_leakage:
@@ -159,28 +193,33 @@ for count,gate_voltage in enumerate(pattern['ramp_pattern']): # ramping up the g
 	print ('\n\n------------------------')
 
 	print('GATE: {:6.4f}'.format(gate_voltage), 'V')
-			
-	time.sleep(time_step)
 
 
-	measured = R_measure(device_id = 'dev352', 
-		amplitude = measure_amplitude, 
-		out_channel = measure_output_channnel, 
-		in_channel = measure_input_channnel, 
-		time_constant = demodulation_time_constant, 
-		frequency = measure_frequency, 
-		poll_length = deamodulation_duration, 
-		device = device, 
-		daq = daq, 
-		out_mixer_channel = out_mixer_channel, 
-		bias_resistor = bias_resistor, 
-		in_range = 4e-3, 
-		out_range = 100e-3, 
-		diff = False, 
-		calibration_factor = 1, 
-		add = False, 
-		offset = 0, 
-		ac = False)
+	if stream_demod:
+		measured = stream.R_measure(t_start, deamodulation_duration, measure_amplitude, bias_resistor, settle = time_step,
+			time_constant = demodulation_time_constant, target_error = target_error, max_duration = max_demodulation_duration)
+	else:
+		time.sleep(time_step)
+		measured = R_measure(device_id = 'dev352', 
+			amplitude = measure_amplitude, 
+			out_channel = measure_output_channnel, 
+			in_channel = measure_input_channnel, 
+			BW = 0.1/demodulation_time_constant, 
+			frequency = measure_frequency, 
+			poll_length = deamodulation_duration, 
+			device = device, 
+			daq = daq, 
+			out_mixer_channel = out_mixer_channel, 
+			bias_resistor = bias_resistor, 
+			in_range = 4e-3, 
+			out_range = 100e-3, 
+			diff = False, 
+			add = False, 
+			offset = 0, 
+			ac = False,
+			session = session,
+			target_error = target_error,
+			max_duration = max_demodulation_duration)
 
 	measured[0] = calibration_factor * measured[0] + shift
 	line = [count,gate_voltage, leakage_current] + measured
@@ -194,31 +233,17 @@ for count,gate_voltage in enumerate(pattern['ramp_pattern']): # ramping up the g
 	print('RESISTANCE: {:6.2f}'.format(measured[0]), 'Ohms')
 	print('PHASE {:4.2f}'.format(measured[1]))
 
-	plt_Vg = np.append(plt_Vg,gate_voltage)
-	plt_resistance = np.append(plt_resistance,measured[0])
-	plt_leak_curr = np.append(plt_leak_curr,leakage_current)
-
-	plt.rcParams["figure.figsize"] = [16,9]
-	plt.subplot(2, 1, 1)
-	plt.plot(plt_Vg,plt_resistance, '--b',marker='.', markersize = 1, linewidth= 0.2)
-	# plt.yscale ('log')
-	plt.ylabel('Resistance ($\Omega$)')
-	# plt.ylim(1, 1000)
-	plt.title(prefix)
-
-
-	plt.subplot(2, 1, 2)
-	plt.plot(plt_Vg,plt_leak_curr, '--b', marker='.',markersize = 1, linewidth= 0.2)
-	plt.ylabel('Leakage Current (nA)')
-	plt.xlabel('Gate Voltage (V)')
-	plt.title("Resistance = %4.2f $\Omega$, Leackage Current = %4.2f nA" %(measured[0], leakage_current))
-
-	plt.pause(0.1)
+	display.set_point('R', count, measured[0]) # drawn by the display process, no plt.pause here
+	display.set_point('leak', count, leakage_current)
+	display.set_title('leak', "Resistance = %4.2f $\\Omega$, Leackage Current = %4.2f nA" %(measured[0], leakage_current))
 
 
 print('RAMPING FINISHED')
 
 dev.RampVoltage(DAC,0,tt=ramp_time) # to safely return back the gate voltage
+if stream_demod:
+	stream.stop()
+session.close()
 zhinst.utils.disable_everything(daq, device)
 if watch_gate_leakage:
 	vmeasure.close()
@@ -233,7 +258,7 @@ if save_data:
 
 
 	# saving the metafile
-	plt.savefig(os.path.dirname(my_file_2.name)+'\\'+prefix)
+	display.savefig(os.path.dirname(my_file_2.name)+'\\'+prefix)
 	my_file_2.close()
 
 	parameters = ['target gate (V)',
@@ -274,7 +299,4 @@ if save_data:
 	caption = ''
 	stlab.autoplot(my_file_2,'gate voltage (V)','leakage current (nA)',title=title,caption=caption)
 
-
-
-
-
+display.close()
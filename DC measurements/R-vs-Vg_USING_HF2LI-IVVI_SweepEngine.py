@@ -0,0 +1,208 @@
+''' R-vs-Vg_USING_HF2LI-IVVI.py written as a sweep_engine.Sweep: gate voltage from the IVVI (S1h), resistance from the HF2LI lock-in amplifier
+
+
+
+	Hardware to be used:
+		- IVVI DAC with S1h: For gating
+		- A bias resistance: As voltage to current converter for lock-in out put.
+		- HF2LI: to measure the resistance of graphene device
+		- Keithley DMM6500: gate leakage current on the S1h 'Current monitor'
+
+	The loop (ramp, settle, readouts, safety limit, saving, live plot, stop key) is the one of
+	Tools/sweep_engine.py: the leakage and the resistance are read at the same time, the data is
+	written in binary during the next gate step and exported to the .dat file at the end.
+	Press 's' in the control window to stop, 'p' to pause.
+
+
+'''
+import numpy as np
+import zhinst.utils
+
+from gate_pattern import gate_pattern
+
+from my_poll_v2 import R_measure as R_measure
+from my_poll_v2 import HF2LI_session
+from demod_stream import HF2LI_stream
+import stlab
+import os
+import sys
+from stlab.devices.IVVI import IVVI_DAC
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'Tools')) # shared helpers
+from gate_ramp import GateRamp
+from run_control import RunControl
+from sweep_engine import Sweep, Axis, Readout, Limit
+
+
+#############################################################
+''' Definitions'''
+
+# definitions
+tempdev = -1
+prefix = 'F18_e6-12_FE_2probe'
+path = 'D:\\measurement_data\\Hadi\\F- Multiterminal graphene JJ\\F18 2020-02-11 measurements/'
+
+time_step = 0.1 # [s] lock-in samples discarded after each gate step, to stablize the gate
+ramp_speed = 0.5 # the safe speed for ramping the gate voltage [V/s]
+gate_tau = 0.1 # [s] settling time constant of the gate
+target_gate = 60
+shift_voltage= 0 #in the case the intended gate pattern in not symmetrical around 0.
+gate_points = 70
+safe_gate_current = 2.5e-6 # [A], safe current leakage limit. With in this limit, the oxide resistance below 4MOhm at 10Vg (400KOhm at 1Vg)) to be considerred not leacky!
+
+s1h_gain = 45 # [V/V] manual gain set on S1h module
+DAC = 1 # DAC linked to the S1h
+
+
+# HF2LI settings
+measure_amplitude = 0.1 #measurement amplitude [V]
+measure_output_channnel = 1
+measure_input_channnel = 1
+measure_frequency = 77 #[Hz]
+demodulation_time_constant = 0.9
+deamodulation_duration = 3
+target_error = None # relative uncertainty on R: demodulates from 3 time constants on until it is reached, up to max_demodulation_duration (None: fixed deamodulation_duration)
+max_demodulation_duration = 10 # [s] upper limit of the adaptive demodulation
+
+
+bias_resistor = 1e8
+
+# Calibration parameters; experimentally achieved to adjst the resistance reading
+	# CASE 1: bias resistance of 1M and demodulation_time_constant = 0.1 =>> calibration_factor = 1.45 and shift = 0
+	# CASE 2: bias resistance of 10M and demodulation_time_constant = 0.45 =>> calibration_factor = 1 and shift = 400
+calibration_factor = 1 # 1.45 recommended  with bias resistance of 1M and demodulation_time_constant = 0.1 # to compensate the shift in resistance measurement
+shift = 400
+
+# output setting
+watch_gate_leakage = True # monitors the gate leakage and stops above the safe leakage limit
+save_data = True
+time_slot = None # [h] fridge time available: the sweep does not start if its planned time is longer (None: no check)
+
+
+##########################################################
+''' Initializing the devices '''
+
+# initial configuration of the Lock-in
+apilevel_example = 6  # The API level supported by this example.
+(daq, device, props) = zhinst.utils.create_api_session('dev352', apilevel_example, required_devtype='.*LI|.*IA|.*IS')
+zhinst.utils.api_server_version_check(daq)
+zhinst.utils.disable_everything(daq, device)
+out_mixer_channel = zhinst.utils.default_output_mixer_channel(props)
+session = HF2LI_session(daq, device) # keeps the demodulator subscribed during the whole sweep
+
+# resetting the IVVI
+dev = IVVI_DAC('COM4') # IVVI
+dev.RampAllZero()
+gate = GateRamp.ivvi(dev, DAC, s1h_gain, voltage = 0, max_rate = ramp_speed, resolution = 0.01, tau = gate_tau)
+
+
+# initializing the Keithley for gate current measurement
+if watch_gate_leakage:
+	vmeasure = stlab.adi('TCPIP::192.168.1.105::INSTR',read_termination='\n') # with Keithley DMM6500
+	vmeasure.write('SENS:VOLT:DC:RANG:AUTO 0')
+	vmeasure.write('SENS:VOLT:DC:RANGE 2')
+	vmeasure.write(':INIT:CONT 0')
+	vmeasure.write('VOLT:NPLC 1')
+	vmeasure.write('TRIG:SOUR IMM')
+	vmeasure.write(":SYST:AZER:STAT OFF")
+	vmeasure.write(":TRIG:COUN 1")
+	gate_leakage_v_I_conversion = 1e-6 # conversion factor of the measured voltage on S1h 'Current monitor' to leakage current
+
+# pushing the lock-in settings once, the stream only records
+R_measure(device_id = 'dev352',
+	amplitude = measure_amplitude,
+	out_channel = measure_output_channnel,
+	in_channel = measure_input_channnel,
+	BW = 0.1/demodulation_time_constant,
+	frequency = measure_frequency,
+	poll_length = deamodulation_duration,
+	device = device,
+	daq = daq,
+	out_mixer_channel = out_mixer_channel,
+	bias_resistor = bias_resistor,
+	in_range = 4e-3,
+	out_range = 100e-3,
+	diff = False,
+	add = False,
+	offset = 0,
+	ac = False,
+	session = session)
+stream = HF2LI_stream(session)
+stream.start()
+
+
+#############################################################
+''' MEASUREMENT'''
+
+# generating gate pattern
+pattern = gate_pattern(target_gate=target_gate, mode='double', data_points=gate_points, shift_voltage= shift_voltage )
+
+def measure_resistance():
+	measured = stream.R_measure(stream.mark(), deamodulation_duration, measure_amplitude, bias_resistor, settle = time_step,
+		time_constant = demodulation_time_constant, target_error = target_error, max_duration = max_demodulation_duration)
+	measured[0] = calibration_factor * measured[0] + shift
+	return measured
+
+readouts = [Readout(['Resistance (k ohm)','phase ()', 'demodulation duration (s)'], measure_resistance, device = stream,
+	duration = time_step + deamodulation_duration)] # for the planned time, printed before the run
+limits = []
+if watch_gate_leakage:
+	readouts.insert(0, Readout('leakage current (nA)', lambda: 1e9*gate_leakage_v_I_conversion*float(vmeasure.query('READ?')), device = vmeasure))
+	limits.append(Limit('leakage current (nA)', maximum = 1e9*safe_gate_current))
+
+sweep = Sweep(
+	axes = [Axis.gate('gate voltage (V)', pattern['ramp_pattern'], gate, device = dev)],
+	readouts = readouts,
+	limits = limits,
+	plots = ['Resistance (k ohm)', 'leakage current (nA)'] if watch_gate_leakage else ['Resistance (k ohm)'],
+	control = RunControl(keys = {'s': 'stop', 'p': 'pause'}),
+	time_slot = time_slot)
+
+my_file_2 = stlab.newfile(prefix,'_',autoindex=True, mypath= path) if save_data else None
+sweep.run(my_file_2) # the gate goes back to 0 V at the end, also after a stop or a leakage above the limit
+
+print('RAMPING FINISHED')
+stream.stop()
+session.close()
+zhinst.utils.disable_everything(daq, device)
+if watch_gate_leakage:
+	vmeasure.close()
+
+print('FINISHED')
+
+
+#######################################################################
+''' saving the data '''
+
+if save_data:
+
+	my_file_2.close()
+
+	# saving the metafile
+	parameters = ['target gate (V)',
+		'time step (s)',
+		'gate points ()',
+		'measure amplitude (V)',
+		'measure frequency (Hz)',
+		'bias resistor (Ohm)',
+		'deamodulation duration (s)',
+		'demodulation time constant (s)',
+		'temperature (K)']
+
+	T = tempdev
+
+	parameters_line =[target_gate,
+		time_step,
+		gate_points,
+		measure_amplitude,
+		measure_frequency,
+		bias_resistor,
+		deamodulation_duration,
+		demodulation_time_constant,
+		T]
+	my_file= stlab.newfile(prefix,'_metadata',autoindex=False,colnames=parameters,usefolder=False,mypath = os.path.dirname(my_file_2.name),usedate=False)
+	stlab.writeline(my_file,parameters_line)
+
+	# saving the plots
+	for title, column in [('Resistance', 'Resistance (k ohm)'), ('Phase', 'phase ()'), ('Duration', 'demodulation duration (s)'), ('Leakage Current', 'leakage current (nA)')]:
+		if column in sweep.data:
+			stlab.autoplot(my_file_2,'gate voltage (V)',column,title=title,caption='')
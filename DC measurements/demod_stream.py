@@ -0,0 +1,194 @@
+''' Continuous acquisition of the HF2LI demodulator in a background thread.
+
+The demodulator data is polled in short chunks into a ring buffer while the
+main loop ramps the gate, reads the leakage current, writes and plots. Every
+gate step is tagged with a device timestamp (mark()) and the samples of that
+step are sliced out of the buffer afterwards, so the lock-in keeps recording
+while the rest of the loop runs instead of taking turns with it.
+
+	Usage:
+		session = HF2LI_session(daq, device)
+		R_measure(..., session = session, initialize = True) # push the settings once
+		stream = HF2LI_stream(session)
+		stream.start()
+		for gate_voltage in pattern:
+			gate_dev.RampVoltage(gate_voltage, ...)
+			t_start = stream.mark()
+			... # leakage readout etc., the stream keeps recording
+			measured = stream.R_measure(t_start, deamodulation_duration, amplitude, bias_resistor)
+		stream.stop()
+'''
+
+import time
+import threading
+import numpy as np
+
+from my_poll_v2 import R_from_sample, demod_stats
+
+
+class HF2LI_stream:
+
+	def __init__(self, session, buffer_size = 2**20, chunk_length = 0.05):
+		''' buffer_size: number of demodulator samples kept in the ring buffer
+			chunk_length: [s] recording time of each poll() in the background thread
+		'''
+		self.session = session
+		self.clockbase = session.clockbase
+		self.buffer_size = int(buffer_size)
+		self.chunk_length = chunk_length
+
+		self.timestamp = np.zeros(self.buffer_size, dtype=np.uint64)
+		self.x = np.zeros(self.buffer_size)
+		self.y = np.zeros(self.buffer_size)
+		self.count = 0 # total number of samples received, the write position is count % buffer_size
+
+		self.marks = [] # device timestamps of the setpoint changes
+		self.last_timestamp = None # newest device timestamp ...
+		self.last_time = None # ... and the host time it arrived
+
+		self.lock = threading.Lock()
+		self.new_data = threading.Condition(self.lock)
+		self.running = False
+		self.thread = None
+		self.error = None
+
+	def start(self):
+		if self.running:
+			return
+		self.session.subscribe()
+		self.running = True
+		self.thread = threading.Thread(target=self._run, daemon=True)
+		self.thread.start()
+
+	def stop(self):
+		self.running = False
+		if self.thread is not None:
+			self.thread.join()
+			self.thread = None
+
+	def _run(self):
+		try:
+			while self.running:
+				with self.session.lock:
+					data = self.session.daq.poll(self.chunk_length, self.session.poll_timeout, 0, True)
+				if self.session.path in data:
+					self._append(data[self.session.path])
+		except Exception as error: # re-raised in the main thread by wait()
+			self.error = error
+			self.running = False
+			with self.new_data:
+				self.new_data.notify_all()
+
+	def _append(self, sample):
+		timestamp = np.asarray(sample['timestamp'], dtype=np.uint64)
+		n = timestamp.size
+		if n == 0:
+			return
+		if n > self.buffer_size: # keep only what fits
+			timestamp = timestamp[-self.buffer_size:]
+			sample = {'x': sample['x'][-self.buffer_size:], 'y': sample['y'][-self.buffer_size:]}
+			self.count += n - self.buffer_size
+			n = self.buffer_size
+
+		with self.new_data:
+			start = self.count % self.buffer_size
+			first = min(n, self.buffer_size - start)
+			self.timestamp[start:start+first] = timestamp[:first]
+			self.x[start:start+first] = sample['x'][:first]
+			self.y[start:start+first] = sample['y'][:first]
+			if first < n: # wrap around
+				self.timestamp[:n-first] = timestamp[first:]
+				self.x[:n-first] = sample['x'][first:]
+				self.y[:n-first] = sample['y'][first:]
+			self.count += n
+			self.last_timestamp = int(timestamp[-1])
+			self.last_time = time.time()
+			self.new_data.notify_all()
+
+	def now(self):
+		''' Estimate of the current device timestamp [ticks] '''
+		with self.lock:
+			while self.last_timestamp is None and self.running:
+				self.new_data.wait(1)
+			if self.last_timestamp is None:
+				self._raise()
+			return self.last_timestamp + int((time.time() - self.last_time)*self.clockbase)
+
+	def mark(self):
+		''' Tag a setpoint change (call it once the gate has reached its new value); returns the device timestamp '''
+		t = self.now()
+		self.marks.append(t)
+		return t
+
+	def wait(self, t_stop, timeout = 10):
+		''' Block until the buffer holds samples up to the device timestamp t_stop '''
+		deadline = time.time() + timeout
+		with self.new_data:
+			while self.last_timestamp is None or self.last_timestamp < t_stop:
+				if not self.running:
+					self._raise()
+				remaining = deadline - time.time()
+				if remaining <= 0:
+					raise TimeoutError('no demodulator data up to the requested timestamp after %.1f s' % timeout)
+				self.new_data.wait(remaining)
+
+	def samples(self, t_start, t_stop):
+		''' Copy of the buffered samples with t_start <= timestamp < t_stop, as a sample dictionary '''
+		with self.lock:
+			end = self.count % self.buffer_size
+			if self.count <= self.buffer_size:
+				segments = [(0, self.count)]
+			else: # wrapped: the oldest samples start at the write position
+				segments = [(end, self.buffer_size), (0, end)]
+
+			index = []
+			for a, b in segments: # each segment is sorted in time
+				lo, hi = np.searchsorted(self.timestamp[a:b], [t_start, t_stop])
+				index.append(np.arange(a+lo, a+hi))
+			index = np.concatenate(index)
+			return {'timestamp': self.timestamp[index], 'x': self.x[index], 'y': self.y[index]}
+
+	def step(self, count):
+		''' Samples between the count-th mark and the next one (or the newest sample) '''
+		t_start = self.marks[count]
+		t_stop = self.marks[count+1] if count+1 < len(self.marks) else self.last_timestamp + 1
+		return self.samples(t_start, t_stop)
+
+	def R_measure(self, t_start, poll_length, amplitude, bias_resistor, settle = 0, time_constant = None, diagnostics = False,
+		target_error = None, max_duration = None, min_duration = None):
+		''' Wait for poll_length seconds of data starting settle seconds after t_start and
+			reduce them like R_measure does.
+
+			With target_error (and time_constant) set, poll_length is not used: the window
+			starts at min_duration (default 3 time constants) and grows one time constant at
+			a time until the relative error of R is reached and the data is settled, or until
+			it is max_duration (default poll_length) long.
+		'''
+		t_start = t_start + int(settle*self.clockbase)
+		if target_error is not None:
+			assert time_constant, 'the adaptive mode (target_error) needs the filter time_constant'
+			if max_duration is None:
+				max_duration = poll_length
+			if min_duration is None:
+				min_duration = 3*time_constant
+			poll_length = min(min_duration, max_duration)
+		t_stop = t_start + int(poll_length*self.clockbase)
+		self.wait(t_stop, timeout = 10 + settle + poll_length)
+		sample = self.samples(t_start, t_stop)
+		assert sample['timestamp'].size > 1, 'no demodulator samples between the requested timestamps, is the ring buffer too small?'
+
+		if target_error is not None:
+			t_max = t_start + int(max_duration*self.clockbase)
+			while t_stop < t_max:
+				stats = demod_stats(sample, self.clockbase, time_constant, self.session.workspace(sample['x'].size))
+				if stats['settled'] and stats['x_err'] <= target_error*np.abs(stats['x']):
+					break
+				t_stop = min(t_stop + int(time_constant*self.clockbase), t_max)
+				self.wait(t_stop, timeout = 10 + time_constant)
+				sample = self.samples(t_start, t_stop)
+		return R_from_sample(sample, amplitude, bias_resistor, self.clockbase, time_constant, diagnostics, self.session.workspace(sample['x'].size))
+
+	def _raise(self):
+		if self.error is not None:
+			raise self.error
+		raise RuntimeError('the demodulator stream is not running')
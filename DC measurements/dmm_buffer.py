@@ -0,0 +1,62 @@
+''' Buffered readout of the Keithley 2000 and DMM6500 multimeters opened with stlab.adi
+
+Instead of averaging over `measure_average` separate READ? queries (one VISA round trip
+and one time.sleep each), the DMM takes all the readings on its own trigger count and
+sends them back in a single transfer, which is parsed into a numpy array.
+
+    Usage:
+        Imeas = stlab.adi(addr='TCPIP::192.168.1.105::INSTR', read_termination='\n')
+        Imeas_buffer = DMM_buffer(Imeas, count=measure_average)
+        readings = Imeas_buffer.read() # numpy array of measure_average readings
+        I = np.mean(readings) / M1b_total_gain
+
+The time per reading is set by the integration time (VOLT:NPLC) of the DMM.
+'''
+
+import numpy as np
+
+
+class DMM_buffer:
+    def __init__(self, dmm, count, model=None, buffer_name='defbuffer1'):
+        ''' dmm: the stlab.adi device
+            count: number of readings per read()
+            model: 'DMM6500' or '2000', read from *IDN? when not given
+        '''
+        self.dmm = dmm
+        self.buffer_name = buffer_name
+        if model is None:
+            model = 'DMM6500' if 'DMM6500' in dmm.query('*IDN?') else '2000'
+        if model not in ['DMM6500', '2000']:
+            raise ValueError('Unknown DMM model: %s' % model)
+        self.model = model
+        self.count = None
+        self.SetCount(count)
+
+    def SetCount(self, count):
+        count = int(count)
+        if count == self.count:
+            return
+        if self.model == 'DMM6500':
+            self.dmm.write(':COUN %d' % count) # readings per trigger of the measure model
+            self.dmm.write(':TRAC:POIN %d, "%s"' % (max(count, 10), self.buffer_name)) # the buffer holds at least 10 points
+        else:
+            if count > 1024:
+                raise ValueError('The Keithley 2000 stores at most 1024 readings')
+            self.dmm.write(':INIT:CONT OFF')
+            self.dmm.write(':FORM:ELEM READ') # readings only, no time stamps or channel
+            self.dmm.write(':TRIG:COUN 1')
+            self.dmm.write(':SAMP:COUN %d' % count)
+        self.count = count
+
+    def read(self):
+        ''' Trigger `count` readings and fetch them in one transfer '''
+        if self.model == 'DMM6500':
+            self.dmm.write(':TRAC:CLE "%s"' % self.buffer_name)
+            self.dmm.write(':TRAC:TRIG "%s"' % self.buffer_name) # fills the buffer with count readings
+            reply = self.dmm.query(':TRAC:DATA? 1, %d, "%s"' % (self.count, self.buffer_name))
+        else:
+            reply = self.dmm.query(':READ?') # returns all SAMP:COUN readings
+        return np.array(reply.strip().split(','), dtype=float)
+
+    def average(self):
+        return np.mean(self.read())
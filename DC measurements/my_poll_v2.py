@@ -1,15 +1,29 @@
 
 from __future__ import print_function
 import time
+import threading
 import numpy as np
 import zhinst.utils
 
 
 def R_measure(device_id, amplitude, out_channel, in_channel, poll_length,
-	device, daq, out_mixer_channel, bias_resistor, in_range, out_range, diff, frequency = 169, BW = 50e-3, filter_order = 2, demod_rate = 7, add = False, offset =0, ac = False, initialize = False):
+	device, daq, out_mixer_channel, bias_resistor, in_range, out_range, diff, frequency = 169, BW = 50e-3, filter_order = 2, demod_rate = 7, add = False, offset =0, ac = False, initialize = False, session = None, diagnostics = False, target_error = None, max_duration = None, min_duration = None):
 	"""Run the example: Connect to the device specified by device_id and obtain
 	demodulator data using ziDAQServer's blocking (synchronous) poll() command.
 
+	If a HF2LI_session is passed as `session`, the demodulator stays subscribed
+	between calls, the clockbase is not re-read and only the settings that
+	changed since the previous call are sent to the device.
+
+	With diagnostics = True the returned list is extended by the standard error
+	of R, its drift during the poll and the settled flag (see demod_stats).
+
+	Adaptive mode (needs a session): with target_error set, poll_length is not
+	used. The demodulator is polled for min_duration (default 3 time constants),
+	then one time constant more at a time, until the relative standard error of
+	R is below target_error and the data is settled, or until max_duration
+	(default poll_length) of wall-clock time has passed.
+
 	Returns:
 	  sample (dict of numpy arrays): The demodulator sample dictionary with the
 		additional demod R and demod phi fields calculated in the example.
@@ -56,90 +70,266 @@ def R_measure(device_id, amplitude, out_channel, in_channel, poll_length,
 					   ['/%s/sigouts/%d/amplitudes/%d' % (device, out_channel, out_mixer_channel), amplitude/out_range],
 					   ['/%s/sigouts/%d/offset' % (device, out_channel), offset/out_range]]
 
-		if initialize: daq.set(exp_setting)
+		if target_error is not None:
+			assert session is not None, "the adaptive mode (target_error) needs a HF2LI_session"
+			if max_duration is None:
+				max_duration = poll_length
+			if min_duration is None:
+				min_duration = 3*time_constant
+
+			session.set(exp_setting)
+			deadline = time.time() + max_duration # on the host clock: extend() may return no new samples
+			sample = session.poll(min(min_duration, max_duration))
+			clockbase = session.clockbase
+			while True:
+				stats = demod_stats(sample, clockbase, time_constant, session.workspace(sample['x'].size))
+				if stats['settled'] and stats['x_err'] <= target_error*np.abs(stats['x']):
+					break
+				if time.time() >= deadline:
+					print('target error not reached within {:.2f} s: {:.2g}'.format(max_duration, stats['x_err']/np.abs(stats['x'])))
+					break
+				sample = session.extend(sample, min(max(time_constant, 0.02), max(deadline - time.time(), 0.02)))
+
+			dt_seconds = stats['duration']
+			print("poll() returned {:.3f} seconds of demodulator data.".format(dt_seconds))
+			return R_from_sample(sample, amplitude, bias_resistor, clockbase, time_constant, diagnostics, session.workspace(sample['x'].size))
+
+		elif session is not None:
+			session.set(exp_setting)
+			sample = session.poll(poll_length)
+			clockbase = session.clockbase
+			dt_seconds = (sample['timestamp'][-1] - sample['timestamp'][0])/clockbase
+			print("poll() returned {:.3f} seconds of demodulator data.".format(dt_seconds))
+
+		else:
+			if initialize: daq.set(exp_setting)
+
+
+			# Unsubscribe any streaming data.
+			# print(daq.unsubscribe)
+			# daq.unsubscribe('*')
+			# time.sleep(5)
+			# Wait for the demodulator filter to settle.
+			# time.sleep(1.2*time_constant)
+
+			# Perform a global synchronisation between the device and the data server:
+			# Ensure that 1. the settings have taken effect on the device before issuing
+			# the poll() command and 2. clear the API's data buffers. Note: the sync()
+			# must be issued after waiting for the demodulator filter to settle above.
+			daq.sync()
+
+			# Subscribe to the demodulator's sample node path.
+			path = '/%s/demods/%d/sample' % (device, demod_index)
+
+			daq.subscribe(path)
+
+			# Sleep for demonstration purposes: Allow data to accumulate in the data
+			# server's buffers for one second: poll() will not only return the data
+			# accumulated during the specified poll_length, but also for data
+			# accumulated since the subscribe() or the previous poll.
+			sleep_length = 1.0
+
+			# For demonstration only: We could, for example, be processing the data
+			# returned from a previous poll().
+			# time.sleep(sleep_length)
+
+			# Poll the subscribed data from the data server. Poll will block and record
+			# for poll_length seconds.
+
+			poll_timeout = 500  # [ms]
+			poll_flags = 0
+			poll_return_flat_dict = True
+			data = daq.poll(poll_length, poll_timeout, poll_flags, poll_return_flat_dict)
+
+			# Unsubscribe from all paths.
+			# print('daq.unsubscribe')
+			# daq.unsubscribe('*')
+			# time.sleep(5)
+
+			# Check the dictionary returned is non-empty
+			assert data, "poll() returned an empty data dictionary, did you subscribe to any paths?"
+
+			# The data returned is a dictionary of dictionaries that reflects the node's path.
+			# Note, the data could be empty if no data had arrived, e.g., if the demods
+			# were disabled or had demodulator rate 0.
+			assert path in data, "The data dictionary returned by poll has no key `%s`." % path
+
+			# Access the demodulator sample using the node's path.
+			sample = data[path]
+
+			# Let's check how many seconds of demodulator data were returned by poll.
+			# First, get the sampling rate of the device's ADCs, the device clockbase...
+			clockbase = float(daq.getInt('/%s/clockbase' % device))
+			# ... and use it to convert sample timestamp ticks to seconds:
+			dt_seconds = (sample['timestamp'][-1] - sample['timestamp'][0])/clockbase
+			print("poll() returned {:.3f} seconds of demodulator data.".format(dt_seconds))
 
+		tol_percent = 50
 
-		# Unsubscribe any streaming data.
-		# print(daq.unsubscribe)
-		# daq.unsubscribe('*')
-		# time.sleep(5)
-		# Wait for the demodulator filter to settle.
-		# time.sleep(1.2*time_constant)
+		assert (dt_seconds - poll_length)/poll_length*100 < tol_percent, \
+			"Duration of demod data returned by poll() (%.3f s) differs " % dt_seconds + \
+			"from the expected duration (%.3f s) by more than %0.2f %%." % \
+			(poll_length, tol_percent)
 
-		# Perform a global synchronisation between the device and the data server:
-		# Ensure that 1. the settings have taken effect on the device before issuing
-		# the poll() command and 2. clear the API's data buffers. Note: the sync()
-		# must be issued after waiting for the demodulator filter to settle above.
-		daq.sync()
 
-		# Subscribe to the demodulator's sample node path.
-		path = '/%s/demods/%d/sample' % (device, demod_index)
+		work = session.workspace(sample['x'].size) if session is not None else None
+		return R_from_sample(sample, amplitude, bias_resistor, clockbase, time_constant, diagnostics, work)
 
-		daq.subscribe(path)
 
-		# Sleep for demonstration purposes: Allow data to accumulate in the data
-		# server's buffers for one second: poll() will not only return the data
-		# accumulated during the specified poll_length, but also for data
-		# accumulated since the subscribe() or the previous poll.
-		sleep_length = 1.0
+def demod_stats(sample, clockbase, time_constant = None, work = None):
+	"""Statistics of a demodulator sample dictionary, computed in one vectorized
+	pass over a (5 x n) work array holding x, y, |z|, phase and time.
 
-		# For demonstration only: We could, for example, be processing the data
-		# returned from a previous poll().
-		# time.sleep(sleep_length)
+	Returns a dictionary with the means ('x', 'y', 'r', 'phi' [deg]), their
+	standard errors ('x_err', 'y_err', 'r_err', 'phi_err'), the drift of x
+	during the poll ('x_slope' [V/s]), the 'duration' [s] and the number of
+	samples 'n'.
 
-		# Poll the subscribed data from the data server. Poll will block and record
-		# for poll_length seconds.
+	Neighbouring samples are correlated over the filter time constant
+	(0.1/BW), so the standard errors are computed with the number of
+	independent samples, duration/(2*time_constant), when it is given. The
+	data counts as 'settled' when the drift of x accumulated over one time
+	constant stays below the standard error of its mean (and never with fewer
+	than 3 samples, too few to estimate either).
 
-		poll_timeout = 500  # [ms]
-		poll_flags = 0
-		poll_return_flat_dict = True
-		data = daq.poll(poll_length, poll_timeout, poll_flags, poll_return_flat_dict)
+	work: optional preallocated array of shape (5, >= n), reused between calls.
+	"""
 
-		# Unsubscribe from all paths.
-		# print('daq.unsubscribe')
-		# daq.unsubscribe('*')
-		# time.sleep(5)
+	n = sample['x'].size
+	if work is None or work.shape[0] < 5 or work.shape[1] < n:
+		work = np.empty((5, n))
+	w = work[:5, :n]
 
-		# Check the dictionary returned is non-empty
-		assert data, "poll() returned an empty data dictionary, did you subscribe to any paths?"
+	w[0] = sample['x']
+	w[1] = sample['y']
+	np.hypot(w[0], w[1], out=w[2])
+	np.arctan2(w[1], w[0], out=w[3])
+	np.rad2deg(w[3], out=w[3])
+	np.subtract(sample['timestamp'], sample['timestamp'][0], out=w[4], casting='unsafe')
+	w[4] /= clockbase
 
-		# The data returned is a dictionary of dictionaries that reflects the node's path.
-		# Note, the data could be empty if no data had arrived, e.g., if the demods
-		# were disabled or had demodulator rate 0.
-		assert path in data, "The data dictionary returned by poll has no key `%s`." % path
+	mean = w.mean(axis=1)
+	w -= mean[:, None]
+	var = np.einsum('ij,ij->i', w, w)/max(n - 1, 1)
+	x_slope = np.dot(w[0], w[4])/var[4]/max(n - 1, 1) if var[4] > 0 else 0.
 
-		# Access the demodulator sample using the node's path.
-		sample = data[path]
+	duration = float(sample['timestamp'][-1] - sample['timestamp'][0])/clockbase
+	n_eff = n
+	if time_constant:
+		n_eff = min(n, max(1., duration/(2*time_constant)))
+	err = np.sqrt(var[:4]/n_eff)
 
-		# Let's check how many seconds of demodulator data were returned by poll.
-		# First, get the sampling rate of the device's ADCs, the device clockbase...
-		clockbase = float(daq.getInt('/%s/clockbase' % device))
-		# ... and use it to convert sample timestamp ticks to seconds:
-		dt_seconds = (sample['timestamp'][-1] - sample['timestamp'][0])/clockbase
-		print("poll() returned {:.3f} seconds of demodulator data.".format(dt_seconds))
+	stats = {'x': mean[0], 'y': mean[1], 'r': mean[2], 'phi': mean[3],
+		'x_err': err[0], 'y_err': err[1], 'r_err': err[2], 'phi_err': err[3],
+		'x_slope': x_slope, 'duration': duration, 'n': n}
+	stats['settled'] = bool(n >= 3 and (time_constant is None or np.abs(x_slope)*time_constant <= err[0]))
 
-		tol_percent = 50
+	return stats
 
-		assert (dt_seconds - poll_length)/poll_length*100 < tol_percent, \
-			"Duration of demod data returned by poll() (%.3f s) differs " % dt_seconds + \
-			"from the expected duration (%.3f s) by more than %0.2f %%." % \
-			(poll_length, tol_percent)
 
+def R_from_sample(sample, amplitude, bias_resistor, clockbase, time_constant = None, diagnostics = False, work = None):
+	"""Reduce a demodulator sample dictionary to the list returned by R_measure:
+	[R, |Z|, phase (deg), duration (s), X (V), Y (V)], followed by
+	[R error (Ohm), R drift (Ohm/s), settled] when diagnostics is True."""
 
-		measured_R = np.mean(sample['x'])*bias_resistor/amplitude
-		measured_X = np.mean(np.abs(sample['x'] + 1j*sample['y']))*bias_resistor/amplitude
-		# measured_phi = np.mean(sample['phase'])
+	stats = demod_stats(sample, clockbase, time_constant, work)
+	scale = bias_resistor/amplitude
 
-		# measured_phi = np.remainder(np.mean(np.angle(sample['x'] + 1j*sample['y'])),360)
-		# measured_phi = np.remainder(np.mean(np.rad2deg(np.angle(sample['x'] + 1j*sample['y']))),360)
-		measured_phi = np.mean(np.rad2deg(np.angle(sample['x'] + 1j*sample['y'])))
+	measured = [stats['x']*scale, stats['r']*scale, stats['phi'], stats['duration'], stats['x'], stats['y']]
+	if diagnostics:
+		measured += [stats['x_err']*scale, stats['x_slope']*scale, stats['settled']]
 
-		measured_x = np.mean(sample['x'])
-		measured_y = np.mean(sample['y'])
+	return measured
 
-		measured_duration = dt_seconds
 
-		#measured = {'resistance':measured_R, 'angle':measured_phi, 'duration':measured_duration}
-		measured = [measured_R, measured_X, measured_phi, measured_duration, measured_x, measured_y]
+class HF2LI_session:
+	"""Long-lived connection to one HF2LI demodulator, to be passed to R_measure
+	as `session` inside a sweep.
 
-		return measured
+	The clockbase is read once, the demodulator sample node stays subscribed
+	between points and a setting is only sent to the device when its value
+	differs from what was sent before, so a measurement point costs the
+	demodulation window and nothing more.
+
+	Call reset() after changing the device behind the session's back (e.g. with
+	zhinst.utils.disable_everything) and close() at the end of the measurement.
+	"""
+
+	def __init__(self, daq, device, demod_index = 0, poll_timeout = 500):
+		self.daq = daq
+		self.device = device
+		self.demod_index = demod_index
+		self.poll_timeout = poll_timeout # [ms]
+		self.path = '/%s/demods/%d/sample' % (device, demod_index)
+		self.clockbase = float(daq.getInt('/%s/clockbase' % device))
+		self.settings = {}
+		self.subscribed = False
+		self.work = np.empty((5, 0))
+		self.lock = threading.RLock() # daq is shared with HF2LI_stream's polling thread
+
+	def set(self, exp_setting):
+		"""Send only the [node, value] pairs that changed; returns True if anything was sent."""
+		changed = [[node, value] for node, value in exp_setting if self.settings.get(node) != value]
+		if not changed:
+			return False
+
+		with self.lock:
+			self.daq.set(changed)
+			self.settings.update(changed)
+
+			# the new settings must have reached the device before the next poll()
+			self.daq.sync()
+		return True
+
+	def subscribe(self):
+		with self.lock:
+			if not self.subscribed:
+				self.daq.sync()
+				self.daq.subscribe(self.path)
+				self.subscribed = True
+
+	def poll(self, poll_length):
+		"""Record poll_length seconds of demodulator data and return the sample dictionary."""
+		self.subscribe()
+
+		with self.lock:
+			data = self.daq.poll(poll_length, self.poll_timeout, 0, True)
+		assert data, "poll() returned an empty data dictionary, did you subscribe to any paths?"
+		assert self.path in data, "The data dictionary returned by poll has no key `%s`." % self.path
+		sample = data[self.path]
+
+		# While subscribed, poll() also returns everything buffered since the
+		# previous poll (e.g. while the gate was ramping): keep only the last
+		# poll_length seconds.
+		timestamp = sample['timestamp']
+		keep = timestamp >= timestamp[-1] - poll_length*self.clockbase
+		if not keep.all():
+			sample = {key: (value[keep] if isinstance(value, np.ndarray) and value.shape == timestamp.shape else value)
+				for key, value in sample.items()}
+
+		return sample
+
+	def extend(self, sample, poll_length):
+		"""Record poll_length seconds more and append them to sample (the data returned by the previous poll)."""
+		with self.lock:
+			data = self.daq.poll(poll_length, self.poll_timeout, 0, True)
+		if self.path not in data:
+			return sample
+		new = data[self.path]
+		return {key: np.concatenate((sample[key], new[key])) for key in ('timestamp', 'x', 'y')}
+
+	def workspace(self, n):
+		"""Work array for demod_stats, only reallocated when a poll returns more samples than before."""
+		if self.work.shape[1] < n:
+			self.work = np.empty((5, n))
+		return self.work
+
+	def reset(self):
+		"""Forget the cached settings, so that the next R_measure sends all of them again."""
+		self.settings = {}
+
+	def close(self):
+		with self.lock:
+			if self.subscribed:
+				self.daq.unsubscribe(self.path)
+				self.subscribed = False
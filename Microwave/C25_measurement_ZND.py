@@ -46,6 +46,9 @@ from pygame.locals import *
 from stlab.devices.IVVI import IVVI_DAC
 from matplotlib import cm
 from array import *
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'Tools')) # shared helpers
+from sweep_data import SweepBuffer
+from resonator_fit import ResonatorFitter, FIT_COLUMNS, fit_columns
 
 
 ###############################################################################################
@@ -68,6 +71,11 @@ SweepTime = 1 # frequency sweep time [s]
 frequency = np.linspace (start_freq,stop_freq,freq_points)
 power = -10 #sweep power [dB] range: -45 to 3 dB
 
+fit_resonance = True # circle fit of every trace in a separate process: f0, kappa and Qi vs the gate, plotted and in a _fits file
+fit_kind = 'reflection' # 'reflection' (through the directional coupler) or 'notch' (side-coupled resonator)
+fit_span = None # [Hz] fit only this span around the deepest point (None: the whole trace)
+max_fit_residual = 0.05 # stop the sweep after 5 fits in a row above this residual, the resonance left the window (None: never stop)
+
 # IVVI settings 
 s1h_gain = 15 # [V/V] manua l gain set on S1h module 
 DAC = 1 # DAC linked to the S1h
@@ -137,11 +145,32 @@ dev.RampVoltage(DAC,1000*shift_voltage/s1h_gain,tt=ramp_time) # the factor 1000
 gate_voltage_step = pattern['ramp_pattern'][1]-pattern['ramp_pattern'][0]
 ramp_time = np.abs(np.floor(gate_voltage_step/ramp_spead))
 
-S21dB = np.array([],[])
-S21Ph = np.array([],[])
-gate = np.array([])
-Leakage_current = np.array([])
-Temp = np.array([])
+steps = len(pattern['ramp_pattern'])
+S21dB = SweepBuffer(steps = steps) # (steps x frequency points), allocated on the first trace
+S21Ph = SweepBuffer(steps = steps)
+gate = SweepBuffer(steps = steps)
+Leakage_current = SweepBuffer(steps = steps)
+Temp = SweepBuffer(steps = steps)
+fit_gate, fit_f0, fit_kappa, fit_residual = [], [], [], []
+
+fitter = ResonatorFitter(fit_kind, span = fit_span, max_residual = max_fit_residual)
+if fit_resonance:
+	fitter.start()
+
+def show_fits(fits): # fits of the previous traces, as they come back from the fitter process
+	for index, fit in fits:
+		if 'error' in fit:
+			print('fit of gate step', index, 'failed:', fit['error'])
+			continue
+		if fit['problem']:
+			print('fit of gate step', index, 'implausible:', fit['problem'])
+			continue
+		fit_gate.append(pattern['ramp_pattern'][index])
+		fit_f0.append(fit['f0'])
+		fit_kappa.append(fit['kappa'])
+		fit_residual.append(fit['residual'])
+		if save_data:
+			stlab.writeline(Fits, [pattern['ramp_pattern'][index]] + list(fit_columns(fit).values()))
 
 dev.RampVoltage(DAC,pattern['ramp_pattern'][0],tt=ramp_time)
 
@@ -155,7 +184,7 @@ for count,gate_voltage in enumerate(pattern['ramp_pattern']): # ramping up the g
 	else: 
 		leakage_current = 0
 	
-	Leakage_current = np.append(Leakage_current,leakage_current)
+	Leakage_current.append(leakage_current)
 	
 
 	if watch_gate_leakage:
@@ -174,31 +203,44 @@ for count,gate_voltage in enumerate(pattern['ramp_pattern']): # ramping up the g
 	print ("ZND measurement start")
 	data = ZND.MeasureScreen_pd()
 	print ("ZND measurement finished")
+	if fit_resonance:
+		fitter.submit(count, np.array(data['Frequency (Hz)']), np.array(data['S21re ()']) + 1j*np.array(data['S21im ()']))
 
 
-	if count == 0:
-		S21dB = np.array(data['S21dB (dB)'])
-		S21Ph = np.array(data['S21Ph (rad)'])
-		gate = np.array(gate_voltage)
-	else: 
-		S21dB = np.array(np.vstack((S21dB,data['S21dB (dB)'])))
-		S21Ph = np.array(np.vstack((S21Ph,data['S21Ph (rad)'])))
-		gate = np.array(np.append(gate,gate_voltage))
+	S21dB.append(data['S21dB (dB)'])
+	S21Ph.append(data['S21Ph (rad)'])
+	gate.append(gate_voltage)
+
+	if count > 0:
 
 		plt.rcParams["figure.figsize"] = [16,9]
 		
 		if (count-1)//monitor_ratio == (count-1)/monitor_ratio:
-			plt.subplot(2, 1, 1)
+			plt.subplot(3, 2, (1,2))
 			plt.plot(data['Frequency (Hz)'],data['S21dB (dB)'])
 			plt.ylabel('S21dB (dB)')
 			plt.text(60, .025,['Gate: ', gate_voltage , 'V'])
 		
-		plt.subplot(2, 1, 2)
-		plt.contourf(data['Frequency (Hz)'],gate,S21dB)
+		plt.subplot(3, 2, (3,4))
+		plt.contourf(data['Frequency (Hz)'],gate.data,S21dB.data)
 		plt.ylabel('gate voltage (V)')
 		plt.title('S21dB (dB)')
 		plt.xlabel('Frequency (Hz)')
 
+		if fit_resonance and fit_gate:
+			plt.subplot(3, 2, 5)
+			plt.cla()
+			plt.plot(fit_gate, np.array(fit_f0)*1e-9, '.')
+			plt.ylabel('$f_0$ (GHz)')
+			plt.xlabel('gate voltage (V)')
+			plt.title('fit residual: {:.1e}'.format(fit_residual[-1]))
+
+			plt.subplot(3, 2, 6)
+			plt.cla()
+			plt.plot(fit_gate, np.array(fit_kappa)*1e-6, '.')
+			plt.ylabel('$\\kappa/2\\pi$ (MHz)')
+			plt.xlabel('gate voltage (V)')
+
 		print ("plotting finished")
 
 	plt.pause(0.1)	
@@ -214,8 +256,10 @@ for count,gate_voltage in enumerate(pattern['ramp_pattern']): # ramping up the g
 
 		if count==0:
 			Data = stlab.newfile(prefix,'_',data.keys(),autoindex = True)
+			if fit_resonance:
+				Fits = stlab.newfile(prefix,'_fits',['Gate Voltage (V)'] + list(FIT_COLUMNS),autoindex = True)
 		stlab.savedict(Data, data)
-		Temp = np.append(Temp,temp)
+		Temp.append(temp)
 
 		# stlab.metagen.fromarrays(Data,data['Frequency (Hz)'],powers[0:i+1],xtitle='Frequency (Hz)', ytitle='Power (dB)',colnames=data.keys())
 
@@ -224,6 +268,11 @@ for count,gate_voltage in enumerate(pattern['ramp_pattern']): # ramping up the g
 		
 		# stlab.writeline(Gate_Data,[gate_voltage, leakage_current])
 
+	if fit_resonance:
+		show_fits(fitter.results()) # never waits for the fits
+		if fitter.drifted:
+			print('the last fits have a residual above', max_fit_residual, ': the resonance left the window, stopping')
+			STOP = True
 	
 	for event in pygame.event.get(): # stopping if 's' pressed
 		if event.type == QUIT: sys.exit()
@@ -236,6 +285,7 @@ for count,gate_voltage in enumerate(pattern['ramp_pattern']): # ramping up the g
 
 dev.RampVoltage(DAC,0,tt=ramp_time) # to safely return back the gate voltage
 dev.close()
+show_fits(fitter.close())
 
 if watch_gate_leakage:
 	vmeasure.close()
@@ -249,17 +299,19 @@ if save_data:
 
 	plt.savefig(os.path.dirname(Data.name)+'\\'+prefix)
 	Data.close()
+	if fit_resonance:
+		Fits.close()
 	plt.close()
 
 	
-	print('gate =', gate)
+	print('gate =', gate.data)
 	plt.subplot(2, 1, 1)
-	plt.plot(gate,Leakage_current)
+	plt.plot(gate.data,Leakage_current.data[:len(gate)])
 	plt.ylabel('leakage current (nA)')
 	plt.xlabel('gate (V)')
 	
 	plt.subplot(2, 1, 2)
-	plt.plot(gate,Temp)
+	plt.plot(gate.data,Temp.data)
 	plt.ylabel('temperature (K)')
 	plt.xlabel('gate (V)')
 	plt.savefig(os.path.dirname(Data.name)+'\\'+prefix+'_extra')
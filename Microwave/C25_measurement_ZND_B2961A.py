@@ -35,6 +35,8 @@ import pygame, sys
 from pygame.locals import *
 from matplotlib import cm
 from array import *
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'Tools')) # shared helpers
+from sweep_data import SweepBuffer
 from stlab.devices.Keysight_B2901A import Keysight_B2901A
 
 
@@ -104,17 +106,17 @@ gate_dev.RampVoltage(pattern['ramp_pattern'][0],tt=10*ramp_time, steps = 100)
 gate_voltage_step = pattern['ramp_pattern'][1]-pattern['ramp_pattern'][0]
 ramp_time = np.abs(np.floor(gate_voltage_step/ramp_spead))
 
-S21dB = np.array([],[])
-S21Ph = np.array([],[])
-gate = np.array([])
-Leakage_current = np.array([])
+steps = len(pattern['ramp_pattern'])
+S_amp = SweepBuffer(steps = steps) # (steps x frequency points), allocated on the first trace
+S_phase = SweepBuffer(steps = steps)
+Leakage_current = SweepBuffer(steps = steps)
 
 
 for count,gate_voltage in enumerate(pattern['ramp_pattern']): # ramping up the gate voltage
 	gate_dev.RampVoltage(gate_voltage,tt=ramp_time, steps = 5)
 
 	leakage_current = float(gate_dev.GetCurrent()) # in the units of [A]
-	Leakage_current = np.append(Leakage_current,leakage_current)
+	Leakage_current.append(leakage_current)
 
 	if np.abs(leakage_current) > safe_gate_current:
 		GATE_LEAKAGE = True
@@ -139,8 +141,8 @@ for count,gate_voltage in enumerate(pattern['ramp_pattern']): # ramping up the g
 
 	if count == 0:
 
-		S_amp = amp_data
-		S_phase = phase_data
+		S_amp.append(amp_data)
+		S_phase.append(phase_data)
 
 
 		if adjust_phase:
@@ -161,8 +163,8 @@ for count,gate_voltage in enumerate(pattern['ramp_pattern']): # ramping up the g
 
 	else:
 
-		S_amp = np.array(np.vstack((S_amp,amp_data)))
-		S_phase = np.array(np.vstack((S_phase,adjusted_phase)))
+		S_amp.append(amp_data)
+		S_phase.append(adjusted_phase)
 
 
 
@@ -182,13 +184,13 @@ for count,gate_voltage in enumerate(pattern['ramp_pattern']): # ramping up the g
 
 
 		plt.subplot(4, 1, 3)
-		plt.contourf(data['Frequency (Hz)'],pattern['ramp_pattern'][0:count+1],S_amp)
+		plt.contourf(data['Frequency (Hz)'],pattern['ramp_pattern'][0:count+1],S_amp.data)
 		plt.ylabel('$V_g$ (V)')
 		plt.title('S11dB (dB)')
 
 
 		plt.subplot(4, 1, 4)
-		plt.contourf(data['Frequency (Hz)'],pattern['ramp_pattern'][0:count+1],S_phase*180/np.pi)
+		plt.contourf(data['Frequency (Hz)'],pattern['ramp_pattern'][0:count+1],S_phase.data*180/np.pi)
 		plt.ylabel('$V_g$ (V)')
 		plt.xlabel('Frequency (Hz)')
 		plt.title('Phase (°)')
@@ -241,7 +243,7 @@ if save_data:
 	plt.close()
 
 
-	plt.plot(pattern['ramp_pattern'],Leakage_current)
+	plt.plot(pattern['ramp_pattern'][0:len(Leakage_current)],Leakage_current.data)
 	plt.ylabel('leakage current (nA)')
 	plt.xlabel('gate (V)')
 	plt.savefig(os.path.dirname(Data.name)+'\\'+prefix+'leakage_current')
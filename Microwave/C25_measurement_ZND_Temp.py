@@ -35,6 +35,8 @@ import pygame, sys
 from pygame.locals import *
 from matplotlib import cm
 from array import *
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'Tools')) # shared helpers
+from sweep_data import SweepBuffer
 from stlab.devices.Cryocon_44C import Cryocon_44C
 
 
@@ -88,10 +90,10 @@ dev = Cryocon_44C('TCPIP::192.168.1.4::5000::SOCKET', reset=True)
 # modulating the gate voltage
 count = 0 # couter of step numbers
 
-S21dB = np.array([],[])
-S21Ph = np.array([],[])
-Temp = np.array([])
-Time = np.array([])
+S_amp = SweepBuffer() # open-ended run: grows by doubling
+S_phase = SweepBuffer()
+Temp = SweepBuffer()
+Time = SweepBuffer()
 
 t0 = time.time()
 t = 0
@@ -113,16 +115,16 @@ while not STOP:
 	temperature = dev.GetTemperature('B')
 	data['Temperature (K)'] = temperature
 
-	Temp = np.append(Temp,temperature)
-	Time = np.append(Time,t)
+	Temp.append(temperature)
+	Time.append(t)
 
 	data['Time (s)'] = t
 
 
 	if count == 0:
 
-		S_amp = amp_data
-		S_phase = phase_data
+		S_amp.append(amp_data)
+		S_phase.append(phase_data)
 
 
 		if adjust_phase:
@@ -143,8 +145,8 @@ while not STOP:
 
 	else:
 
-		S_amp = np.array(np.vstack((S_amp,amp_data)))
-		S_phase = np.array(np.vstack((S_phase,adjusted_phase)))
+		S_amp.append(amp_data)
+		S_phase.append(adjusted_phase)
 
 
 
@@ -164,7 +166,7 @@ while not STOP:
 
 
 		plt.subplot(3, 1, 3)
-		plt.contourf(data['Frequency (Hz)'],Temp,S_amp)
+		plt.contourf(data['Frequency (Hz)'],Temp.data,S_amp.data)
 		plt.ylabel('T (K)')
 
 
@@ -220,7 +222,7 @@ if save_data:
 	plt.savefig(os.path.dirname(Data.name)+'\\'+prefix)
 	plt.close()
 
-	plt.plot(Time,Temp)
+	plt.plot(Time.data,Temp.data)
 	plt.ylabel('Temperature (K)')
 	plt.xlabel('Time (s)')
 
@@ -46,6 +46,8 @@ from pygame.locals import *
 from stlab.devices.IVVI import IVVI_DAC
 from matplotlib import cm
 from array import *
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'Tools')) # shared helpers
+from sweep_data import SweepBuffer
 
 font = {'family': 'serif',
         'color':  'darkred',
@@ -125,9 +127,9 @@ leakage_current = 0
 ramp_time = np.abs(np.floor(gate/ramp_spead))
 dev.RampVoltage(DAC,1000*gate/s1h_gain,tt=ramp_time) # the factor 1000 is applied as the unit reads in mV.
 
-Temp = np.array([])
-S_amp = np.array([],[])
-S_phase = np.array([],[])
+Temp = SweepBuffer(steps = power_points)
+S_amp = SweepBuffer(steps = power_points) # (power steps x frequency points), allocated on the first trace
+S_phase = SweepBuffer(steps = power_points)
 
 for count,power in enumerate(power_pattern): # ramping up the gate voltage
 	
@@ -150,8 +152,8 @@ for count,power in enumerate(power_pattern): # ramping up the gate voltage
 
 	if count == 0:
 		
-		S_amp = amp_data
-		S_phase = phase_data
+		S_amp.append(amp_data)
+		S_phase.append(phase_data)
 		plt.plot(data['Frequency (Hz)'],phase_data)
 		plt.show()
 		
@@ -169,8 +171,8 @@ for count,power in enumerate(power_pattern): # ramping up the gate voltage
 
 	else: 
 		
-		S_amp = np.array(np.vstack((S_amp,amp_data)))
-		S_phase = np.array(np.vstack((S_phase,adjusted_phase)))
+		S_amp.append(amp_data)
+		S_phase.append(adjusted_phase)
 
 
 
@@ -193,13 +195,13 @@ for count,power in enumerate(power_pattern): # ramping up the gate voltage
 
 		
 		plt.subplot(4, 1, 3)
-		plt.contourf(data['Frequency (Hz)'],power_pattern[0:count+1],S_amp)
+		plt.contourf(data['Frequency (Hz)'],power_pattern[0:count+1],S_amp.data)
 		plt.ylabel('power (dB)')
 		plt.title('S11dB (dB)')
 
 		
 		plt.subplot(4, 1, 4)
-		plt.contourf(data['Frequency (Hz)'],power_pattern[0:count+1],S_phase)
+		plt.contourf(data['Frequency (Hz)'],power_pattern[0:count+1],S_phase.data)
 		plt.ylabel('power (dB)')
 		plt.xlabel('Frequency (Hz)')
 		plt.title('Phase (°)')
@@ -218,7 +220,7 @@ for count,power in enumerate(power_pattern): # ramping up the gate voltage
 		if count==0:
 			Data = stlab.newfile(prefix,'_',data.keys(),autoindex = True)
 		stlab.savedict(Data, data)
-		Temp = np.append(Temp,temp)
+		Temp.append(temp)
 
 		# stlab.metagen.fromarrays(Data,data['Frequency (Hz)'],powers[0:i+1],xtitle='Frequency (Hz)', ytitle='Power (dB)',colnames=data.keys())
 
@@ -36,6 +36,8 @@ import pygame, sys
 from pygame.locals import *
 from matplotlib import cm
 from array import *
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'Tools')) # shared helpers
+from sweep_data import SweepBuffer
 
 font = {'family': 'serif',
         'color':  'darkred',
@@ -115,9 +117,9 @@ temp_dev = Cryocon_44C('TCPIP::192.168.1.4::5000::SOCKET')
 # generating gate pattern
 power_pattern = np.linspace(start_power,end_power,power_points)
 
-Temp = np.array([])
-S_amp = np.array([],[])
-S_phase = np.array([],[])
+Temp = SweepBuffer(steps = power_points)
+S_amp = SweepBuffer(steps = power_points) # (power steps x frequency points), allocated on the first trace
+S_phase = SweepBuffer(steps = power_points)
 
 for count,power in enumerate(power_pattern): # ramping up the gate voltage
 
@@ -140,8 +142,8 @@ for count,power in enumerate(power_pattern): # ramping up the gate voltage
 
     if count == 0 :
 
-        S_amp = amp_data
-        S_phase = phase_data
+        S_amp.append(amp_data)
+        S_phase.append(phase_data)
 
 
         if adjust_phase:
@@ -162,8 +164,8 @@ for count,power in enumerate(power_pattern): # ramping up the gate voltage
 
     else:
 
-        S_amp = np.array(np.vstack((S_amp,amp_data)))
-        S_phase = np.array(np.vstack((S_phase,adjusted_phase)))
+        S_amp.append(amp_data)
+        S_phase.append(adjusted_phase)
 
 
 
@@ -183,13 +185,13 @@ for count,power in enumerate(power_pattern): # ramping up the gate voltage
 
 
         plt.subplot(4, 1, 3)
-        plt.contourf(data['Frequency (Hz)'],power_pattern[0:count+1],S_amp)
+        plt.contourf(data['Frequency (Hz)'],power_pattern[0:count+1],S_amp.data)
         plt.ylabel('power (dB)')
         plt.title('S11dB (dB)')
 
 
         plt.subplot(4, 1, 4)
-        plt.contourf(data['Frequency (Hz)'],power_pattern[0:count+1],S_phase)
+        plt.contourf(data['Frequency (Hz)'],power_pattern[0:count+1],S_phase.data)
         plt.ylabel('power (dB)')
         plt.xlabel('Frequency (Hz)')
         plt.title('Phase (°)')
@@ -208,7 +210,7 @@ for count,power in enumerate(power_pattern): # ramping up the gate voltage
         if count==0:
             Data = stlab.newfile(prefix,'_',data.keys(),autoindex = True)
         stlab.savedict(Data, data)
-        Temp = np.append(Temp,temp)
+        Temp.append(temp)
 
         # stlab.metagen.fromarrays(Data,data['Frequency (Hz)'],powers[0:i+1],xtitle='Frequency (Hz)', ytitle='Power (dB)',colnames=data.keys())
 
@@ -23,14 +23,17 @@ The program eventually plots the reflection of the cavity as a function of the f
 import os
 import numpy as np
 import time
+import tempfile
 import stlab
 import stlabutils
 import matplotlib.pyplot as plt
-import pygame, sys
-from pygame.locals import *
+import sys
 from array import *
 from stlab.devices.Cryocon_44C import Cryocon_44C
 from stlab.devices.RS_ZND import RS_ZND
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'Tools')) # shared helpers
+from sweep_data import SweepStore
+from run_control import RunControl
 
 
 ###############################################################################################
@@ -64,9 +67,9 @@ safe_gate_current = 5e-3 # [A], safe current leakage limit, above this limit S1h
 
 # output setting
 save_data =True
-pygame.init()
-pygame.display.set_mode((100,100))
-STOP = False
+save_text = True # the stlab .dat (appended step by step, read by the analysis scripts); the spectra also go to the memory-mapped store (prefix*.sweep)
+plot_steps = 500 # number of last steps shown in the 2D map
+control = RunControl(keys = {'s': 'slower', 'f': 'faster', 'e': 'stop', 'p': 'pause'}) # 's'/'f' double/halve the delay between the measurement steps
 monitor_ratio = 3 #shows 1 out of "monitor_ratio" spectrums
 
 font = {'family': 'serif',
@@ -102,28 +105,27 @@ dev = Cryocon_44C('TCPIP::192.168.1.4::5000::SOCKET', reset=True)
 # modulating the gate voltage
 count = 0 # couter of step numbers
 
-S21dB = np.array([],[])
-S21Ph = np.array([],[])
-Temp = np.array([])
-Time = np.array([])
+store_path = path if save_data else tempfile.mkdtemp()
+store = None # created with the frequency axis of the first spectrum
 
 t0 = time.time()
 t = 0
 temperature = 300
 tdelay = tdelay_measure
 
-while (not STOP):
+control.start()
+while control.wait_if_paused():
 
     tt = time.time()
     t=tt-t0
     temperature = dev.GetTemperature('B')
     print ('Temperature:', temperature)
     if  temperature > hight_T:
-        STOP = True
+        control.request('stop')
 
     if low_T < temperature < hight_T:
 
-        tdelay = tdelay_measure
+        tdelay = tdelay_measure*control.slowdown
         data = VNA.MeasureScreen_pd()
         if measure == 'OnePort':
             amp_data = np.array(data['S11dB (dB)'])
@@ -135,23 +137,13 @@ while (not STOP):
 
         data['Temperature (K)'] = temperature
 
-        Temp = np.append(Temp,temperature)
-        Time = np.append(Time,t)
-
         data['Time (s)'] = t
 
+        if store is None:
+            store = SweepStore(os.path.join(store_path, prefix+time.strftime('%Y_%m_%d_%H.%M.%S')+'.sweep'), axis=data['Frequency (Hz)'])
+        store.append(S_amp=amp_data, S_phase=phase_data, Temperature=temperature, Time=t)
 
-        if count == 0:
-
-            S_amp = amp_data
-            S_phase = phase_data
-
-
-        else:
-
-            S_amp = np.array(np.vstack((S_amp,amp_data)))
-            S_phase = np.array(np.vstack((S_phase,)))
-
+        if count > 0:
 
 
             plt.rcParams["figure.figsize"] = [16,9]
@@ -171,7 +163,7 @@ while (not STOP):
 
 
             plt.subplot(3, 1, 3)
-            plt.contourf(data['Frequency (Hz)'],Temp,S_amp)
+            plt.contourf(data['Frequency (Hz)'],store.read('Temperature', -plot_steps),store.read('S_amp', -plot_steps))
             plt.ylabel('T (K)')
             plt.xlabel('Frequency (GHz)')
 
@@ -182,7 +174,7 @@ while (not STOP):
         plt.pause(0.1)
 
 
-        if save_data:
+        if save_data and save_text:
 
             # temp = tempdev.GetTemperature()
             data['Power (dBm)'] = VNA.GetPower()
@@ -196,43 +188,32 @@ while (not STOP):
 
         count+=1
 
-        for event in pygame.event.get(): # stopping if 's' pressed
-            if event.type == QUIT: sys.exit()
-
-            if event.type == KEYDOWN and event.dict['key'] == 115: # corresponding to character "s" (slower measurement)
-                tdelay *= 2
-                print ('Delay between the meaurement steps raised to', tdelay)
-
-
-            if event.type == KEYDOWN and event.dict['key'] == 102: # corresponding to character "f" (faster measurement)
-                tdelay *= 0.5
-
-                print ('Delay between the meaurement steps lowered to', tdelay)
-
-            if event.type == KEYDOWN and event.dict['key'] == 101: # corresponding to character "e" (end measurement)
-                STOP = True
-
-    time.sleep(tdelay)
+    control.sleep(tdelay) # returns at once on 'e'
 
 
 
 
+control.close()
 print('FINISHED')
 
 #############################################################
 ''' output '''
 
-if save_data:
+if store is not None:
+    store.close()
+
+if save_data and store is not None:
 
-    plt.savefig(os.path.dirname(Data.name)+'\\'+prefix)
+    plt.savefig(os.path.join(store.path, prefix))
     plt.close()
 
-    plt.plot(Time,Temp)
+    plt.plot(store.read('Time'),store.read('Temperature'))
     plt.ylabel('Temperature (K)')
     plt.xlabel('Time (s)')
 
-    plt.savefig(os.path.dirname(Data.name)+'\\'+prefix+'_Temp')
-    Data.close()
+    plt.savefig(os.path.join(store.path, prefix+'_Temp'))
+    if save_text:
+        Data.close()
 
 
 if gate_voltage != 0:
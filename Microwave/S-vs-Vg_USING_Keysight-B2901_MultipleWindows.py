@@ -27,9 +27,11 @@ import stlab
 import stlabutils
 from gate_pattern import gate_pattern
 import matplotlib.pyplot as plt
-import pygame, sys
-from pygame.locals import *
+import sys
 from stlab.devices.Keysight_B2901A import Keysight_B2901A
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'Tools')) # shared helpers
+from live_view import LiveView
+from run_control import RunControl
 
 
 ###############################################################################################
@@ -62,9 +64,7 @@ averaging  = 1
 
 # output setting
 save_data =True
-pygame.init()
-pygame.display.set_mode((100,100))
-STOP = False
+control = RunControl(keys = {'s': 'stop', 'p': 'pause'}) # key window in a background thread
 temp = 12.3 # read it manually
 
 prefix = title+'_GateSweep'
@@ -117,8 +117,12 @@ gate_voltage_step = pattern['ramp_pattern'][1]-pattern['ramp_pattern'][0]
 ramp_time = np.abs(np.floor(gate_voltage_step/ramp_spead))
 
 
+control.start()
 for i in range(len(Frequency)-1):
 
+	if control.stopped:
+		break
+
 	start_freq = Frequency [i]
 	stop_freq = Frequency [i+1]
 	frequency = np.linspace (start_freq,stop_freq,freq_points)
@@ -129,11 +133,25 @@ for i in range(len(Frequency)-1):
 	count = 0 # couter of step numbers
 	leakage_current = 0
 
-	S21dB = np.array([],[])
-	S21Ph = np.array([],[])
-	gate = np.array([])
 	Leakage_current = np.array([])
 
+	# live view: one image and two lines, updated in place and blitted
+	fig = plt.figure(figsize = [16,9])
+	ax_amp = fig.add_subplot(3, 1, 1)
+	ax_amp.set_ylabel('S11dB (dB)')
+	ax_amp.set_title(title + ' Power: '+ str(power) + ' dBm')
+	ax_phase = fig.add_subplot(3, 1, 2)
+	ax_phase.set_ylabel('Phase (°)')
+	ax_map = fig.add_subplot(3, 1, 3)
+	ax_map.set_ylabel('$V_g$ (V)')
+	ax_map.set_title('S11dB (dB)', backgroundcolor = 'white')
+	ax_map.set_xlabel('Frequency (GHz)')
+	live = LiveView(fig)
+	amp_trace = live.trace(ax_amp, frequency)
+	phase_trace = live.trace(ax_phase, frequency)
+	amp_map = live.map(ax_map, frequency, pattern['ramp_pattern'])
+	plt.show(block = False)
+
 	t_in = time.time()
 	for count,gate_voltage in enumerate(pattern['ramp_pattern']): # ramping up the gate voltage
 
@@ -157,47 +175,13 @@ for i in range(len(Frequency)-1):
 			amp_data = np.array(data['S21dB (dB)'])
 			phase_data = np.array(data['S21Ph (rad)'])
 
-		if count == 0:
-
-			S_amp = amp_data
-			S_phase = phase_data
-
-		else:
-
-			S_amp = np.array(np.vstack((S_amp,amp_data)))
-			S_phase = np.array(np.vstack((S_phase,phase_data)))
-
-
-
-			plt.rcParams["figure.figsize"] = [16,9]
-
-			if (count-1)//monitor_ratio == (count-1)/monitor_ratio:
-				plt.subplot(3, 1, 1)
-				plt.plot(data['Frequency (Hz)']*1e-9,amp_data)
-				plt.ylabel('S11dB (dB)')
-				plt.xlim(np.min(data['Frequency (Hz)'])*1e-9,np.max(data['Frequency (Hz)'])*1e-9)
-				plt.title(title + ' Power: '+ str(power) + ' dBm')
-
-				plt.subplot(3, 1, 2)
-				plt.plot(data['Frequency (Hz)']*1e-9,phase_data*180/np.pi)
-				plt.ylabel('Phase (°)')
-				plt.xlim(np.min(data['Frequency (Hz)'])*1e-9,np.max(data['Frequency (Hz)'])*1e-9)
+		amp_map.add_row(count, amp_data) # only this row is copied into the image
 
+		if count//monitor_ratio == count/monitor_ratio:
+			amp_trace.set_data(amp_data)
+			phase_trace.set_data(phase_data*180/np.pi)
 
-			plt.subplot(3, 1, 3)
-			plt.contourf(data['Frequency (Hz)']*1e-9,pattern['ramp_pattern'][0:count+1],S_amp)
-			plt.ylabel('$V_g$ (V)')
-			plt.title('S11dB (dB)', backgroundcolor = 'white')
-			plt.xlabel('Frequency (GHz)')
-
-
-			# plt.subplot(4, 1, 4)
-			# plt.contourf(data['Frequency (Hz)']*1e-9,pattern['ramp_pattern'][0:count+1],S_phase*180/np.pi)
-			# plt.ylabel('$V_g$ (V)')
-			# plt.title('Phase (°)', backgroundcolor = 'white')
-
-
-		plt.pause(0.1)
+		live.draw() # at most max_fps frames per second, whatever the acquisition rate
 
 
 		if save_data:
@@ -213,13 +197,7 @@ for i in range(len(Frequency)-1):
 			stlab.savedict(Data, data)
 
 
-		for event in pygame.event.get(): # stopping if 's' pressed
-			if event.type == QUIT: sys.exit()
-
-			if event.type == KEYDOWN and event.dict['key'] == 115: # corresponding to character "s"
-				STOP = True
-
-		if STOP:
+		if not control.wait_if_paused(): # 's' pressed
 			break
 
 
@@ -234,6 +212,7 @@ for i in range(len(Frequency)-1):
 	gate_dev.RampVoltage(0,tt=ramp_time) # to safely return back the gate voltage
 
 
+	live.finish()
 	print('FINISHED')
 
 	#############################################################
@@ -253,24 +232,4 @@ for i in range(len(Frequency)-1):
 		plt.xlabel('gate (V)')
 		plt.savefig(os.path.dirname(Data.name)+'\\'+prefix+'leakage_current')
 
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
+control.close()
@@ -0,0 +1,205 @@
+''' This program uses KEYSIGHT FieldFox to find and follow the resonaces of a microwave cavity and B2961A to apply a gate voltage to a coupled graphene.
+Instead of scanning the whole frequency range in high resolution windows (see S-vs-Vg_USING_Keysight-B2901_MultipleWindows.py), one fast wide sweep finds the resonance dips,
+and at every gate voltage only narrow high resolution windows around them are measured, centered on the resonance frequency of the previous gate step.
+The program eventually plots the resonance frequencies as a function of the gate voltage.
+
+
+
+	Hardware to be used:
+		- KEYSIGHT FieldFox
+		- Keysight B2961A: For gating
+
+
+
+	Before runnign the programm:
+		- Make sure that room temperature amplifier is well wired: mounted on port 2 of the KEYSIGHT FieldFox and it is powered up with 15 V with Rigol
+		- wide_points should resolve the resonances: (Stop_Freq-Start_Freq)/wide_points below their linewidth
+
+	Wiring:
+		-	For the reflection measurements with the directional-coupler inside the fridge: Out put of the KEYSIGHT FieldFox (port 2) is connected to the side port "-20 dB" of the coupler, "output " port
+			eventually connected to the Port 2 on KEYSIGHT FieldFox (through the circulator and low-T amplifier) and "input" port to the resonator.
+
+'''
+
+
+import os
+import numpy as np
+import time
+import stlab
+import stlabutils
+from gate_pattern import gate_pattern
+import matplotlib.pyplot as plt
+import sys
+from stlab.devices.Keysight_B2901A import Keysight_B2901A
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'Tools')) # shared helpers
+from resonance_search import ResonanceSearch
+from live_view import LiveDisplay
+from run_control import RunControl
+from gate_ramp import GateRamp
+from dat_writer import DatWriter
+from adaptive_gate import AdaptiveGate
+
+
+###############################################################################################
+''' Definitions'''
+
+#definitions
+title = 'C26_UL'
+path = 'D:/measurement_data_4KDIY/Hadi/C26 2020-04-26 measurements/'
+
+gate_ramp_speed = 0.5 # the safe spead for ramping the gate voltage [V/s]
+gate_tau = 0.2 # time constant of the gate settling [s]
+target_gate = 30 #
+shift_voltage= 0 #in the case the intended gate pattern in not symmetrical around 0.
+gate_points = 60
+adaptive_gate = False # True: the gate points are chosen while measuring, a coarse pass then passes refining where the resonance adaptive_resonance shifts or bends the most
+adaptive_resonance = 0 # id of the followed resonance steering the adaptive gate points (0: the deepest of the first wide sweep)
+safe_gate_current = 5e-3 # [A], safe current leakage limit, above this limit S1h unit gives an error. With in this limit, the oxide resistance below 4MOhm at 10Vg (400KOhm at 1Vg)) to be considerred not leacky!
+
+Start_Freq = 3.5  # start grequency [GHz]
+Stop_Freq = 11 # stop frequency [GHz]
+wide_points = 10001 # points of the fast wide sweep looking for the resonances
+wide_ifbw = 1e3 # [Hz] IF bandwidth of the wide sweep
+zoom_points = 101 # points of each narrow sweep
+zoom_ifbw = 100. # [Hz] IF bandwidth of the narrow sweeps
+max_resonances = 3 # number of resonances followed (the deepest dips of the wide sweep)
+prominence = 3 # [dB] depth of a dip below the background to count as a resonance
+
+power = 0 #sweep power [dB] range: -45 to 3 dB
+measure = 'TwoPort' # 'OnePort' or 'TwoPort'
+
+
+
+# output setting
+save_data =True
+binary_data = True # the steps are written in binary (.dat.bin), the .dat text file once at the end (Tools/dat_writer.py)
+control = RunControl(keys = {'s': 'stop', 'p': 'pause'}) # key window in a background thread
+temp = 12.3 # read it manually
+
+prefix = title+'_GateSweep_ResonanceSearch'
+
+
+##########################################################
+''' Initializing the devices '''
+
+# Keysight setting
+gate_dev = Keysight_B2901A('TCPIP::192.168.1.63::INSTR')
+gate_dev.SetModeVoltage()
+gate_dev.SetComplianceCurrent(safe_gate_current)
+gate_dev.SetOutputOn()
+gate = GateRamp.b2901a(gate_dev, max_rate = gate_ramp_speed, resolution = 0.01, tau = gate_tau)
+
+
+# initializing the FieldFox
+VNA = stlab.adi(addr='TCPIP::192.168.1.230::INSTR',reset=False) # this is FieldFox
+VNA.SetPower(power)
+
+parameter = 'S11' if measure == 'OnePort' else 'S21'
+search = ResonanceSearch(VNA, Start_Freq*1e9, Stop_Freq*1e9, parameter = parameter,
+	wide_points = wide_points, wide_ifbw = wide_ifbw, zoom_points = zoom_points, zoom_ifbw = zoom_ifbw,
+	max_resonances = max_resonances, prominence = prominence)
+
+
+#############################################################
+''' measurements '''
+# generating gate pattern
+pattern = gate_pattern(target_gate=target_gate, mode='single', data_points=gate_points, shift_voltage= shift_voltage )
+if adaptive_gate: # as many points as the single pattern, all the passes in the same direction
+	sweep = AdaptiveGate(pattern['ramp_pattern'][0], pattern['ramp_pattern'][-1], points = len(pattern['ramp_pattern']))
+else:
+	sweep = pattern['ramp_pattern']
+
+gate.RampVoltage(pattern['ramp_pattern'][0])
+gate.Settle()
+
+found = search.Wide()
+print('resonances found at', np.round(found*1e-9, 4), 'GHz')
+if len(found) == 0:
+	print('no resonance deeper than', prominence, 'dB: lower prominence or increase wide_points')
+	sys.exit(0)
+
+# live view: one trace per resonance (by its id, the index in found), the frequency shift from the wide sweep vs the gate
+display = LiveDisplay(figsize = [16,9])
+for n, f0 in enumerate(found):
+	display.trace('f%d' % n, (len(found), 1, n+1), pattern['ramp_pattern'], style = {'marker': '.'}, ylabel = '$f_0$ - {:.4f} GHz (MHz)'.format(f0*1e-9))
+display.start()
+shifts = [[] for f0 in found] # (gate, shift) of every resonance, for the adaptive gate points
+
+Leakage_current = []
+Gate_voltage = []
+writer = None
+control.start()
+t_in = time.time()
+for count,gate_voltage in enumerate(sweep):
+
+	gate.RampVoltage(gate_voltage)
+	leakage_current = float(gate_dev.GetCurrent()) # in the units of [A]
+	Leakage_current.append(leakage_current)
+	Gate_voltage.append(gate_voltage)
+	gate.Settle()
+
+	points = search.points
+	results = search.Step()
+
+	for result in results:
+		n = result['id'] # the same resonance at every step, whichever is the deepest
+		if n < len(found) and result['found']:
+			if adaptive_gate: # the points measured so far, sorted by gate voltage
+				shifts[n].append((gate_voltage, (result['f0'] - found[n])*1e-6))
+				x, y = np.transpose(sorted(shifts[n]))
+				display.set_data('f%d' % n, y, x)
+			else:
+				display.set_point('f%d' % n, count, (result['f0'] - found[n])*1e-6)
+
+		if save_data:
+			data = result['data']
+			data['Gate Voltage (V)'] = gate_voltage
+			data['Leakage Current (A)'] = leakage_current
+			data['Temperature (K)'] = temp
+			data['Resonance ()'] = n
+			data['f0 (Hz)'] = result['f0']
+			data['Linewidth (Hz)'] = result['linewidth']
+			data['Depth (dB)'] = result['depth']
+
+			if writer is None:
+				Data = stlab.newfile(prefix,'_',data.keys(),autoindex = True, mypath= path)
+				writer = DatWriter(Data)
+			if binary_data:
+				writer.savedict(data)
+			else:
+				stlab.savedict(Data, data)
+
+	if adaptive_gate: # before the next gate point; NaN if the resonance was not found at this one
+		steering = [result['f0'] for result in results if result['id'] == adaptive_resonance and result['found']]
+		sweep.add(steering[0] if steering else np.nan)
+
+	if not control.wait_if_paused(): # 's' pressed
+		break
+
+	t = time.time()
+	print('measured gate steps:', count+1, ', VNA points in this step:', search.points - points)
+	time_passed = t - t_in
+	time_remain = (time_passed/(count+1))*(len(pattern['ramp_pattern'])-count-1)
+	print('ELAPSED TIME: {:.2f} min'.format(time_passed/60))
+	print('REMAINING TIME: {:.2f} min'.format(time_remain/60))
+
+
+gate.RampVoltage(0) # to safely return back the gate voltage
+control.close()
+print('FINISHED, {} VNA points in total, {} wide sweeps'.format(search.points, search.wide_sweeps))
+
+#############################################################
+''' output '''
+
+if save_data:
+
+	display.savefig(os.path.dirname(Data.name)+'\\'+prefix)
+	writer.close() # the .dat text file
+	Data.close()
+
+	plt.plot(Gate_voltage,Leakage_current, '.')
+	plt.ylabel('leakage current (nA)')
+	plt.xlabel('gate (V)')
+	plt.savefig(os.path.dirname(Data.name)+'\\'+prefix+'leakage_current')
+
+display.close()
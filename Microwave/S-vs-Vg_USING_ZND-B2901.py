@@ -26,10 +26,20 @@ import stlab
 import stlabutils
 from gate_pattern import gate_pattern
 import matplotlib.pyplot as plt
-import pygame, sys
-from pygame.locals import *
+import sys
 from stlab.devices.Keysight_B2901A import Keysight_B2901A
 from stlab.devices.RS_ZND import RS_ZND
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'Tools')) # shared helpers
+from vna_fetch import VNA_fetch
+from sweep_data import SweepBuffer
+from live_view import LiveDisplay
+from run_control import RunControl
+from step_scheduler import StepScheduler
+from gate_ramp import GateRamp
+from resonator_fit import ResonatorFitter, FIT_COLUMNS, fit_columns
+from dat_writer import DatWriter
+from step_timer import StepTimer
+from sweep_plan import SweepPlan, ETA
 
 
 ###############################################################################################
@@ -41,8 +51,10 @@ title = 'C26_LL_GateSweep_'
 path = 'F:\\measurement_data_triton\\Hadi\\C\\C26 2020-06-26 measurements'
 figures_path = path+'/All_Results'
 
-time_step = 1#20 #time step between each gate voltage steps, to stablize the gate
-ramp_spead = 10 # the safe spead for ramping the gate voltage [mV/s]
+gate_ramp_speed = 0.5 # the safe spead for ramping the gate voltage [V/s]
+gate_resolution = 0.01 # largest gate step of a single write [V]
+gate_tau = 0.2 # time constant of the gate settling [s]; the wait after each gate step follows from it (was a fixed time_step)
+gate_tolerance = 1e-3 # the gate is settled when within this error [V]
 min_gate = -15 #
 max_gate = 15
 gate_points = 500
@@ -59,6 +71,11 @@ power = -45 #sweep power [dB] range: -45 to 3 dB
 measure = 'TwoPort' # 'OnePort' or 'TwoPort'
 averaging  = 1
 
+fit_resonance = True # circle fit of every trace in a separate process: f0, kappa and Qi vs the gate, live and in a _fits file
+fit_kind = 'reflection' # 'reflection' (through the directional coupler) or 'notch' (side-coupled resonator)
+fit_span = None # [Hz] fit only this span around the deepest point (None: the whole trace)
+max_fit_residual = 0.05 # stop the sweep after 5 fits in a row above this residual, the resonance left the window (None: never stop)
+
 frequency_pattern = np.linspace(start_freq, stop_freq, freq_points)
 
 
@@ -66,9 +83,11 @@ frequency_pattern = np.linspace(start_freq, stop_freq, freq_points)
 
 # output setting
 save_data =True
-pygame.init()
-pygame.display.set_mode((100,100))
-STOP = False
+binary_data = True # the steps are written in binary (.dat.bin), the .dat text file once at the end (Tools/dat_writer.py)
+control = RunControl(keys = {'s': 'stop', 'p': 'pause'}) # key window in a background thread
+timing_log = True # time of the ramp, settle, sweep, transfer, fit, write and plot of every step in a _timing.jsonl file (Tools/step_timer.py)
+timer = StepTimer()
+time_slot = None # [h] fridge time available: stops before the sweep if its planned time is longer (None: no check)
 
 prefix = title+'_GateSweep'
 
@@ -94,6 +113,7 @@ gate_dev.SetOutputOn()
 
 # initializing the ZND
 VNA = RS_ZND('TCPIP::192.168.1.149::INSTR', reset=False)
+fetch = VNA_fetch(VNA, timer = timer) # binary trace transfer
 # VNA.SetSweepfrequency(start_freq, stop_freq, freq_points)
 # VNA.SetPower(power) #[db] minimum -30db
 # VNA.SetIFBW(1e3) #Set IF bandwidth in Hz
@@ -119,143 +139,163 @@ VNA = RS_ZND('TCPIP::192.168.1.149::INSTR', reset=False)
 # generating gate pattern
 gate_pattern = np.linspace(min_gate, max_gate,gate_points)
 # modulating the gate voltage
-ramp_time = np.abs(np.floor(gate_pattern[0]/ramp_spead))
-gate_dev.RampVoltage(gate_pattern[0],tt=10*ramp_time, steps = 100)
-gate_voltage_step = gate_pattern[1]-gate_pattern[0]
-ramp_time = np.abs(np.floor(gate_voltage_step/ramp_spead))
+gate = GateRamp.b2901a(gate_dev, max_rate = gate_ramp_speed, resolution = gate_resolution, tau = gate_tau, tolerance = gate_tolerance)
+gate.RampVoltage(gate_pattern[0])
+
+# planned time from the gate steps and the VNA sweep, refined by the measured times during the sweep (Tools/sweep_plan.py)
+plan = SweepPlan(len(gate_pattern))
+plan.gate(gate_pattern, gate)
+plan.vna(fetch.SweepTime(), points = len(fetch.GetFrequency()), averages = averaging, traces = len(fetch.GetTraces()))
+plan.report(time_slot)
+if time_slot is not None and not plan.fits(time_slot):
+	raise ValueError('Planned time longer than the time slot of %g h: %.1f h' % (time_slot, plan.total()/3600))
 
 
 count = 0 # couter of step numbers
 leakage_current = 0
 
-S21dB = np.array([],[])
-S21Ph = np.array([],[])
-gate = np.array([])
-Leakage_current = np.array([])
-
-t_in = time.time()
-for count,gate_voltage in enumerate(gate_pattern): # ramping up the gate voltage
-
-
-	gate_dev.RampVoltage(gate_voltage,tt=ramp_time, steps = 5)
-
-	leakage_current = float(gate_dev.GetCurrent()) # in the units of [A]
-	Leakage_current = np.append(Leakage_current,leakage_current)
-
-	# if np.abs(leakage_current) > safe_gate_current:
-	# 	GATE_LEAKAGE = True
-	# 	print ('gate current', leakage_current, ' nA exceeds safe gate current limit reaching the gate voltage of', gate_voltage, 'V.')
-	# 	print ('dielectric resitance is only', oxide_resistance, 'MOhms.')
-	# 	print ('reseting the gate voltage')
-	# 	dev.RampVoltage(DAC,0,tt=ramp_time)
-	# 	break
-	# print ('\n\n------------------------')
-
-
-	time.sleep(time_step)
-
-	for j in range(averaging):
-		data = VNA.MeasureScreen_pd()
-		for event in pygame.event.get(): # stopping if 's' pressed
-			if event.type == QUIT: sys.exit()
-			if event.type == KEYDOWN and event.dict['key'] == 115: # corresponding to character "s"
-				STOP = True
-				gate_dev.RampVoltage(0,tt=ramp_time) # to safely return back the gate voltage
-				break
-		if STOP:
+S_amp = SweepBuffer(steps = len(gate_pattern)) # (steps x frequency points), allocated on the first trace
+S_phase = SweepBuffer(steps = len(gate_pattern))
+Leakage_current = SweepBuffer(steps = len(gate_pattern))
+
+# live view, drawn by a separate process: the loop below never waits for matplotlib
+frequency = fetch.GetFrequency()*1e-9 # [GHz]
+display = LiveDisplay(figsize = [16,9])
+display.trace('amp', (4, 2, 1), frequency, ylabel = 'S11dB (dB)', title = title + ' Power: '+ str(power) + ' dBm')
+display.trace('phase', (4, 2, 3), frequency, ylabel = 'Phase (°)', xlabel = 'frequency (GHz)')
+display.map('S_amp', (4, 2, (2,6)), frequency, gate_pattern, vmin = -38, vmax = -22, ylabel = '$V_g$ (V)', title = 'S11dB (dB)', xlabel = 'Frequency (GHz)')
+if fit_resonance:
+	display.trace('f0', (4, 2, 5), gate_pattern, style = {'marker': '.'}, ylabel = '$f_0$ (GHz)')
+	display.trace('kappa', (4, 2, 7), gate_pattern, style = {'marker': '.'}, ylabel = '$\\kappa/2\\pi$ (MHz)', xlabel = '$V_g$ (V)')
+	display.trace('residual', (4, 2, 8), gate_pattern, style = {'marker': '.'}, ylabel = 'fit residual', xlabel = '$V_g$ (V)')
+display.start()
+
+fitter = ResonatorFitter(fit_kind, span = fit_span, max_residual = max_fit_residual)
+if fit_resonance:
+	fitter.start()
+
+def show_fits(fits):
+	''' Fits of the previous traces, as they come back from the fitter process '''
+	for index, fit in fits:
+		if 'error' in fit:
+			print('fit of gate step', index, 'failed:', fit['error'])
+		elif fit['problem']:
+			print('fit of gate step', index, 'implausible:', fit['problem'])
+		else:
+			display.set_point('f0', index, fit['f0']*1e-9)
+			display.set_point('kappa', index, fit['kappa']*1e-6)
+			display.set_point('residual', index, fit['residual'])
+		if save_data:
+			stlab.writeline(Fits, [gate_pattern[index]] + list(fit_columns(fit).values()))
+
+control.start()
+scheduler = StepScheduler()
+
+eta = ETA(plan, timer)
+written = None # file write of the previous step
+try:
+	for count,gate_voltage in enumerate(gate_pattern): # ramping up the gate voltage
+
+
+		# the leakage readout and the file write of the previous step overlap with the gate settling
+		ramp = scheduler.submit(gate_dev, timer.wrap('ramp', gate.RampVoltage), gate_voltage)
+		leakage = scheduler.submit(gate_dev, timer.wrap('acquire', gate_dev.GetCurrent)) # after the ramp: same instrument
+		settle = scheduler.submit(None, timer.wrap('settle', gate.Settle), after = [ramp]) # the leakage readout counts as settling time
+
+		# if np.abs(leakage_current) > safe_gate_current:
+		# 	GATE_LEAKAGE = True
+		# 	print ('gate current', leakage_current, ' nA exceeds safe gate current limit reaching the gate voltage of', gate_voltage, 'V.')
+		# 	print ('dielectric resitance is only', oxide_resistance, 'MOhms.')
+		# 	print ('reseting the gate voltage')
+		# 	dev.RampVoltage(DAC,0,tt=ramp_time)
+		# 	break
+		# print ('\n\n------------------------')
+
+
+		measured = scheduler.submit(VNA, fetch.Measure, after = [settle])
+		for j in range(1, averaging):
+			measured = scheduler.submit(VNA, fetch.Measure)
+
+		trace, leakage_current = scheduler.gather(measured, leakage)
+		leakage_current = float(leakage_current) # in the units of [A]
+		Leakage_current.append(leakage_current)
+
+		if measure == 'OnePort':
+			parameter = 'S11'
+		elif measure == 'TwoPort':
+			parameter = 'S21'
+		amp_data = trace.dB(parameter)
+		phase_data = trace.phase(parameter)
+		if fit_resonance:
+			with timer('fit'):
+				fitter.submit(count, trace.frequency, trace.S[parameter])
+
+		S_amp.append(amp_data)
+		S_phase.append(phase_data)
+
+		with timer('plot'):
+			display.add_row('S_amp', count, amp_data) # only this row goes to the display process
+
+			if count//monitor_ratio == count/monitor_ratio:
+				display.set_data('amp', amp_data)
+				display.set_data('phase', phase_data*180/np.pi)
+
+
+		if save_data:
+
+			with timer('write'):
+				data = trace.to_pd() # the full table is only built for saving
+			# temp = tempdev.GetTemperature()
+			data['Power (dBm)'] = VNA.GetPower()
+			data['Gate Voltage (V)'] = gate_voltage
+			data['Leakage Current (A)'] = leakage_current
+			data['Temperature (K)'] = temp
+
+			if count==0:
+				colnames = ['Vset (V)', 'Imeas (A)', 'R (Ohm)', 'Vgate (V)', 'T (K)', 'Ileakage (nA)']
+
+				Data = stlab.newfile(prefix,'_',colnames,autoindex = True, mypath= path)
+				writer = DatWriter(Data)
+				if timing_log:
+					timer.log_to(os.path.splitext(Data.name)[0] + '_timing.jsonl')
+				if fit_resonance:
+					Fits = stlab.newfile(prefix,'_fits',['Gate Voltage (V)'] + list(FIT_COLUMNS),autoindex = True, mypath= path)
+
+
+
+			if written is not None:
+				written.result() # raises a failed write of the previous step, the gate is ramped down in finally
+			if binary_data:
+				written = scheduler.submit(Data, timer.wrap('write', writer.savedict), data) # written while the next step runs
+			else:
+				written = scheduler.submit(Data, timer.wrap('write', stlab.savedict), Data, data)
+
+		if fit_resonance:
+			with timer('fit'):
+				show_fits(fitter.results()) # never waits for the fits
+			if fitter.drifted:
+				print('the last fits have a residual above', max_fit_residual, ': the resonance left the window, stopping')
+				control.request('stop')
+
+		timer.step(gate = gate_voltage)
+		if not control.wait_if_paused(): # 's' pressed
 			break
 
-	if measure == 'OnePort':
-		amp_data = np.array(data['S11dB (dB)'])
-		phase_data = np.array(data['S11Ph (rad)'])
-
-	elif measure == 'TwoPort':
-		amp_data = np.array(data['S21dB (dB)'])
-		phase_data = np.array(data['S21Ph (rad)'])
-
-	if count == 0:
-
-		S_amp = amp_data
-		S_phase = phase_data
-
-	else:
-
-		S_amp = np.array(np.vstack((S_amp,amp_data)))
-		S_phase = np.array(np.vstack((S_phase,phase_data)))
-
-
-
-		plt.rcParams["figure.figsize"] = [16,9]
-
-		if (count-1)//monitor_ratio == (count-1)/monitor_ratio:
-			plt.subplot(2, 2, 1)
-			plt.plot(data['Frequency (Hz)']*1e-9,amp_data)
-			plt.ylabel('S11dB (dB)')
-			plt.xlim(np.min(data['Frequency (Hz)'])*1e-9,np.max(data['Frequency (Hz)'])*1e-9)
-			plt.title(title + ' Power: '+ str(power) + ' dBm')
-
-			plt.subplot(2, 2, 3)
-			plt.plot(data['Frequency (Hz)']*1e-9,phase_data*180/np.pi)
-			plt.ylabel('Phase (°)')
-			plt.xlim(np.min(data['Frequency (Hz)'])*1e-9,np.max(data['Frequency (Hz)'])*1e-9)
-			plt.xlabel('frequency (GHz)')
-
-
-
-		plt.subplot(2, 2, (2,4))
-
-		if count > 0:
-			extent = [np.min(data['Frequency (Hz)'])*1e-9,np.max(data['Frequency (Hz)'])*1e-9, gate_pattern[0], gate_pattern[count]]
-			plt.imshow(S_amp, origin = 'lower', aspect='auto', extent=extent, cmap='seismic', vmin = -38, vmax = -22)
 
-		plt.ylabel('$V_g$ (V)')
-		plt.title('S11dB (dB)')
-		plt.xlabel('Frequency (GHz)')
+		print(eta.status())
 
 
-
-
-
-		# plt.subplot(4, 1, 4)
-		# plt.contourf(data['Frequency (Hz)']*1e-9,pattern['ramp_pattern'][0:count+1],S_phase*180/np.pi)
-		# plt.ylabel('$V_g$ (V)')
-		# plt.title('Phase (°)', backgroundcolor = 'white')
-
-
-	plt.pause(0.1)
-
-
-	if save_data:
-
-		# temp = tempdev.GetTemperature()
-		data['Power (dBm)'] = VNA.GetPower()
-		data['Gate Voltage (V)'] = gate_voltage
-		data['Leakage Current (A)'] = leakage_current
-		data['Temperature (K)'] = temp
-
-		if count==0:
-			colnames = ['Vset (V)', 'Imeas (A)', 'R (Ohm)', 'Vgate (V)', 'T (K)', 'Ileakage (nA)']
-
-			Data = stlab.newfile(prefix,'_',colnames,autoindex = True, mypath= path)
-
-
-
-		stlab.savedict(Data, data)
-
-
-	if STOP:
-		break
-
-
-	t = time.time()
-	print('measured gate steps:', count+1)
-	time_passed = t - t_in
-	time_remain = (time_passed/(count+1))*(len(gate_pattern)-count-1)
-	print('ELAPSED TIME: {:.2f} min'.format(time_passed/60))
-	print('REMAINING TIME: {:.2f} min'.format(time_remain/60))
-
-
-gate_dev.RampVoltage(0,tt=ramp_time) # to safely return back the gate voltage
+	scheduler.close() # pending file writes
+finally:
+	scheduler.shutdown() # after an error: the calls still queued end before the gate is touched
+	gate.RampVoltage(0) # to safely return back the gate voltage
+	control.close()
+if save_data:
+	writer.close() # the .dat text file, before metagen
+show_fits(fitter.close())
+fetch.Close()
+timer.report() # which phase took the time
+timer.close()
 stlab.metagen.fromarrays(Data,frequency_pattern,gate_pattern[0:count+1],xtitle='frequency (Hz)', ytitle='gate voltage (V)',ztitle='',colnames=colnames)
 
 print('FINISHED')
@@ -265,19 +305,17 @@ print('FINISHED')
 
 if save_data:
 
-	plt.savefig(os.path.dirname(Data.name)+'\\'+prefix)
+	display.savefig(os.path.dirname(Data.name)+'\\'+prefix)
 	# plt.savefig(figures_path+'\\'+str(start_freq)+'GHz.jpg')
 
 	Data.close()
-	plt.close()
+	if fit_resonance:
+		Fits.close()
 
 
-	plt.plot(gate_pattern[0:count+1],Leakage_current)
+	plt.plot(gate_pattern[0:count+1],Leakage_current.data)
 	plt.ylabel('leakage current (nA)')
 	plt.xlabel('gate (V)')
 	plt.savefig(os.path.dirname(Data.name)+'\\'+prefix+'leakage_current')
 
-
-
-
-
+display.close()
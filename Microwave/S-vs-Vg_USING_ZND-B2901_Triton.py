@@ -26,11 +26,14 @@ import stlab
 import stlabutils
 from gate_pattern import gate_pattern
 import matplotlib.pyplot as plt
-import pygame, sys
-from pygame.locals import *
+import sys
 from stlab.devices.Keysight_B2901A import Keysight_B2901A
 from stlab.devices.RS_ZND import RS_ZND
 from stlab.devices.TritonWrapper import TritonWrapper as tritonclass
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'Tools')) # shared helpers
+from step_scheduler import StepScheduler
+from run_control import RunControl
+from dat_writer import DatWriter
 
 
 
@@ -67,9 +70,8 @@ frequency_pattern = np.linspace(start_freq, stop_freq, freq_points)
 
 # output setting
 save_data =True
-pygame.init()
-pygame.display.set_mode((100,100))
-STOP = False
+binary_data = True # the steps are written in binary (.dat.bin), the .dat text file once at the end (Tools/dat_writer.py)
+control = RunControl(keys = {'s': 'stop', 'p': 'pause'}) # key window in a background thread
 
 prefix = title+'_GateSweep'
 
@@ -138,120 +140,125 @@ S21Ph = np.array([],[])
 gate = np.array([])
 Leakage_current = np.array([])
 
-t_in = time.time()
-for count,gate_voltage in enumerate(gate_pattern): # ramping up the gate voltage
-
-
-	gate_dev.RampVoltage(gate_voltage,tt=ramp_time, steps = 5)
+scheduler = StepScheduler()
+control.start()
 
-	leakage_current = float(gate_dev.GetCurrent()) # in the units of [A]
-	Leakage_current = np.append(Leakage_current,leakage_current)
-
-	time.sleep(time_step)
-	if count == 0:
-		time.sleep(10*time_step)
+t_in = time.time()
+written = None # file write of the previous step
+try:
+	for count,gate_voltage in enumerate(gate_pattern): # ramping up the gate voltage
 
 
-	for j in range(averaging):
-		data = VNA.MeasureScreen_pd()
-		for event in pygame.event.get(): # stopping if 's' pressed
-			if event.type == QUIT: sys.exit()
-			if event.type == KEYDOWN and event.dict['key'] == 115: # corresponding to character "s"
-				STOP = True
-				gate_dev.RampVoltage(0,tt=ramp_time) # to safely return back the gate voltage
-				break
-		if STOP:
-			break
+		# the leakage, temperature and file write of the previous step overlap with the gate ramp and settling
+		ramp = scheduler.submit(gate_dev, gate_dev.RampVoltage, gate_voltage, tt=ramp_time, steps = 5)
+		leakage = scheduler.submit(gate_dev, gate_dev.GetCurrent) # after the ramp: same instrument
+		settle = scheduler.submit(None, time.sleep, 11*time_step if count == 0 else time_step, after = [ramp])
+		if save_data:
+			temperature = scheduler.submit(mytriton, mytriton.gettemperature, 8)
 
-	if measure == 'OnePort':
-		amp_data = np.array(data['S11dB (dB)'])
-		phase_data = np.array(data['S11Ph (rad)'])
+		measured = scheduler.submit(VNA, VNA.MeasureScreen_pd, after = [settle])
+		for j in range(1, averaging):
+			measured = scheduler.submit(VNA, VNA.MeasureScreen_pd)
 
-	elif measure == 'TwoPort':
-		amp_data = np.array(data['S21dB (dB)'])
-		phase_data = np.array(data['S21Ph (rad)'])
+		data, leakage_current = scheduler.gather(measured, leakage)
+		leakage_current = float(leakage_current) # in the units of [A]
+		Leakage_current = np.append(Leakage_current,leakage_current)
 
-	if count == 0:
+		if measure == 'OnePort':
+			amp_data = np.array(data['S11dB (dB)'])
+			phase_data = np.array(data['S11Ph (rad)'])
 
-		S_amp = amp_data
-		S_phase = phase_data
+		elif measure == 'TwoPort':
+			amp_data = np.array(data['S21dB (dB)'])
+			phase_data = np.array(data['S21Ph (rad)'])
 
-	else:
+		if count == 0:
 
-		S_amp = np.array(np.vstack((S_amp,amp_data)))
-		S_phase = np.array(np.vstack((S_phase,phase_data)))
+			S_amp = amp_data
+			S_phase = phase_data
 
+		else:
 
+			S_amp = np.array(np.vstack((S_amp,amp_data)))
+			S_phase = np.array(np.vstack((S_phase,phase_data)))
 
-		plt.rcParams["figure.figsize"] = [16,9]
 
-		if (count-1)//monitor_ratio == (count-1)/monitor_ratio:
-			plt.subplot(2, 2, 1)
-			plt.plot(data['Frequency (Hz)']*1e-9,amp_data)
-			plt.ylabel('S11dB (dB)')
-			plt.xlim(np.min(data['Frequency (Hz)'])*1e-9,np.max(data['Frequency (Hz)'])*1e-9)
-			plt.title(title + ' Power: '+ str(power) + ' dBm')
 
-			plt.subplot(2, 2, 3)
-			plt.plot(data['Frequency (Hz)']*1e-9,phase_data*180/np.pi)
-			plt.ylabel('Phase (°)')
-			plt.xlim(np.min(data['Frequency (Hz)'])*1e-9,np.max(data['Frequency (Hz)'])*1e-9)
-			plt.xlabel('frequency (GHz)')
+			plt.rcParams["figure.figsize"] = [16,9]
 
+			if (count-1)//monitor_ratio == (count-1)/monitor_ratio:
+				plt.subplot(2, 2, 1)
+				plt.plot(data['Frequency (Hz)']*1e-9,amp_data)
+				plt.ylabel('S11dB (dB)')
+				plt.xlim(np.min(data['Frequency (Hz)'])*1e-9,np.max(data['Frequency (Hz)'])*1e-9)
+				plt.title(title + ' Power: '+ str(power) + ' dBm')
 
+				plt.subplot(2, 2, 3)
+				plt.plot(data['Frequency (Hz)']*1e-9,phase_data*180/np.pi)
+				plt.ylabel('Phase (°)')
+				plt.xlim(np.min(data['Frequency (Hz)'])*1e-9,np.max(data['Frequency (Hz)'])*1e-9)
+				plt.xlabel('frequency (GHz)')
 
-		plt.subplot(2, 2, (2,4))
 
-		if count > 0:
-			extent = [np.min(data['Frequency (Hz)'])*1e-9,np.max(data['Frequency (Hz)'])*1e-9, gate_pattern[0], gate_pattern[count]]
-			plt.imshow(S_amp, origin = 'lower', aspect='auto', extent=extent, cmap='seismic', vmin = -38, vmax = -22)
 
-		plt.ylabel('$V_g$ (V)')
-		plt.title('S11dB (dB)')
-		plt.xlabel('Frequency (GHz)')
+			plt.subplot(2, 2, (2,4))
 
+			if count > 0:
+				extent = [np.min(data['Frequency (Hz)'])*1e-9,np.max(data['Frequency (Hz)'])*1e-9, gate_pattern[0], gate_pattern[count]]
+				plt.imshow(S_amp, origin = 'lower', aspect='auto', extent=extent, cmap='seismic', vmin = -38, vmax = -22)
 
-	plt.pause(0.1)
+			plt.ylabel('$V_g$ (V)')
+			plt.title('S11dB (dB)')
+			plt.xlabel('Frequency (GHz)')
 
 
+		plt.pause(0.1)
 
-	if save_data:
 
-	    temp = np.mean(mytriton.gettemperature(8))
-	    data['Power (dBm)'] = VNA.GetPower()
-	    data['Gate Voltage (V)'] = gate_voltage
-	    data['Leakage Current (A)'] = leakage_current
-	    data['Temperature (K)'] = temp
 
-	    if count==0:
-	        Data = stlab.newfile(prefix,'_',data.keys(),autoindex = True, mypath= path)
-	        # stlab.metagen.fromarrays(Data,measure_frequency,-gate_pattern,[],xtitle='frequency (Hz)', ytitle='gate voltage (V)')
-	        # stlab.metagen.fromlimits(Data,freq_points,start_freq,stop_freq,gate_points,min_gate,max_gate,Nz=None,zmin=None,zmax=None,xtitle='frequency (Hz)', ytitle='gate voltage (V)',ztitle='',colnames=None)
+		if save_data:
 
+		    temp = np.mean(temperature.result())
+		    data['Power (dBm)'] = VNA.GetPower()
+		    data['Gate Voltage (V)'] = gate_voltage
+		    data['Leakage Current (A)'] = leakage_current
+		    data['Temperature (K)'] = temp
 
-	    stlab.savedict(Data, data)
+		    if count==0:
+		        Data = stlab.newfile(prefix,'_',data.keys(),autoindex = True, mypath= path)
+		        writer = DatWriter(Data)
+		        # stlab.metagen.fromarrays(Data,measure_frequency,-gate_pattern,[],xtitle='frequency (Hz)', ytitle='gate voltage (V)')
+		        # stlab.metagen.fromlimits(Data,freq_points,start_freq,stop_freq,gate_points,min_gate,max_gate,Nz=None,zmin=None,zmax=None,xtitle='frequency (Hz)', ytitle='gate voltage (V)',ztitle='',colnames=None)
 
 
-	for event in pygame.event.get(): # stopping if 's' pressed
-	    if event.type == QUIT: sys.exit()
+		    if written is not None:
+		        written.result() # raises a failed write of the previous step, the gate is ramped down in finally
+		    if binary_data:
+		        written = scheduler.submit(Data, writer.savedict, data) # written while the next step runs
+		    else:
+		        written = scheduler.submit(Data, stlab.savedict, Data, data)
 
-	    if event.type == KEYDOWN and event.dict['key'] == 115: # corresponding to character "s"
-	        STOP = True
 
-	if STOP:
-	    break
+		if not control.wait_if_paused(): # 's' pressed
+		    break
 
 
 
-	t = time.time()
-	print('measured gate steps:', count+1)
-	time_passed = t - t_in
-	time_remain = (time_passed/(count+1))*(len(gate_pattern)-count-1)
-	print('ELAPSED TIME: {:.2f} min'.format(time_passed/60))
-	print('REMAINING TIME: {:.2f} min'.format(time_remain/60))
+		t = time.time()
+		print('measured gate steps:', count+1)
+		time_passed = t - t_in
+		time_remain = (time_passed/(count+1))*(len(gate_pattern)-count-1)
+		print('ELAPSED TIME: {:.2f} min'.format(time_passed/60))
+		print('REMAINING TIME: {:.2f} min'.format(time_remain/60))
 
 
-gate_dev.RampVoltage(0,tt=ramp_time) # to safely return back the gate voltage
+	scheduler.close() # pending file writes
+finally:
+	scheduler.shutdown() # after an error: the calls still queued end before the gate is touched
+	gate_dev.RampVoltage(0,tt=ramp_time) # to safely return back the gate voltage
+	control.close()
+if save_data:
+	writer.close() # the .dat text file, before metagen
 colnames = ['Frequency (Hz)', 'S21re ()', 'S21im ()', 'S21dB (dB)', 'S21Ph (rad)', 'Power (dBm)', 'Gate Voltage (V)', 'Leakage Current (A)', 'Temperature (K)']
 stlab.metagen.fromarrays(Data,frequency_pattern,gate_pattern[0:count+1],xtitle='frequency (Hz)', ytitle='gate voltage (V)',ztitle='',colnames=colnames)
 
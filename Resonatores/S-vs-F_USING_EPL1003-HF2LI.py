@@ -32,6 +32,9 @@ import stlab
 import stlabutils
 
 from stlab.devices.RS_ZND import RS_ZND
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'Tools')) # shared helpers
+from vna_fetch import VNA_fetch
+from live_view import LiveDisplay
 
 
 
@@ -94,6 +97,7 @@ SetRemote(gate_dev)
 
 # initializing the ZND
 VNA = RS_ZND('TCPIP::192.168.10.151::INSTR', reset=False)
+fetch = VNA_fetch(VNA) # binary trace transfer
 # VNA.SetSweepfrequency(start_freq, stop_freq, freq_points)
 # VNA.SetPower(power) #[db] minimum -30db
 # VNA.SetIFBW(1e3) #Set IF bandwidth in Hz
@@ -122,9 +126,12 @@ TurnOn(gate_dev)
 RampVoltage(gate_dev, start_gate,tt=ramp_time, steps = 100)
 print('gate set')
 
-S_amp_Watt = np.array([],[])
-S_phase = np.array([],[])
-time_array = np.array([])
+if show_figure:
+    frequency = fetch.GetFrequency()*1e-6 # [MHz]
+    display = LiveDisplay(figsize = [12,7])
+    display.trace('amp', (2, 2, (1,3)), frequency, ylabel = 'S11 (uW)', xlabel = 'Frequency (MHz)', title = title)
+    display.map('S_amp', (2, 2, (2,4)), frequency, gate_pattern, ylabel = 'Gate Voltage (V)', title = 'S11 (uW)', xlabel = 'Frequency (MHz)')
+    display.start()
 
 
 STOP = False
@@ -145,59 +152,21 @@ for count, gate_voltage in enumerate(gate_pattern):
         print('gate voltage {:.2f} set'.format(gate_voltage))
 
         # VNA.MeasureScreen_pd()
-        data = VNA.MeasureScreen_pd() #for parametric measurement we need to measure twice. 
-        amp_data = np.array(data['S21dB (dB)'])
-        amp_data_Watt = 10**(amp_data/20)*1e6
-        phase_data = np.array(data['S21Ph (rad)'])
+        trace = fetch.Measure() #for parametric measurement we need to measure twice. 
+        amp_data_Watt = np.abs(trace.S['S21'])*1e6
 
         t = time.time() - t_in
 
 
-        if count == 0:
-
-            S_amp_Watt = amp_data_Watt
-            S_phase = phase_data
-            time_array = t
-
-        else:
-
-            S_amp_Watt = np.array(np.vstack((S_amp_Watt,amp_data_Watt)))
-            S_phase = np.array(np.vstack((S_phase,phase_data)))
-            time_array = np.append(time_array,t)
-
-
-            plt.rcParams["figure.figsize"] = [12,7]
-
-            if (count-1)//monitor_ratio == (count-1)/monitor_ratio:
-                plt.subplot(2, 2, (1,3))
-                plt.plot(data['Frequency (Hz)']*1e-6,amp_data_Watt)
-                plt.ylabel('S11 (uW)')
-                plt.xlabel('Frequency (MHz)')
-                plt.xlim(np.min(data['Frequency (Hz)'])*1e-6,np.max(data['Frequency (Hz)'])*1e-6)
-                plt.title(title + ' Power: '+ str(power) + ' dBm')
-
-
-
-            plt.subplot(2, 2, (2,4))
-
-            if count > 0:
-                extent = [np.min(data['Frequency (Hz)'])*1e-6,np.max(data['Frequency (Hz)'])*1e-6, gate_pattern[0], gate_pattern[count]]
-                plt.imshow(S_amp_Watt, origin = 'lower', aspect='auto', extent=extent, cmap='seismic', vmin = np.min(np.min(S_amp_Watt)), vmax = np.max(np.max(S_amp_Watt)))
-
-
-
-            plt.ylabel('Gate Voltage (V)')
-            plt.title('S11 (uW)')
-            plt.xlabel('Frequency (MHz)')
-
-
-
         if show_figure:
-            plt.pause(0.5)
+            display.add_row('S_amp', count, amp_data_Watt) # drawn by the display process, no plt.pause here
+            if count//monitor_ratio == count/monitor_ratio:
+                display.set_data('amp', amp_data_Watt)
 
 
         if save_data:
 
+            data = trace.to_pd() # the full table is only built for saving
             data['Power (dBm)'] = VNA.GetPower()
             data['Time (s)'] = t
             data['Gate Voltage (V)'] = gate_voltage
@@ -230,6 +199,7 @@ for count, gate_voltage in enumerate(gate_pattern):
 
 
 
+fetch.Close()
 stlab.metagen.fromarrays(Data,frequency_pattern,gate_pattern[0:count+1],xtitle='frequency (MHz)', ytitle='gate voltage (V)',ztitle='',colnames=colnames)
 
 
@@ -241,9 +211,12 @@ stlab.metagen.fromarrays(Data,frequency_pattern,gate_pattern[0:count+1],xtitle='
 if save_data:
 
 
-    plt.savefig(os.path.dirname(Data.name)+'\\'+prefix)
+    if show_figure:
+        display.savefig(os.path.dirname(Data.name)+'\\'+prefix)
     Data.close()
-    plt.close()
+
+if show_figure:
+    display.close()
 
 #############################################################
 ''' finishing '''
@@ -19,11 +19,13 @@ import os
 import numpy as np
 import time
 import matplotlib.pyplot as plt
-import pygame, sys
-from pygame.locals import *
+import sys
 import stlab
 import stlabutils
 from stlab.devices.RS_ZND import RS_ZND
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'Tools')) # shared helpers
+from sweep_data import SweepBuffer
+from run_control import RunControl
 
 
 
@@ -55,9 +57,7 @@ power_pattern = np.linspace(start_power,stop_power, power_points)
 
 # output setting
 save_data =True
-pygame.init()
-pygame.display.set_mode((100,100))
-STOP = False
+control = RunControl(keys = {'s': 'stop', 'p': 'pause'}) # key window in a background thread
 
 prefix = title+'_PowerSweep'
 
@@ -84,18 +84,18 @@ VNA.SetIFBW(IF_bandwidth) #Set IF bandwidth in Hz
 ''' measurements '''
 # amping to the target  gate
 
-S_amp_Watt = np.array([],[])
-S_phase = np.array([],[])
+S_amp_Watt = SweepBuffer(freq_points, power_points) # preallocated (power steps x frequency points)
+S_phase = SweepBuffer(freq_points, power_points)
 
-STOP = False
-            
+control.start()
 
 t_in = time.time()
 
 
 count = 0
 for count, power in enumerate(power_pattern):
-    if STOP:
+    if not control.wait_if_paused(): # stop requested while paused
+        count -= 1
         break
     VNA.SetPower(power) #[db] minimum -30db
 
@@ -107,15 +107,10 @@ for count, power in enumerate(power_pattern):
     t = time.time() - t_in
 
 
-    if count == 0:
+    S_amp_Watt.append(amp_data_Watt)
+    S_phase.append(phase_data)
 
-        S_amp_Watt = amp_data_Watt
-        S_phase = phase_data
-
-    else:
-
-        S_amp_Watt = np.array(np.vstack((S_amp_Watt,amp_data_Watt)))
-        S_phase = np.array(np.vstack((S_phase,phase_data)))
+    if count > 0:
 
 
         plt.rcParams["figure.figsize"] = [16,9]
@@ -133,7 +128,7 @@ for count, power in enumerate(power_pattern):
 
         if count > 0:
             extent = [np.min(data['Frequency (Hz)'])*1e-6,np.max(data['Frequency (Hz)'])*1e-6, power_pattern[0], power_pattern[count]]
-            plt.imshow(S_amp_Watt, origin = 'lower', aspect='auto', extent=extent, cmap='seismic', vmin = np.min(np.min(S_amp_Watt)), vmax = np.max(np.max(S_amp_Watt)))
+            plt.imshow(S_amp_Watt.data, origin = 'lower', aspect='auto', extent=extent, cmap='seismic', vmin = np.min(S_amp_Watt.data), vmax = np.max(S_amp_Watt.data))
 
 
 
@@ -163,17 +158,11 @@ for count, power in enumerate(power_pattern):
 
 
 
-    for cnt in range(1000):
-        for event in pygame.event.get(): # stopping if 's' pressed
-            if event.type == KEYDOWN and event.dict['key'] == 115: # corresponding to character "s"
-                STOP = True
-                print('--------------------------------')
-                print('s detected')
-                print('--------------------------------')
-                break
-
+    if control.stopped:
+        break
 
 
+control.close()
 stlab.metagen.fromarrays(Data,frequency_pattern,power_pattern[0:count+1],xtitle='frequency (MHz)', ytitle='Power (dBm)',ztitle='',colnames=colnames)
 
 
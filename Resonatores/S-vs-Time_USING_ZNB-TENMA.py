@@ -24,12 +24,14 @@ import numpy as np
 import time
 
 import matplotlib.pyplot as plt
-import pygame, sys
-from pygame.locals import *
+import sys
 import stlab
 import stlabutils
 
 from stlab.devices.RS_ZND import RS_ZND
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'Tools')) # shared helpers
+from sweep_data import SweepBuffer
+from run_control import RunControl
 
 # Functions NOTE: ideally this functions has to be intergrated into a TENMA class; but I did not manage to do that yet. so I put them here. 
 def numtostr(mystr):
@@ -106,9 +108,7 @@ frequency_pattern = np.linspace(start_freq, stop_freq, freq_points)
 
 # output setting
 save_data =True
-pygame.init()
-pygame.display.set_mode((100,100))
-STOP = False
+control = RunControl(keys = {'s': 'stop', 'p': 'pause'}) # key window in a background thread
 
 prefix = title+'_GateSweep'
 
@@ -165,25 +165,22 @@ TurnOn(gate_dev)
 RampVoltage(gate_dev, start_gate,tt=ramp_time, steps = 100)
 print('gate set')
 
-S_amp = np.array([],[])
-S_phase = np.array([],[])
-time_array = np.array([])
+S_amp = SweepBuffer() # open-ended run: grows by doubling
+S_phase = SweepBuffer()
+time_array = SweepBuffer()
 
 
-STOP = True
+control.start()
+control.request('pause')
+print ('press "p" when reasy to start')
+control.wait_if_paused()
 
-print ('press "s" when reasy to start')
-while STOP:
-    for event in pygame.event.get(): # stopping if 's' pressed
-        if event.type == KEYDOWN and event.dict['key'] == 115: # corresponding to character "s"
-            STOP = False
-            
 
 t_in = time.time()
 
 
 count = 0
-while STOP == False:
+while control.wait_if_paused():
     SetVoltage(gate_dev, stop_gate)
 
     data = VNA.MeasureScreen_pd()
@@ -193,17 +190,11 @@ while STOP == False:
     t = time.time() - t_in
 
 
-    if count == 0:
+    S_amp.append(amp_data)
+    S_phase.append(phase_data)
+    time_array.append(t)
 
-        S_amp = amp_data
-        S_phase = phase_data
-        time_array = t
-
-    else:
-
-        S_amp = np.array(np.vstack((S_amp,amp_data)))
-        S_phase = np.array(np.vstack((S_phase,phase_data)))
-        time_array = np.append(time_array,t)
+    if count > 0:
 
 
         plt.rcParams["figure.figsize"] = [16,9]
@@ -227,7 +218,7 @@ while STOP == False:
 
         if count > 0:
             extent = [np.min(data['Frequency (Hz)'])*1e-6,np.max(data['Frequency (Hz)'])*1e-6, 0, t]
-            plt.imshow(S_amp, origin = 'lower', aspect='auto', extent=extent, cmap='seismic', vmin = -38, vmax = -22)
+            plt.imshow(S_amp.data, origin = 'lower', aspect='auto', extent=extent, cmap='seismic', vmin = -38, vmax = -22)
 
 
 
@@ -258,29 +249,12 @@ while STOP == False:
 
     count = count+1
 
-    # for cnt in range(20):
-    #     for event in pygame.event.get(): # stopping if 's' pressed
-    #         if event.type == KEYDOWN and event.dict['key'] == 115: # corresponding to character "s"
-    #             break
-    #             STOP == True
-    #             print('--------------------------------')
-    #             print('s detected')
-    #             print('--------------------------------')
-
-    # while not STOP:
-    for cnt in range(1000):
-        for event in pygame.event.get(): # stopping if 's' pressed
-            if event.type == KEYDOWN and event.dict['key'] == 115: # corresponding to character "s"
-                STOP = True
-                RampVoltage(gate_dev,0,tt=ramp_time) # to safely return back the gate voltage
-                break
-                print('--------------------------------')
-                print('s detected')
-                print('--------------------------------')
-
-
-
-stlab.metagen.fromarrays(Data,frequency_pattern,time_array,xtitle='frequency (Hz)', ytitle='gate voltage (V)',ztitle='',colnames=colnames)
+    if control.stopped:
+        RampVoltage(gate_dev,0,tt=ramp_time) # to safely return back the gate voltage
+
+control.close()
+
+stlab.metagen.fromarrays(Data,frequency_pattern,time_array.data,xtitle='frequency (Hz)', ytitle='gate voltage (V)',ztitle='',colnames=colnames)
 
 print('FINISHED')
 
@@ -14,13 +14,16 @@ import pyvisa
 import os
 import numpy as np
 import time
+import tempfile
 import matplotlib.pyplot as plt
-import pygame, sys
-from pygame.locals import *
+import sys
 import stlab
 import stlabutils
 
 from stlab.devices.RS_ZND import RS_ZND
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'Tools')) # shared helpers
+from sweep_data import SweepStore
+from run_control import RunControl
 
 # Functions NOTE: ideally this functions has to be intergrated into a TENMA class; but I did not manage to do that yet. so I put them here. 
 def numtostr(mystr):
@@ -97,9 +100,9 @@ frequency_pattern = np.linspace(start_freq, stop_freq, freq_points)
 
 # output setting
 save_data =True
-pygame.init()
-pygame.display.set_mode((100,100))
-STOP = False
+save_text = True # the stlab .dat (appended step by step, read by the analysis scripts); the spectra also go to the memory-mapped store (prefix*.sweep)
+plot_steps = 500 # number of last steps shown in the 2D map
+control = RunControl(keys = {'s': 'stop', 'p': 'pause'}) # key window in a background thread
 
 prefix = title+'_reproducibility'
 
@@ -110,7 +113,10 @@ font = {'family': 'serif',
         }
 
 colnames = ['Frequency (Hz)', 'S21re ()', 'S21im ()', 'S21dB (dB)', 'S21Ph (rad)', 'Power (dBm)', 'Time (s)', 'S21 (uW)']
-Data = stlab.newfile(prefix,'_',colnames,autoindex = True, mypath= path)
+if save_text:
+    Data = stlab.newfile(prefix,'_',colnames,autoindex = True, mypath= path)
+store_path = path if save_data else tempfile.mkdtemp()
+store = SweepStore(os.path.join(store_path, prefix+time.strftime('%Y_%m_%d_%H.%M.%S')+'.sweep'), axis=frequency_pattern)
 
 ##########################################################
 ''' Initializing the devices '''
@@ -140,22 +146,18 @@ VNA = RS_ZND('TCPIP::192.168.10.151::INSTR', reset=False)
 #############################################################
 ''' measurements '''
 
-S_amp_Watt = np.array([],[])
-S_phase = np.array([],[])
-time_array = np.array([])
 
 
-STOP = False
-            
+control.start()
 
 t_in = time.time()
 
 
 
 count = 0
-# while not STOP:
+# while not control.stopped:
 while count < 12:
-    if STOP:
+    if not control.wait_if_paused(): # stop requested
         break
     try:
 
@@ -168,17 +170,9 @@ while count < 12:
         t = time.time() - t_in
 
 
-        if count == 0:
+        store.append(S_amp_Watt=amp_data_Watt, S_phase=phase_data, Time=t)
 
-            S_amp_Watt = amp_data_Watt
-            S_phase = phase_data
-            time_array = t
-
-        else:
-
-            S_amp_Watt = np.array(np.vstack((S_amp_Watt,amp_data_Watt)))
-            S_phase = np.array(np.vstack((S_phase,phase_data)))
-            time_array = np.append(time_array,t)
+        if count > 0:
 
 
             plt.rcParams["figure.figsize"] = [16,9]
@@ -195,8 +189,9 @@ while count < 12:
             plt.subplot(2, 2, (2,4))
 
             if count > 0:
-                extent = [np.min(data['Frequency (Hz)'])*1e-6,np.max(data['Frequency (Hz)'])*1e-6, 0, count]
-                plt.imshow(S_amp_Watt, origin = 'lower', aspect='auto', extent=extent, cmap='seismic', vmin = np.min(np.min(S_amp_Watt)), vmax = np.max(np.max(S_amp_Watt)))
+                S_amp_Watt = store.read('S_amp_Watt', -plot_steps)
+                extent = [np.min(data['Frequency (Hz)'])*1e-6,np.max(data['Frequency (Hz)'])*1e-6, count+1-len(S_amp_Watt), count]
+                plt.imshow(S_amp_Watt, origin = 'lower', aspect='auto', extent=extent, cmap='seismic', vmin = np.min(S_amp_Watt), vmax = np.max(S_amp_Watt))
 
 
 
@@ -210,7 +205,7 @@ while count < 12:
             plt.pause(0.5)
 
 
-        if save_data:
+        if save_data and save_text:
 
             data['Power (dBm)'] = VNA.GetPower()
             data['Time (s)'] = t
@@ -225,15 +220,6 @@ while count < 12:
 
 
 
-        for cnt in range(1000):
-            for event in pygame.event.get(): # stopping if 's' pressed
-                if event.type == KEYDOWN and event.dict['key'] == 115: # corresponding to character "s"
-                    STOP = True
-                    break
-                    print('--------------------------------')
-                    print('s detected')
-                    print('--------------------------------')
-
         count = count+1
     except:
         print ('############STOP#################')
@@ -243,7 +229,10 @@ while count < 12:
 
 
 
-stlab.metagen.fromarrays(Data,frequency_pattern,time_array[0:count+1],xtitle='frequency (MHz)', ytitle='time (s)',ztitle='',colnames=colnames)
+control.close()
+store.close()
+if save_text:
+    stlab.metagen.fromarrays(Data,frequency_pattern,store.read('Time'),xtitle='frequency (MHz)', ytitle='time (s)',ztitle='',colnames=colnames)
 
 
 
@@ -254,8 +243,9 @@ stlab.metagen.fromarrays(Data,frequency_pattern,time_array[0:count+1],xtitle='fr
 if save_data:
 
 
-    plt.savefig(os.path.dirname(Data.name)+'\\'+prefix)
-    Data.close()
+    plt.savefig(os.path.join(store.path, prefix))
+    if save_text:
+        Data.close()
     plt.close()
 
 #############################################################
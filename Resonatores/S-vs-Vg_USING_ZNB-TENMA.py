@@ -33,6 +33,8 @@ from TENMA import TENMA
 
 
 from stlab.devices.RS_ZND import RS_ZND
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'Tools')) # shared helpers
+from resonator_fit import ResonatorFitter, FIT_COLUMNS, fit_columns
 
 # Functions NOTE: ideally this functions has to be intergrated into a TENMA class; but I did not manage to do that yet. so I put them here. 
 def numtostr(mystr):
@@ -74,6 +76,21 @@ def TurnOff(gate_device):
 def Close(gate_device):
     gate_device.close()
 
+def show_fits(fits): # fits of the previous traces, as they come back from the fitter process
+    for index, fit in fits:
+        if 'error' in fit:
+            print('fit of gate step', index, 'failed:', fit['error'])
+            continue
+        if fit['problem']:
+            print('fit of gate step', index, 'implausible:', fit['problem'])
+            continue
+        fit_gate.append(gate_pattern[index])
+        fit_f0.append(fit['f0'])
+        fit_kappa.append(fit['kappa'])
+        fit_residual.append(fit['residual'])
+        if save_data:
+            stlab.writeline(Fits, [gate_pattern[index]] + list(fit_columns(fit).values()))
+
 ###############################################################################################
 ''' Definitions'''
 
@@ -100,6 +117,11 @@ power = -45 #sweep power [dB] range: -45 to 3 dB
 measure = 'TwoPort' # 'OnePort' or 'TwoPort'
 averaging  = 1
 
+fit_resonance = True # circle fit of every trace in a separate process: f0, kappa and Qi vs the gate, plotted and in a _fits file
+fit_kind = 'reflection' # 'reflection' (through the directional coupler) or 'notch' (side-coupled resonator)
+fit_span = None # [Hz] fit only this span around the deepest point (None: the whole trace)
+max_fit_residual = 0.05 # stop the sweep after 5 fits in a row above this residual, the resonance left the window (None: never stop)
+
 frequency_pattern = np.linspace(start_freq, stop_freq, freq_points)
 
 
@@ -176,6 +198,11 @@ S21dB = np.array([],[])
 S21Ph = np.array([],[])
 gate = np.array([])
 Leakage_current = np.array([])
+fit_gate, fit_f0, fit_kappa, fit_residual = [], [], [], []
+
+fitter = ResonatorFitter(fit_kind, span = fit_span, max_residual = max_fit_residual)
+if fit_resonance:
+	fitter.start()
 
 t_in = time.time()
 for count,gate_voltage in enumerate(gate_pattern): # ramping up the gate voltage
@@ -210,12 +237,13 @@ for count,gate_voltage in enumerate(gate_pattern): # ramping up the gate voltage
 			break
 
 	if measure == 'OnePort':
-		amp_data = np.array(data['S11dB (dB)'])
-		phase_data = np.array(data['S11Ph (rad)'])
-
+		parameter = 'S11'
 	elif measure == 'TwoPort':
-		amp_data = np.array(data['S21dB (dB)'])
-		phase_data = np.array(data['S21Ph (rad)'])
+		parameter = 'S21'
+	amp_data = np.array(data[parameter + 'dB (dB)'])
+	phase_data = np.array(data[parameter + 'Ph (rad)'])
+	if fit_resonance:
+		fitter.submit(count, np.array(data['Frequency (Hz)']), np.array(data[parameter + 're ()']) + 1j*np.array(data[parameter + 'im ()']))
 
 	if count == 0:
 
@@ -232,13 +260,13 @@ for count,gate_voltage in enumerate(gate_pattern): # ramping up the gate voltage
 		plt.rcParams["figure.figsize"] = [16,9]
 
 		if (count-1)//monitor_ratio == (count-1)/monitor_ratio:
-			plt.subplot(2, 2, 1)
+			plt.subplot(4, 2, 1)
 			plt.plot(data['Frequency (Hz)']*1e-9,amp_data)
 			plt.ylabel('S11dB (dB)')
 			plt.xlim(np.min(data['Frequency (Hz)'])*1e-9,np.max(data['Frequency (Hz)'])*1e-9)
 			plt.title(title + ' Power: '+ str(power) + ' dBm')
 
-			plt.subplot(2, 2, 3)
+			plt.subplot(4, 2, 3)
 			plt.plot(data['Frequency (Hz)']*1e-9,phase_data*180/np.pi)
 			plt.ylabel('Phase (°)')
 			plt.xlim(np.min(data['Frequency (Hz)'])*1e-9,np.max(data['Frequency (Hz)'])*1e-9)
@@ -246,7 +274,7 @@ for count,gate_voltage in enumerate(gate_pattern): # ramping up the gate voltage
 
 
 
-		plt.subplot(2, 2, (2,4))
+		plt.subplot(4, 2, (2,6))
 
 		if count > 0:
 			extent = [np.min(data['Frequency (Hz)'])*1e-9,np.max(data['Frequency (Hz)'])*1e-9, gate_pattern[0], gate_pattern[count]]
@@ -256,6 +284,23 @@ for count,gate_voltage in enumerate(gate_pattern): # ramping up the gate voltage
 		plt.title('S11dB (dB)')
 		plt.xlabel('Frequency (GHz)')
 
+		if fit_resonance:
+			plt.subplot(4, 2, 5)
+			plt.cla()
+			plt.plot(fit_gate, np.array(fit_f0)*1e-9, '.')
+			plt.ylabel('$f_0$ (GHz)')
+
+			plt.subplot(4, 2, 7)
+			plt.cla()
+			plt.plot(fit_gate, np.array(fit_kappa)*1e-6, '.')
+			plt.ylabel('$\\kappa/2\\pi$ (MHz)')
+			plt.xlabel('$V_g$ (V)')
+
+			plt.subplot(4, 2, 8)
+			plt.cla()
+			plt.plot(fit_gate, fit_residual, '.')
+			plt.ylabel('fit residual')
+			plt.xlabel('$V_g$ (V)')
 
 
 
@@ -281,11 +326,19 @@ for count,gate_voltage in enumerate(gate_pattern): # ramping up the gate voltage
 			colnames = ['Vset (V)', 'Imeas (A)', 'R (Ohm)', 'Vgate (V)', 'T (K)', 'Ileakage (nA)']
 
 			Data = stlab.newfile(prefix,'_',colnames,autoindex = True, mypath= path)
+			if fit_resonance:
+				Fits = stlab.newfile(prefix,'_fits',['Gate Voltage (V)'] + list(FIT_COLUMNS),autoindex = True, mypath= path)
 
 
 
 		stlab.savedict(Data, data)
 
+	if fit_resonance:
+		show_fits(fitter.results()) # never waits for the fits
+		if fitter.drifted:
+			print('the last fits have a residual above', max_fit_residual, ': the resonance left the window, stopping')
+			STOP = True
+
 
 	if STOP:
 		break
@@ -300,6 +353,7 @@ for count,gate_voltage in enumerate(gate_pattern): # ramping up the gate voltage
 
 
 gate_dev.RampVoltage(0,tt=ramp_time) # to safely return back the gate voltage
+show_fits(fitter.close())
 stlab.metagen.fromarrays(Data,frequency_pattern,gate_pattern[0:count+1],xtitle='frequency (Hz)', ytitle='gate voltage (V)',ztitle='',colnames=colnames)
 
 print('FINISHED')
@@ -313,6 +367,8 @@ if save_data:
 	# plt.savefig(figures_path+'\\'+str(start_freq)+'GHz.jpg')
 
 	Data.close()
+	if fit_resonance:
+		Fits.close()
 	plt.close()
 
 
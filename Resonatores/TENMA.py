@@ -39,7 +39,7 @@ def numtostr(mystr):
 
 class TENMA:
     def __init__(self):
-        pass
+        self.voltage = None # last setpoint, so that ramps need no readback
         # self.ps = rm.open_resource("ASRL8::INSTR")
         # # self.ps.write_termination = '\n'
         # # self.ps.read_termination = '\n'
@@ -88,6 +88,7 @@ class TENMA:
         mystr = numtostr(Vol)
         mystr = 'VSET1:' + mystr
         self.write(mystr)
+        self.voltage = Vol
 
 
     def GetVoltage(self):  # (manual entry) Preset and make a DC voltage measurement with the specified range and resolution. The reading is sent to the output buffer.
@@ -103,7 +104,7 @@ class TENMA:
         return float(num)
 
     def RampVoltage(self, mvoltage, tt=5., steps=100):  #To ramp voltage over 'tt' seconds from current DAC value.
-        v0 = self.GetVoltage()
+        v0 = self.voltage if self.voltage is not None else self.GetVoltage() # VOUT1? only before the first ramp
         if np.abs(mvoltage - v0) < 1e-2:
             self.SetVoltage(mvoltage)
             return
@@ -0,0 +1,93 @@
+''' Gate values chosen while measuring, dense only where the measured value changes
+
+gate_pattern() sweeps a uniform np.linspace, so resolving the Dirac peak or a resonance
+that shifts quickly over a small gate range takes 200+ points spread over the whole
+range. AdaptiveGate measures a coarse uniform pass first, then passes adding points in
+the intervals where the measured value (resistance, resonance frequency) shifts or bends
+the most. Each pass is swept in the same direction (start -> stop), so all the points
+are on the same hysteresis branch.
+
+    Usage:
+        sweep = AdaptiveGate(-target_gate, target_gate, points = 60)
+        for count, gate_voltage in enumerate(sweep):
+            ...
+            sweep.add(r) # value at gate_voltage, needed before the next point (NaN: not measured)
+        sweep.gates, sweep.values # sorted by gate voltage
+
+The importance of an interval between two neighbouring points is the length of the
+normalized curve over it (shift) plus how far its end points are off the chord of their
+neighbours (curvature); an interval split in m parts counts 1/m of it.
+'''
+
+import numpy as np
+
+
+class AdaptiveGate:
+    def __init__(self, start, stop, points = 60, coarse_points = None, passes = 3, min_step = None):
+        ''' points: total number of gate points; coarse_points: points of the first, uniform pass (default points/3)
+            passes: number of refinement passes; min_step: intervals are not split below it (default: (stop-start)/200)
+        '''
+        self.start = start
+        self.stop = stop
+        self.points = points
+        self.coarse_points = max(3, points//3) if coarse_points is None else coarse_points
+        self.passes = passes
+        self.min_step = np.abs(stop - start)/200 if min_step is None else min_step
+        self.measured = [] # (gate, value) in the order of the measurement
+        self.pending = None
+
+    def __iter__(self):
+        plan = np.linspace(self.start, self.stop, self.coarse_points)
+        for n in range(self.passes + 1):
+            for gate in plan:
+                self.pending = gate
+                yield gate
+                if self.pending is not None:
+                    raise RuntimeError('AdaptiveGate: add() the value of {} V before the next point'.format(gate))
+            remaining = self.points - len(self.measured)
+            if n == self.passes or remaining <= 0:
+                return
+            plan = self.refine(int(np.ceil(remaining/(self.passes - n))))
+            if len(plan) == 0:
+                return
+
+    def add(self, value):
+        ''' The value measured at the gate voltage yielded last '''
+        self.measured.append((self.pending, value))
+        self.pending = None
+
+    @property
+    def gates(self):
+        return np.array(sorted(g for g, v in self.measured))
+
+    @property
+    def values(self):
+        return np.array([v for g, v in sorted(self.measured, key = lambda m: m[0])])
+
+    def loss(self):
+        ''' (sorted gates, importance of each interval between them), without the points not measured (NaN) '''
+        x, y = self.gates, self.values
+        finite = np.isfinite(y)
+        x, y = x[finite], y[finite]
+        dx = np.diff(x)/np.abs(self.stop - self.start)
+        scale = np.ptp(y) or 1.
+        dy = np.diff(y)/scale
+        bend = np.zeros(len(x))
+        bend[1:-1] = np.abs(y[1:-1] - (y[:-2] + (y[2:] - y[:-2])*(x[1:-1] - x[:-2])/(x[2:] - x[:-2])))/scale
+        return x, np.hypot(dx, dy) + bend[:-1] + bend[1:]
+
+    def refine(self, n):
+        ''' n new gate values splitting the intervals with the largest loss, in the direction of the sweep '''
+        x, loss = self.loss()
+        if len(loss) == 0:
+            return np.array([])
+        splits = np.zeros(len(loss), dtype = int)
+        for i in range(n):
+            share = loss/(splits + 1)
+            share[np.abs(np.diff(x))/(splits + 2) < self.min_step] = -1 # already at the resolution limit
+            best = np.argmax(share)
+            if share[best] < 0:
+                break
+            splits[best] += 1
+        new = np.concatenate([np.linspace(x[k], x[k + 1], m + 2)[1:-1] for k, m in enumerate(splits) if m > 0] + [np.array([])])
+        return np.sort(new) if self.stop > self.start else np.sort(new)[::-1]
@@ -0,0 +1,116 @@
+''' Offline resonator fit of a whole 2D map (gate, power, temperature sweep)
+
+Fitting the traces of a finished sweep one at a time with scipy curve_fit takes longer
+than the measurement. fit_map estimates the starting point of all the traces at once
+(vectorized over the rows), splits the rows in contiguous chunks fitted in parallel
+processes, and in a chunk starts every fit from the previous trace: its cable delay is
+only refined in a narrow range and its Q_l starts the phase fit. The results are arrays
+aligned with the sweep axis, NaN where a fit failed or is implausible (resonator_fit.plausibility).
+
+    Usage:
+        from batch_fit import load_map, fit_map
+        if __name__ == '__main__': # worker processes re-import the calling file on Windows
+            gate, frequency, S = load_map('C26_GateSweep.dat', parameter = 'S21', axis = 'Gate Voltage (V)')
+            fits = fit_map(frequency, S, kind = 'reflection', span = 20e6)
+            plt.errorbar(gate, fits['f0'], fits['f0_err'])
+            plt.plot(gate, fits['Qi'])
+
+        python batch_fit.py C26_GateSweep.dat reflection # writes C26_GateSweep_fits.npz
+
+The fit itself is resonator_fit.fit_resonator (circle fit, see there for the model).
+'''
+
+import os
+import sys
+import numpy as np
+from concurrent.futures import ProcessPoolExecutor
+from resonator_fit import fit_resonator
+from dat_reader import read_dat
+
+FIT_KEYS = ['f0', 'Ql', 'Qi', 'Qc', 'phi', 'kappa', 'kappa_i', 'kappa_c', 'a', 'alpha', 'delay', 'residual',
+    'f0_err', 'Ql_err', 'Qi_err', 'Qc_err']
+
+
+def initial_guesses(frequency, S):
+    ''' Starting points of all the rows of S (steps x points) at once: delay [s] from the phase slope
+    at both edges, f0 at the point farthest from the off-resonant background, Ql from the width at half power
+    '''
+    frequency = np.asarray(frequency, dtype = float)
+    S = np.atleast_2d(S)
+    n = max(3, S.shape[1]//10)
+    phase = np.unwrap(np.angle(S), axis = 1)
+    slopes = []
+    for edge in (slice(0, n), slice(-n, None)): # least squares slope of every row
+        f = frequency[edge] - np.mean(frequency[edge])
+        slopes.append((phase[:, edge] - np.mean(phase[:, edge], axis = 1, keepdims = True)) @ f/np.sum(f**2))
+    delay = -np.mean(slopes, axis = 0)/(2*np.pi)
+
+    z = S*np.exp(2j*np.pi*frequency*delay[:, None])
+    m = max(3, S.shape[1]//20)
+    distance = np.abs(z - np.mean(np.concatenate((z[:, :m], z[:, -m:]), axis = 1), axis = 1, keepdims = True))
+    k = np.argmax(distance, axis = 1)
+    peak = distance[np.arange(len(k)), k]
+    step = np.abs(frequency[1] - frequency[0])
+    width = np.maximum(np.sum(distance**2 > peak[:, None]**2/2, axis = 1), 2)*step
+    f0 = frequency[k]
+    return {'delay': delay, 'f0': f0, 'Ql': f0/width}
+
+
+def _fit_chunk(frequency, S, guesses, kind, span, warm_start):
+    fits = []
+    previous = None
+    for row, guess in zip(S, guesses):
+        if warm_start and previous is not None: # f0 of this row (it may jump), delay and Ql of the neighbour
+            guess = dict(guess, delay = previous['delay'], Ql = previous['Ql'])
+        try:
+            fit = fit_resonator(frequency, row, kind = kind, span = span, guess = guess)
+        except Exception as error:
+            fit = {'error': repr(error)}
+        previous = fit if 'error' not in fit and not fit['problem'] and np.isfinite(fit['residual']) and fit['residual'] < 0.1 else None
+        fits.append(fit)
+    return fits
+
+
+def fit_map(frequency, S, kind = 'notch', span = None, workers = None, warm_start = True):
+    ''' Fit every row of S (steps x points) measured at frequency [Hz]; returns a dict of arrays
+    (steps,) with the keys of FIT_KEYS, NaN where the fit failed or is implausible
+    kind, span: see resonator_fit.fit_resonator
+    workers: parallel processes (None: all cores, 1: no worker process)
+    warm_start: start every fit from the previous row of its chunk
+    '''
+    frequency = np.asarray(frequency, dtype = float)
+    S = np.atleast_2d(np.asarray(S, dtype = complex))
+    guesses = initial_guesses(frequency, S)
+    if span is not None: # the guesses of the whole trace do not hold in the window
+        guesses = {'delay': guesses['delay']}
+    guesses = [{key: value[i] for key, value in guesses.items()} for i in range(len(S))]
+
+    workers = os.cpu_count() if workers is None else workers
+    if workers <= 1 or len(S) < 2:
+        fits = _fit_chunk(frequency, S, guesses, kind, span, warm_start)
+    else:
+        chunks = np.array_split(np.arange(len(S)), min(len(S), 4*workers)) # more chunks than workers to balance the load
+        with ProcessPoolExecutor(max_workers = workers) as pool:
+            jobs = [pool.submit(_fit_chunk, frequency, S[chunk], guesses[chunk[0]:chunk[-1] + 1], kind, span, warm_start) for chunk in chunks]
+            fits = [fit for job in jobs for fit in job.result()]
+
+    fits = [{} if fit.get('problem') else fit for fit in fits]
+    return {key: np.array([fit.get(key, np.nan) for fit in fits]) for key in FIT_KEYS}
+
+
+def load_map(filename, parameter = 'S21', axis = 'Gate Voltage (V)'):
+    ''' Blocks of an stlab .dat file (one per sweep step, written by stlab.savedict) as
+    (axis values (steps,), frequency (points,), complex S (steps x points))
+    '''
+    sweep = read_dat(filename)
+    S = sweep[parameter + 're ()'] + 1j*sweep[parameter + 'im ()']
+    return np.array(sweep[axis][:, 0]), np.array(sweep['Frequency (Hz)'][0]), S
+
+
+if __name__ == '__main__':
+    filename = sys.argv[1]
+    kind = sys.argv[2] if len(sys.argv) > 2 else 'notch'
+    values, frequency, S = load_map(filename)
+    fits = fit_map(frequency, S, kind = kind)
+    np.savez(os.path.splitext(filename)[0] + '_fits.npz', axis = values, **fits)
+    print('fitted', len(S), 'traces,', np.sum(np.isnan(fits['f0'])), 'failed')
@@ -0,0 +1,359 @@
+''' Benchmarks of the measurement loops on simulated instruments
+
+Each benchmark is a loop of the measurement scripts, written with the same helpers, on
+the simulators of instrument_sim: IV map (IVVI gate x bias, DMM), HF2LI R vs gate, VNA
+S vs gate with the resonator fit, VNA power sweep (ASCII MeasureScreen_pd) and a time
+series (VNA, temperature, current). Every step is split in phases (ramp, settle, acquire,
+transfer, fit, write, plot; step_timer.StepTimer) and the report gives points per second, the time per point of each
+phase and the peak memory of the Python allocations. With time_scale = 0 the simulators
+do not wait, and what is left is the overhead of our own code.
+
+    Usage:
+        python benchmark.py                                 # all the benchmarks, instrument times included
+        python benchmark.py r_vs_vg s_vs_vg --time-scale 0  # our own overhead only
+        python benchmark.py --history benchmark_history.json # compared with the last run of the same settings, then appended
+
+        from benchmark import run_benchmark
+        result = run_benchmark('s_vs_vg', size = 2, time_scale = 0)
+        result['points_per_second'], result['phases'] # phases: seconds per point
+
+The exit code is 1 when a benchmark is slower than the previous run in the history by
+more than --tolerance. The plots are drawn by LiveView on an off-screen figure in the
+benchmark process (the scripts draw in a LiveDisplay process, so this is an upper bound).
+'''
+
+import os
+import sys
+import json
+import time
+import argparse
+import tempfile
+import subprocess
+import tracemalloc
+import numpy as np
+from matplotlib.figure import Figure
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'DC measurements')) # dmm_buffer, my_poll_v2, demod_stream
+import instrument_sim
+from instrument_sim import SimSample, SimIVVI, SimB2901A, SimVNA, SimDMM, SimDAQ, SimCryocon, SimTENMA
+from gate_ramp import GateRamp
+from sweep_order import sweep_order, row_runs
+from dat_writer import DatWriter
+from live_view import LiveView
+from vna_fetch import VNA_fetch
+from resonator_fit import fit_resonator
+from dmm_buffer import DMM_buffer
+try:
+    import zhinst.utils
+except ImportError: # no LabOne on this computer: my_poll_v2 gets the simulated zhinst.utils
+    instrument_sim.install()
+from my_poll_v2 import R_measure, HF2LI_session
+from step_timer import StepTimer
+
+INSTRUMENT_PHASES = ['ramp', 'settle', 'acquire', 'transfer'] # the rest is our own code
+
+
+def _ramp_limits(max_rate, tau):
+    ''' max_rate and tau of a GateRamp, on the time scale of the simulators (its waits are real sleeps) '''
+    scale = instrument_sim.TIME_SCALE
+    return {'max_rate': max_rate/scale if scale > 0 else 1e12, 'tau': tau*scale}
+
+
+def _view(rows, x, y):
+    fig = Figure(figsize = [16, 9])
+    FigureCanvasAgg(fig)
+    view = LiveView(fig)
+    live_map = view.map(fig.add_subplot(2, 1, 2), x, y)
+    live_trace = view.trace(fig.add_subplot(2, 1, 1), x)
+    return view, live_map, live_trace
+
+
+def iv_map(phases, sample, folder, size = 1.):
+    ''' IV-VoltageBias_USING_IVVI_MAPPING: gate rows, bias points read with DMM_buffer '''
+    gates = np.linspace(-5, 5, max(2, int(8*size)))
+    biases = np.linspace(-10, 10, 40) # [mV] at the DAC
+    ivvi = SimIVVI(sample = sample, gate_dac = 1, gain = 45.)
+    gate = GateRamp.ivvi(ivvi, 1, 45., voltage = 0, resolution = 0.01, **_ramp_limits(1, 0.05))
+    dmm = SimDMM(sample = sample, reading = lambda: 1e-3*ivvi.dac_voltages[4]/sample.resistance()*1e7) # M1b at 1e7 V/A
+    current = DMM_buffer(dmm, count = 1)
+    writer = DatWriter(os.path.join(folder, 'iv_map.dat'), colnames = ['Gate Voltage (V)', 'Bias (mV)', 'Current (A)'])
+    view, live_map, live_trace = _view(len(gates), biases, gates)
+    I_map = np.full((len(gates), len(biases)), np.nan)
+
+    for row, columns in row_runs(sweep_order(len(gates), len(biases), 'serpentine')):
+        with phases('ramp'):
+            gate.RampVoltage(gates[row])
+        with phases('settle'):
+            gate.Settle()
+        for column in columns:
+            with phases('ramp'):
+                ivvi.RampVoltage(5, biases[column], tt = 0.02, steps = 5)
+            with phases('acquire'):
+                I_map[row, column] = np.mean(current.read())/1e7
+        with phases('write'):
+            for column in range(len(biases)): # in the order of the bias list, as the script writes
+                writer.writeline([gates[row], biases[column], I_map[row, column]])
+            writer.end_block()
+        with phases('plot'):
+            live_map.add_row(row, I_map[row])
+            live_trace.set_data(I_map[row])
+            view.draw()
+        phases.step()
+    with phases('write'):
+        writer.close()
+    return I_map.size
+
+
+def r_vs_vg(phases, sample, folder, size = 1.):
+    ''' R-vs-Vg_USING_HF2LI-IVVI: IVVI gate, leakage on a DMM, R from the HF2LI session '''
+    gates = np.linspace(-5, 5, max(2, int(40*size)))
+    ivvi = SimIVVI(sample = sample, gate_dac = 1, gain = 45.)
+    gate = GateRamp.ivvi(ivvi, 1, 45., voltage = 0, resolution = 0.01, **_ramp_limits(1, 0.05))
+    leakage = SimDMM(sample = sample)
+    daq = SimDAQ(sample = sample)
+    session = HF2LI_session(daq, 'dev352')
+    writer = DatWriter(os.path.join(folder, 'r_vs_vg.dat'), colnames = ['gate voltage (V)', 'leakage current (nA)', 'Resistance (Ohm)', 'phase ()'])
+    view, live_map, live_trace = _view(2, gates, [0, 1])
+    R = np.full(len(gates), np.nan)
+
+    for count, gate_voltage in enumerate(gates):
+        with phases('ramp'):
+            gate.RampVoltage(gate_voltage)
+        with phases('settle'):
+            gate.Settle()
+        with phases('acquire'):
+            leakage_current = 1e3*float(leakage.query('READ?'))
+            measured = R_measure(device_id = 'dev352', amplitude = 0.1, out_channel = 1, in_channel = 1, BW = 1., frequency = 77,
+                poll_length = 0.2, device = 'dev352', daq = daq, out_mixer_channel = 6, bias_resistor = 1e8, in_range = 4e-3,
+                out_range = 100e-3, diff = False, demod_rate = 100, session = session)
+        R[count] = measured[0]
+        with phases('write'):
+            writer.writeline([gate_voltage, leakage_current, measured[0], measured[2]])
+        with phases('plot'):
+            live_trace.set_point(count, R[count])
+            view.draw()
+        phases.step()
+    session.close()
+    with phases('write'):
+        writer.close()
+    return len(gates)
+
+
+def s_vs_vg(phases, sample, folder, size = 1.):
+    ''' S-vs-Vg_USING_ZND-B2901: B2901A gate, binary VNA traces, resonator fit of every trace '''
+    gates = np.linspace(-5, 5, max(2, int(30*size)))
+    gate_dev = SimB2901A(sample = sample)
+    gate_dev.SetOutputOn()
+    gate = GateRamp.b2901a(gate_dev, resolution = 0.05, **_ramp_limits(1, 0.05))
+    VNA = SimVNA(sample = sample)
+    VNA.SetSweepfrequency(5.99, 6.03, 801)
+    VNA.SetIFBW(2e4)
+    fetch = VNA_fetch(VNA, timer = phases)
+    frequency = fetch.GetFrequency()
+    writer = DatWriter(os.path.join(folder, 's_vs_vg.dat'))
+    view, live_map, live_trace = _view(len(gates), frequency, gates)
+
+    for count, gate_voltage in enumerate(gates):
+        with phases('ramp'):
+            gate.RampVoltage(gate_voltage)
+        with phases('settle'):
+            gate.Settle()
+        trace = fetch.Measure() # acquire and transfer
+        with phases('acquire'):
+            leakage_current = gate_dev.GetCurrent()
+        with phases('fit'):
+            fit = fit_resonator(frequency, trace.S['S21'], kind = 'notch')
+        with phases('write'):
+            data = trace.to_dict()
+            data['Gate Voltage (V)'] = gate_voltage
+            data['Leakage Current (A)'] = leakage_current
+            data['f0 (Hz)'] = fit['f0']
+            writer.savedict(data)
+        with phases('plot'):
+            live_map.add_row(count, trace.dB('S21'))
+            live_trace.set_data(trace.dB('S21'))
+            view.draw()
+        phases.step()
+    fetch.Close()
+    with phases('write'):
+        writer.close()
+    return len(gates)
+
+
+def power_sweep(phases, sample, folder, size = 1.):
+    ''' S-vs-Power_USING_ZNB: VNA power steps read with MeasureScreen_pd (ASCII) '''
+    powers = np.linspace(-30, 0, max(2, int(20*size)))
+    VNA = SimVNA(sample = sample)
+    VNA.SetSweepfrequency(5.99, 6.03, 801)
+    VNA.SetIFBW(2e4)
+    writer = DatWriter(os.path.join(folder, 'power_sweep.dat'))
+    view, live_map, live_trace = _view(len(powers), VNA.frequency(), powers)
+
+    for count, power in enumerate(powers):
+        with phases('ramp'):
+            VNA.SetPower(power)
+        with phases('acquire'):
+            data = VNA.MeasureScreen_pd()
+        with phases('write'):
+            data['Power (dBm)'] = power
+            writer.savedict(data)
+        with phases('plot'):
+            amp = 10**(np.array(data['S21dB (dB)'])/10)
+            live_map.add_row(count, amp)
+            live_trace.set_data(amp)
+            view.draw()
+        phases.step()
+    with phases('write'):
+        writer.close()
+    return len(powers)
+
+
+def time_series(phases, sample, folder, size = 1.):
+    ''' S-vs-Time_USING_ZNB-TENMA: repeated VNA traces with the temperature and the TENMA current '''
+    steps = max(2, int(30*size))
+    VNA = SimVNA(sample = sample)
+    VNA.SetSweepfrequency(5.99, 6.03, 801)
+    VNA.SetIFBW(2e4)
+    fetch = VNA_fetch(VNA, timer = phases)
+    frequency = fetch.GetFrequency()
+    tempdev = SimCryocon(sample = sample)
+    gate_dev = SimTENMA(sample = sample)
+    gate_dev.SetVoltage(1.)
+    writer = DatWriter(os.path.join(folder, 'time_series.dat'))
+    view, live_map, live_trace = _view(steps, frequency, np.arange(steps))
+    t_in = time.time()
+
+    for count in range(steps):
+        trace = fetch.Measure() # acquire and transfer
+        with phases('acquire'):
+            temperature = tempdev.GetTemperature('B')
+            current = gate_dev.GetCurrent()
+        with phases('write'):
+            data = trace.to_dict()
+            data['Time (s)'] = time.time() - t_in
+            data['Temperature (K)'] = temperature
+            data['Current (A)'] = current
+            writer.savedict(data)
+        with phases('plot'):
+            live_map.add_row(count, trace.dB('S21'))
+            live_trace.set_data(trace.dB('S21'))
+            view.draw()
+        phases.step()
+    fetch.Close()
+    with phases('write'):
+        writer.close()
+    return steps
+
+
+BENCHMARKS = {'iv_map': iv_map, 'r_vs_vg': r_vs_vg, 's_vs_vg': s_vs_vg, 'power_sweep': power_sweep, 'time_series': time_series}
+
+
+def _run(name, size, time_scale):
+    scale = instrument_sim.TIME_SCALE
+    instrument_sim.TIME_SCALE = time_scale
+    phases = StepTimer()
+    try:
+        with tempfile.TemporaryDirectory() as folder:
+            t = time.perf_counter()
+            points = BENCHMARKS[name](phases, SimSample(seed = 0), folder, size)
+            seconds = time.perf_counter() - t
+    finally:
+        instrument_sim.TIME_SCALE = scale
+    return points, seconds, phases.totals()
+
+
+def run_benchmark(name, size = 1., time_scale = 1., memory = True, repeat = 1):
+    ''' Run the benchmark name (BENCHMARKS); size scales the number of points
+        memory: second run under tracemalloc for the peak memory (not in the timing)
+        repeat: number of timed runs, the fastest one is kept
+    returns {'points', 'seconds', 'points_per_second', 'phases' (s per point), 'instrument', 'overhead' (s per point), 'peak_memory' (bytes)}
+    '''
+    if name not in BENCHMARKS:
+        raise ValueError('Unknown benchmark: %s' % name)
+    points, seconds, times = min((_run(name, size, time_scale) for _ in range(repeat)), key = lambda run: run[1])
+    result = {'points': points, 'seconds': seconds, 'points_per_second': points/seconds,
+        'phases': {phase: total/points for phase, total in times.items()}}
+    result['instrument'] = sum(result['phases'].get(phase, 0.) for phase in INSTRUMENT_PHASES)
+    result['overhead'] = seconds/points - result['instrument'] # own code, including what is outside the phases
+    if memory:
+        tracemalloc.start()
+        try:
+            _run(name, size, time_scale)
+            result['peak_memory'] = tracemalloc.get_traced_memory()[1]
+        finally:
+            tracemalloc.stop()
+    return result
+
+
+def report(results):
+    phases = []
+    for result in results.values():
+        phases += [phase for phase in result['phases'] if phase not in phases]
+    print('%-12s %8s %10s %10s %10s ' % ('benchmark', 'points', 'points/s', 'overhead', 'memory') + ' '.join('%9s' % phase for phase in phases))
+    for name, result in results.items():
+        memory = '%8.1fMB' % (result['peak_memory']/2**20) if 'peak_memory' in result else '-'
+        print('%-12s %8d %10.2f %8.2fms %10s ' % (name, result['points'], result['points_per_second'], 1e3*result['overhead'], memory)
+            + ' '.join('%7.2fms' % (1e3*result['phases'][phase]) if phase in result['phases'] else '%9s' % '-' for phase in phases))
+
+
+def _commit():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], cwd = os.path.dirname(os.path.abspath(__file__)),
+            stderr = subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(previous, results, tolerance = 0.2):
+    ''' Names of the benchmarks slower than in previous by more than tolerance (relative), with a printout '''
+    regressions = []
+    for name, result in results.items():
+        if name not in previous:
+            continue
+        change = result['points_per_second']/previous[name]['points_per_second'] - 1
+        slower = change < -tolerance
+        print('%-12s %+6.1f%% points/s%s' % (name, 100*change, '   REGRESSION' if slower else ''))
+        for phase, seconds in result['phases'].items():
+            before = previous[name]['phases'].get(phase)
+            if before and abs(seconds - before) > tolerance*before:
+                print('    %-8s %7.2fms -> %7.2fms' % (phase, 1e3*before, 1e3*seconds))
+        if slower:
+            regressions.append(name)
+    return regressions
+
+
+def main(argv = None):
+    parser = argparse.ArgumentParser(description = 'Benchmarks of the measurement loops on simulated instruments')
+    parser.add_argument('names', nargs = '*', help = 'benchmarks to run (default: all): ' + ', '.join(BENCHMARKS))
+    parser.add_argument('--size', type = float, default = 1., help = 'factor on the number of points')
+    parser.add_argument('--time-scale', type = float, default = 1., help = 'factor on the instrument times (0: own overhead only)')
+    parser.add_argument('--repeat', type = int, default = 1, help = 'timed runs of each benchmark, the fastest is kept')
+    parser.add_argument('--no-memory', action = 'store_true', help = 'skip the peak memory run')
+    parser.add_argument('--history', help = 'JSON file of the previous runs, compared and appended')
+    parser.add_argument('--tolerance', type = float, default = 0.2, help = 'relative slowdown counted as a regression')
+    args = parser.parse_args(argv)
+
+    results = {}
+    for name in args.names or BENCHMARKS:
+        results[name] = run_benchmark(name, args.size, args.time_scale, memory = not args.no_memory, repeat = args.repeat)
+    report(results)
+
+    regressions = []
+    if args.history:
+        history = []
+        if os.path.exists(args.history):
+            with open(args.history) as f:
+                history = json.load(f)
+        settings = {'size': args.size, 'time_scale': args.time_scale, 'repeat': args.repeat}
+        previous = [run for run in history if run['settings'] == settings]
+        if previous:
+            print('\ncompared with %s (%s):' % (previous[-1]['commit'], previous[-1]['date']))
+            regressions = compare(previous[-1]['results'], results, args.tolerance)
+        history.append({'date': time.strftime('%Y-%m-%d %H:%M:%S'), 'commit': _commit(), 'settings': settings, 'results': results})
+        with open(args.history, 'w') as f:
+            json.dump(history, f, indent = 1)
+    return 1 if regressions else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
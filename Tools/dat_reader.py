@@ -0,0 +1,174 @@
+''' Fast reader of the stlab .dat files of a sweep
+
+stlab.newfile / stlab.writeline / stlab.savedict write comma separated text: '#' header
+lines with the column names, one block of lines per sweep step, blocks separated by a
+blank line. Generic text loaders parse such a 500 x 2501 map line by line in minutes.
+read_dat memory-maps the file, finds the line ends with numpy in chunks, sorts the lines
+into headers, separators and data, converts all the data lines in a single np.loadtxt
+call (one call per block is slower; it skips the headers and separators itself) and
+splits the rows into the blocks by their lengths.
+A line with a bad number or another number of columns raises a ValueError with its line
+numbers. The array is cached next to the file (name.dat.npy
+and name.dat.json); later loads memory-map the cache and are instant, until the .dat
+file changes (a run still writing to it).
+
+    Usage:
+        sweep = read_dat('C26_GateSweep.dat')
+        sweep.colnames # ['Frequency (Hz)', 'S21re ()', ...]
+        sweep.data.shape # (steps, points, columns)
+        amp = sweep['S21dB (dB)'] # (steps x points)
+        gate = sweep['Gate Voltage (V)'][:, 0] # one value per step
+        frequency = sweep['Frequency (Hz)'][0]
+
+A block shorter than the others (a run stopped during the write) is padded with NaN;
+a file of stlab.writeline lines without separators is a single block.
+'''
+
+import io
+import os
+import json
+import mmap
+import numpy as np
+
+
+class DatMap:
+    def __init__(self, data, colnames):
+        self.data = data # (steps, points, columns)
+        self.colnames = list(colnames)
+
+    def __getitem__(self, name):
+        ''' (steps x points) array of the column name '''
+        return self.data[:, :, self.colnames.index(name)]
+
+    def __contains__(self, name):
+        return name in self.colnames
+
+    @property
+    def steps(self):
+        return self.data.shape[0]
+
+    @property
+    def points(self):
+        return self.data.shape[1]
+
+
+def _cache_names(filename):
+    return filename + '.npy', filename + '.json'
+
+
+def _source_stamp(filename):
+    stat = os.stat(filename)
+    return {'size': stat.st_size, 'mtime': stat.st_mtime}
+
+
+_CHUNK = 1 << 24 # bytes scanned for line ends at a time
+
+
+def _lines(text):
+    ''' (starts, ends) byte offsets and first bytes of the lines of a memory-mapped file, scanned in chunks '''
+    buffer = np.frombuffer(text, dtype = np.uint8) # a view, nothing is copied; the mmap cannot close while it exists
+    ends = [np.flatnonzero(buffer[offset:offset + _CHUNK] == ord('\n')) + offset for offset in range(0, buffer.size, _CHUNK)]
+    ends = np.concatenate(ends + [np.array([buffer.size])])
+    starts = np.concatenate(([0], ends[:-1] + 1))
+    if starts[-1] >= buffer.size: # the file ends with a line end
+        starts, ends = starts[:-1], ends[:-1]
+    return starts, ends, buffer[np.minimum(starts, buffer.size - 1)]
+
+
+def parse_dat(filename):
+    ''' (steps x points x columns) array and the column names of an stlab .dat file, without the cache '''
+    with open(filename, 'rb') as f:
+        if os.fstat(f.fileno()).st_size == 0:
+            return np.empty((0, 0, 0)), []
+        with mmap.mmap(f.fileno(), 0, access = mmap.ACCESS_READ) as text:
+            return _parse(filename, text)
+
+
+def _parse(filename, text):
+    starts, ends, first = _lines(text)
+    kind = np.zeros(len(starts), dtype = np.int8) # 0 data, 1 header, 2 blank
+    kind[first == ord('#')] = 1
+    kind[ends == starts] = 2
+    for line in np.flatnonzero(np.isin(first, list(b' \t\r')) & (ends > starts)): # only the lines starting with white space
+        stripped = text[starts[line]:ends[line]].strip()
+        kind[line] = 2 if not stripped else 1 if stripped[:1] == b'#' else 0
+
+    # blocks of data lines, ended by blank lines; a header line (savedict) splits a block into spans
+    headers = []
+    blocks = [[]] # (first line, stop line) spans of every block
+    previous = 0
+    for line in list(np.flatnonzero(kind != 0)) + [len(starts)]:
+        if line > previous:
+            blocks[-1].append((previous, line))
+        if line < len(starts):
+            if kind[line] == 1:
+                headers.append(text[starts[line]:ends[line]].strip()[1:])
+            elif blocks[-1]:
+                blocks.append([])
+        previous = line + 1
+    if not blocks[-1]:
+        blocks.pop()
+    if not blocks:
+        return np.empty((0, 0, 0)), _colnames(headers, 0)
+
+    line = blocks[0][0][0]
+    columns = text[starts[line]:ends[line]].count(b',') + 1
+    colnames = _colnames(headers, columns)
+    lengths = [sum(stop - first for first, stop in spans) for spans in blocks]
+    spans = [span for spans in blocks for span in spans]
+    lines = io.TextIOWrapper(io.BytesIO(text[starts[spans[0][0]]:ends[spans[-1][1] - 1]]), errors = 'replace') # the file as mapped, not what was written since
+    try:
+        values = np.loadtxt(lines, delimiter = ',', comments = '#', ndmin = 2)
+    except ValueError:
+        values = None
+    if values is None or values.shape != (sum(lengths), columns):
+        _raise_span_error(filename, text, starts, ends, spans, columns)
+    if min(lengths) == max(lengths):
+        return values.reshape(len(blocks), lengths[0], columns), colnames
+    data = np.full((len(blocks), max(lengths), columns), np.nan)
+    for step, stop in enumerate(np.cumsum(lengths)):
+        data[step, :lengths[step]] = values[stop - lengths[step]:stop]
+    return data, colnames
+
+
+def _raise_span_error(filename, text, starts, ends, spans, columns):
+    ''' The ValueError of the first span of data lines that does not parse, with its line numbers '''
+    for first, stop in spans:
+        span = text[starts[first]:ends[stop - 1]].decode(errors = 'replace').splitlines()
+        try:
+            values = np.loadtxt(span, delimiter = ',', ndmin = 2)
+        except ValueError as error:
+            raise ValueError('%s, lines %d-%d: %s' % (filename, first + 1, stop, error))
+        if values.shape != (stop - first, columns):
+            raise ValueError('%s, lines %d-%d: %d values per line, %d in the first line' % (filename, first + 1, stop, values.shape[1], columns))
+    raise ValueError('%s: the data lines do not parse' % filename)
+
+
+def _colnames(headers, columns):
+    ''' Names of the last header line with the right number of columns (newfile and savedict may write different ones) '''
+    for header in reversed(headers):
+        names = [name.strip() for name in header.decode(errors = 'replace').split(',')]
+        if len(names) == columns:
+            return names
+    return ['column %d' % i for i in range(columns)]
+
+
+def read_dat(filename, cache = True):
+    ''' DatMap of an stlab .dat file; cache: read and write the binary copy next to the file '''
+    data_cache, header_cache = _cache_names(filename)
+    stamp = _source_stamp(filename)
+    if cache and os.path.exists(data_cache) and os.path.exists(header_cache):
+        with open(header_cache) as f:
+            header = json.load(f)
+        if header.get('source') == stamp:
+            return DatMap(np.load(data_cache, mmap_mode = 'r'), header['colnames'])
+
+    data, colnames = parse_dat(filename)
+    if cache:
+        try:
+            np.save(data_cache, data)
+            with open(header_cache, 'w') as f:
+                json.dump({'colnames': colnames, 'shape': list(data.shape), 'source': stamp}, f)
+        except OSError: # read-only data folder: no cache
+            pass
+    return DatMap(data, colnames)
@@ -0,0 +1,167 @@
+''' Binary writer behind the stlab .dat files
+
+stlab.writeline and stlab.savedict format every number as text while the sweep runs:
+a 2501-point VNA trace with 7 columns is ~30 kB of ASCII and most of the write time of a
+step. DatWriter takes the same calls but appends the raw float64 rows to name.dat.bin
+(a JSON header with the column names, then the rows), and writes the legacy text .dat
+file only on export(), by default when it is closed. stlab.metagen and the plotting
+tools keep working on the exported file.
+
+    Usage:
+        Data = stlab.newfile(prefix,'_',colnames,autoindex = True, mypath= path) # as before
+        writer = DatWriter(Data)
+        for count, gate_voltage in enumerate(gate_pattern):
+            ...
+            writer.savedict(data) # instead of stlab.savedict(Data, data)
+            # writer.writeline([gate_voltage, I, R]) # instead of stlab.writeline(Data, ...)
+            # writer.export() # on demand: the .dat file so far
+        writer.close() # exports the .dat file
+        stlab.metagen.fromarrays(Data, ...)
+        Data.close()
+
+        sweep = read_bin(Data.name + '.bin') # dat_reader.DatMap, also during the run
+
+File: b'STLABBIN', uint32 length of the JSON header, the header ({'colnames': [...]}),
+then records: int64 n > 0 followed by n rows of float64, or int64 0 for the blank line
+ending a block. A record cut short by a crash is ignored when reading.
+'''
+
+import json
+import struct
+import numpy as np
+from dat_reader import DatMap
+
+MAGIC = b'STLABBIN'
+
+
+class DatWriter:
+    def __init__(self, dat, colnames = None, export_on_close = True):
+        ''' dat: the legacy .dat file, as opened by stlab.newfile (or a filename)
+            colnames: column names of writeline rows (savedict takes the keys of its data)
+            export_on_close: write the .dat text when closed
+        '''
+        self.dat = dat
+        self.filename = (dat if isinstance(dat, str) else dat.name) + '.bin'
+        self.colnames = None if colnames is None else list(colnames)
+        self.export_on_close = export_on_close
+        self.file = open(self.filename, 'wb')
+        self.header_written = False
+        self.rows = 0
+        self.blocks = 0
+
+    def _write_header(self, colnames):
+        self.colnames = list(colnames)
+        header = json.dumps({'colnames': self.colnames}).encode()
+        self.file.write(MAGIC + struct.pack('<I', len(header)) + header)
+        self.header_written = True
+
+    def _write_rows(self, rows):
+        rows = np.ascontiguousarray(rows, dtype = '<f8')
+        assert rows.shape[1] == len(self.colnames), 'rows of %d columns, header of %d' % (rows.shape[1], len(self.colnames))
+        self.file.write(struct.pack('<q', len(rows)) + rows.tobytes())
+        self.rows += len(rows)
+
+    def writeline(self, line):
+        ''' One row, like stlab.writeline (no block separator) '''
+        if not self.header_written:
+            self._write_header(self.colnames if self.colnames is not None else ['column %d' % i for i in range(len(line))])
+        self._write_rows(np.reshape(np.asarray(line, dtype = float), (1, -1)))
+        self.file.flush()
+
+    def savedict(self, data):
+        ''' One block from a dict or data frame of columns (scalars are repeated), like stlab.savedict '''
+        names = list(data.keys())
+        if not self.header_written:
+            self._write_header(names)
+        assert names == self.colnames, 'the columns changed: %s' % names
+        columns = np.broadcast_arrays(*[np.asarray(data[name], dtype = float) for name in names])
+        self._write_rows(np.column_stack(columns))
+        self.end_block()
+
+    def end_block(self):
+        ''' The blank line between two sweep steps '''
+        self.file.write(struct.pack('<q', 0))
+        self.blocks += 1
+        self.file.flush()
+
+    def export(self):
+        ''' Write the legacy .dat text of everything written so far (replaces its content) '''
+        if not self.file.closed:
+            self.file.flush()
+        if isinstance(self.dat, str):
+            with open(self.dat, 'w') as f:
+                write_text(f, self.filename)
+        else:
+            self.dat.seek(0)
+            self.dat.truncate()
+            write_text(self.dat, self.filename)
+            self.dat.flush()
+
+    def close(self):
+        if self.file.closed:
+            return
+        self.file.close()
+        if self.export_on_close:
+            self.export()
+
+
+def _records(filename):
+    ''' Column names and the records of a .bin file: arrays of rows, None for a block end '''
+    with open(filename, 'rb') as f:
+        content = f.read()
+    if len(content) < len(MAGIC) + 4 or content[:len(MAGIC)] != MAGIC:
+        return [], []
+    length, = struct.unpack_from('<I', content, len(MAGIC))
+    position = len(MAGIC) + 4
+    colnames = json.loads(content[position:position + length])['colnames']
+    position += length
+    width = 8*len(colnames)
+    records = []
+    while position + 8 <= len(content):
+        n, = struct.unpack_from('<q', content, position)
+        position += 8
+        if n == 0:
+            records.append(None) # end of a block
+            continue
+        if position + n*width > len(content): # cut short
+            break
+        records.append(np.frombuffer(content, dtype = '<f8', count = n*len(colnames), offset = position).reshape(n, len(colnames)))
+        position += n*width
+    return colnames, records
+
+
+def _blocks(records):
+    blocks, current = [], []
+    for record in records:
+        if record is None:
+            blocks.append(current)
+            current = []
+        else:
+            current.append(record)
+    if current:
+        blocks.append(current)
+    return [np.concatenate(block) if block else np.empty((0, 0)) for block in blocks]
+
+
+def read_bin(filename):
+    ''' DatMap (steps x points x columns) of a DatWriter file; short blocks are padded with NaN '''
+    colnames, records = _records(filename)
+    blocks = _blocks(records)
+    points = max([len(block) for block in blocks], default = 0)
+    data = np.full((len(blocks), points, len(colnames)), np.nan)
+    for step, block in enumerate(blocks):
+        data[step, :len(block)] = block
+    return DatMap(data, colnames)
+
+
+def write_text(f, filename):
+    ''' The stlab .dat text of a DatWriter file: '#' header, comma separated rows, blank line after each block '''
+    colnames, records = _records(filename)
+    if not colnames:
+        return
+    f.write('#' + ', '.join(colnames) + '\n')
+    for record in records:
+        if record is None:
+            f.write('\n')
+        else:
+            np.savetxt(f, record, fmt = '%.10e', delimiter = ', ')
@@ -0,0 +1,130 @@
+''' Gate ramp with a known setpoint, a slew-rate limit and a settling model
+
+RampVoltage(v, tt=ramp_time, steps=5) of the instruments reads the output back before
+every ramp, spreads a fixed number of writes over a fixed time whatever the size of
+the step, and the scripts then sleep a fixed time_step / time_sleep_gate at every point.
+GateRamp remembers the last setpoint (no readback), makes the minimum number of writes
+so that no single write is larger than resolution, paces them at max_rate, and waits
+only as long as an exponential settling model with time constant tau needs to bring the
+gate within tolerance of the target. The time spent since the last write (readouts,
+file writes) counts as settling time.
+
+    Usage:
+        ivvi.RampAllZero(tt=2., steps = 20)
+        gate = GateRamp.ivvi(ivvi, S1h_dac, S1h_gain, voltage = 0, max_rate = 1, resolution = 0.01, tau = 0.5)
+        # gate = GateRamp.b2901a(gate_dev, max_rate = 0.01, resolution = 0.01, tau = 0.5)
+        for Vg in Vglist:
+            gate.RampVoltage(Vg) # [V] at the gate
+            gate.Settle() # returns at once if the gate is already within tolerance
+            ...
+        gate.RampVoltage(0)
+
+Settling model: the gate follows the setpoint as a first-order system. At the end of a
+ramp the remaining error is the last write plus the lag of the ramp (max_rate*tau), at
+most the whole step, and it decays as exp(-t/tau).
+'''
+
+import time
+import numpy as np
+
+
+class GateRamp:
+    def __init__(self, write, max_rate, resolution, tau = 0., tolerance = 1e-3, voltage = None, read = None):
+        ''' write: function setting the gate voltage [V] with a single instrument write
+            max_rate: [V/s] maximum slew rate of the gate
+            resolution: [V] largest step made in a single write
+            tau: [s] time constant of the gate settling (0: no settling wait)
+            tolerance: [V] settled when the remaining error is below it
+            voltage: [V] present setpoint; if None it is read once with read()
+        '''
+        assert max_rate > 0 and resolution > 0, 'max_rate and resolution must be positive'
+        assert voltage is not None or read is not None, 'give the present voltage or a function to read it'
+        self.write = write
+        self.max_rate = max_rate
+        self.resolution = resolution
+        self.tau = tau
+        self.tolerance = tolerance
+        self.voltage = float(read()) if voltage is None else float(voltage)
+        self.error = 0. # [V] remaining error at the last write
+        self.last_write = time.time()
+        self.writes = 0
+
+    @classmethod
+    def ivvi(cls, ivvi, dac, gain = 1., **kwargs):
+        ''' IVVI_DAC dac behind an amplifier of gain [V/V] (S1h); voltages in V at the gate '''
+        return cls(lambda v: ivvi.SetVoltage(dac, v/gain*1000.), **kwargs)
+
+    @classmethod
+    def b2901a(cls, dev, **kwargs):
+        ''' Keysight B2901A / B2961A in voltage mode; the output is read once if voltage is not given '''
+        kwargs.setdefault('read', dev.GetVoltage)
+        return cls(dev.SetVoltage, **kwargs)
+
+    @classmethod
+    def tenma(cls, dev, **kwargs):
+        ''' TENMA power supply (Resonatores/TENMA.py) '''
+        kwargs.setdefault('read', dev.GetVoltage)
+        return cls(dev.SetVoltage, **kwargs)
+
+    def GetVoltage(self):
+        ''' Last setpoint [V], without instrument access '''
+        return self.voltage
+
+    def Plan(self, target):
+        ''' Setpoints written to go to target: the fewest steps no larger than resolution '''
+        delta = target - self.voltage
+        steps = int(np.ceil(abs(delta)/self.resolution - 1e-9))
+        if steps == 0:
+            return np.array([])
+        return self.voltage + delta*np.arange(1, steps + 1)/steps
+
+    def StepTime(self, target):
+        ''' ([s] ramp, [s] settling) of the step to target from the present setpoint '''
+        steps = len(self.Plan(target))
+        if steps == 0:
+            return 0., 0.
+        ramp = abs(target - self.voltage)/self.max_rate # one interval before every write, the first one too
+        return ramp, self._settle_time(self._error(target))
+
+    def RampTime(self, target):
+        ''' [s] duration of the ramp to target plus its settling '''
+        return sum(self.StepTime(target))
+
+    def _error(self, target):
+        delta = abs(target - self.voltage)
+        steps = len(self.Plan(target))
+        return min(delta, delta/steps + self.max_rate*self.tau) if steps else 0.
+
+    def _settle_time(self, error):
+        if self.tau <= 0 or error <= self.tolerance:
+            return 0.
+        return self.tau*np.log(error/self.tolerance)
+
+    def RampVoltage(self, target):
+        ''' Go to target [V] at max_rate; does not wait for the settling (see Settle) '''
+        setpoints = self.Plan(target)
+        if len(setpoints) == 0:
+            return
+        error = self._error(target)
+        interval = abs(target - self.voltage)/len(setpoints)/self.max_rate
+        start = max(self.last_write, time.time()) # write k at start + (k+1)*interval: also a single write, or back-to-back ramps, stay below max_rate
+        for count, v in enumerate(setpoints):
+            wait = start + (count + 1)*interval - time.time() # scheduled, so the write time is not added to each step
+            if wait > 0:
+                time.sleep(wait)
+            self.write(v)
+            self.voltage = v
+            self.writes += 1
+            self.last_write = time.time()
+        self.voltage = target
+        self.error = error
+
+    def SettleTime(self):
+        ''' [s] still to wait for the last ramp to settle '''
+        return max(0., self._settle_time(self.error) - (time.time() - self.last_write))
+
+    def Settle(self):
+        wait = self.SettleTime()
+        if wait > 0:
+            time.sleep(wait)
+        self.error = 0.
@@ -0,0 +1,696 @@
+''' Simulated instruments, to run and time the measurement scripts without hardware
+
+The simulators take the same calls as the drivers the scripts use (IVVI_DAC, Keysight_B2901A,
+RS_ZND, stlab.adi multimeters, the zhinst ziDAQServer, Cryocon_44C, TENMA), wait as long as
+the real instrument would (VISA round trips, ramps, integration times, VNA sweeps, transfer
+of ASCII or binary blocks, demodulator polls) and answer with synthetic data of a shared
+SimSample: the gate voltage set by one instrument moves the resistance, the leakage current
+and the resonance read by the others.
+
+    Usage:
+        python instrument_sim.py "../DC measurements/R-vs-Vg_USING_HF2LI-IVVI.py" # the script, unmodified
+
+        from instrument_sim import install
+        install(time_scale = 0.1, IVVI_DAC = {'gain': 45, 'gate_dac': 1}) # before the script imports its drivers
+        from stlab.devices.IVVI import IVVI_DAC # SimIVVI
+
+        sample = SimSample(dirac = 2., Qi = 5e4)
+        gate_dev = SimB2901A(sample = sample)
+        VNA = SimVNA(sample = sample, transfer_rate = 1e6)
+
+time_scale multiplies all the waits (0: no waiting, to time the code of the loop alone).
+Only the drivers are replaced: the file functions of stlab (newfile, writeline, metagen)
+are the real ones, and a script opening its instrument with pyvisa directly is not covered.
+'''
+
+import os
+import re
+import sys
+import time
+import types
+import runpy
+import functools
+import numpy as np
+from vna_fetch import VNA_trace
+
+TIME_SCALE = 1.
+
+
+def _sleep(seconds):
+    if seconds > 0 and TIME_SCALE > 0:
+        time.sleep(seconds*TIME_SCALE)
+
+
+def _number(command):
+    ''' Last number of a SCPI command, e.g. 'SENS1:FREQ:STAR 4e9' -> 4e9 '''
+    return float(re.findall(r'[-+]?(?:\d+\.?\d*|\.\d+)(?:[eE][-+]?\d+)?', command)[-1])
+
+
+class SimSample:
+    def __init__(self, dirac = 0.5, R_peak = 4e3, R_contact = 400., width = 1.5, oxide_resistance = 1e10,
+            f0 = 6e9, tuning = 2e6, Qi = 2e4, Qc = 1e4, phi = 0.1, delay = 50e-9, attenuation = -40.,
+            T_start = 300., T_base = 3.5, cooldown = 3600., seed = None):
+        ''' dirac: [V] charge neutrality point; R_peak, R_contact: [Ohm] resistance at and far from it; width: [V]
+            oxide_resistance: [Ohm] gate leakage path
+            f0: [Hz] resonance at the Dirac point, tuning: [Hz/V] shift with |gate - dirac|
+            Qi, Qc, phi: internal and coupling quality factors, impedance mismatch [rad]
+            delay: [s] cable delay; attenuation: [dB] of the lines
+            T_start, T_base: [K] temperature at the start and the end of the cooldown; cooldown: [s] time constant
+        '''
+        self.dirac = dirac
+        self.R_peak = R_peak
+        self.R_contact = R_contact
+        self.width = width
+        self.oxide_resistance = oxide_resistance
+        self.f0 = f0
+        self.tuning = tuning
+        self.Qi = Qi
+        self.Qc = Qc
+        self.phi = phi
+        self.delay = delay
+        self.attenuation = attenuation
+        self.T_start = T_start
+        self.T_base = T_base
+        self.cooldown = cooldown
+        self.gate = 0. # [V] at the gate, set by the instrument driving it
+        self.t0 = time.time()
+        self.rng = np.random.default_rng(seed)
+
+    def resistance(self):
+        return self.R_contact + self.R_peak/np.sqrt(1 + ((self.gate - self.dirac)/self.width)**2)
+
+    def leakage(self):
+        return self.gate/self.oxide_resistance
+
+    def resonance(self):
+        return self.f0 + self.tuning*np.abs(self.gate - self.dirac)
+
+    def S(self, frequency, parameter = 'S21'):
+        ''' Notch resonator for the transmission (S21, S12), reflection resonator for S11, S22 '''
+        frequency = np.asarray(frequency, dtype = float)
+        Ql = 1/(1/self.Qi + 1/self.Qc)
+        coupling = (1 if parameter in ['S21', 'S12'] else 2)*Ql/self.Qc*np.exp(1j*self.phi)
+        background = 10**(self.attenuation/20)*np.exp(-2j*np.pi*frequency*self.delay)
+        return background*(1 - coupling/(1 + 2j*Ql*(frequency/self.resonance() - 1)))
+
+    def temperature(self, channel = 'A'):
+        elapsed = (time.time() - self.t0)/(TIME_SCALE if TIME_SCALE > 0 else 1.)
+        return self.T_base + (self.T_start - self.T_base)*np.exp(-elapsed/self.cooldown)
+
+    def noise(self, scale, size = None):
+        return scale*self.rng.standard_normal(size)
+
+
+SAMPLE = SimSample() # shared by the simulators created without a sample
+
+
+class SimIVVI:
+    def __init__(self, addr = 'COM5', ndacs = 8, polarity = ('BIP', 'BIP'), verb = True, timeout = 2, reset = False,
+            sample = None, gate_dac = None, gain = 1., latency = 5e-3):
+        ''' IVVI_DAC; gate_dac: DAC driving the gate (None: the last one written), gain: [V/V] of the S1h after it
+            latency: [s] per serial command
+        '''
+        self.sample = SAMPLE if sample is None else sample
+        self.gate_dac = gate_dac
+        self.gain = gain
+        self.latency = latency
+        self.verb = verb
+        self.dac_voltages = np.zeros(ndacs) # [mV]
+        if reset:
+            self.RampAllZero(tt = 20.)
+
+    def SetVoltage(self, dac, mvoltage):
+        _sleep(self.latency)
+        self.dac_voltages[dac - 1] = mvoltage
+        if self.gate_dac is None or dac == self.gate_dac:
+            self.sample.gate = mvoltage/1000.*self.gain
+
+    def ReadDACs(self):
+        _sleep(self.latency)
+        return list(self.dac_voltages)
+
+    def RampVoltage(self, dac, mvoltage, tt = 5., steps = 100):
+        v0 = self.ReadDACs()[dac - 1]
+        for v in np.linspace(v0, mvoltage, steps):
+            self.SetVoltage(dac, v)
+            _sleep(tt/steps)
+
+    def RampAllZero(self, tt = 2., steps = 20):
+        for dac in np.nonzero(self.dac_voltages)[0]:
+            self.RampVoltage(dac + 1, 0., tt = tt, steps = steps)
+
+    def close(self):
+        pass
+
+
+class SimB2901A:
+    def __init__(self, addr = 'TCPIP::192.168.1.63::INSTR', reset = True, verb = True, sample = None, gate = True,
+            latency = 2e-3, noise = 1e-12):
+        ''' Keysight_B2901A; gate: the output drives the gate of the sample
+            latency: [s] per command; noise: [A] of the current readings
+        '''
+        self.sample = SAMPLE if sample is None else sample
+        self.gate = gate
+        self.latency = latency
+        self.noise = noise
+        self.voltage = 0.
+        self.compliance = 1e-4
+        self.output = False
+
+    def write(self, command):
+        _sleep(self.latency)
+        command = command.upper()
+        if re.match(r':?SOUR\w*:VOLT\S*\s+[-+.\d]', command):
+            self._set(_number(command))
+        elif command.startswith(':OUTP') or command.startswith('OUTP'):
+            self.output = command.rstrip().endswith(('ON', '1'))
+
+    def query(self, command):
+        _sleep(self.latency)
+        command = command.upper()
+        if '*IDN?' in command:
+            return 'Keysight Technologies,B2901A,SIM,1.0'
+        if 'CURR?' in command:
+            return '%.10e' % self._current()
+        if 'VOLT?' in command:
+            return '%.10e' % self.voltage
+        return '0'
+
+    def _set(self, voltage):
+        self.voltage = voltage
+        if self.gate:
+            self.sample.gate = voltage
+
+    def _current(self):
+        current = self.sample.leakage() + self.sample.noise(self.noise) if self.output else 0.
+        return float(np.clip(current, -self.compliance, self.compliance))
+
+    def SetModeVoltage(self):
+        _sleep(self.latency)
+
+    def SetComplianceCurrent(self, current):
+        _sleep(self.latency)
+        self.compliance = current
+
+    def SetOutputOn(self):
+        _sleep(self.latency)
+        self.output = True
+
+    def SetOutputOff(self):
+        _sleep(self.latency)
+        self.output = False
+
+    def SetVoltage(self, voltage):
+        _sleep(self.latency)
+        self._set(voltage)
+
+    def GetVoltage(self):
+        _sleep(self.latency)
+        return self.voltage
+
+    def GetCurrent(self):
+        _sleep(self.latency)
+        return self._current()
+
+    def RampVoltage(self, mvoltage, tt = 5., steps = 100):
+        v0 = self.GetVoltage()
+        for v in np.linspace(v0, mvoltage, steps):
+            self.SetVoltage(v)
+            _sleep(tt/steps)
+
+    def close(self):
+        pass
+
+
+class SimVNA:
+    def __init__(self, addr = 'TCPIP::192.168.1.149::INSTR', reset = True, verb = True, sample = None,
+            latency = 2e-3, transfer_rate = 5e6, overhead = 0.02, noise = 1e-3):
+        ''' RS_ZND / ZNB (also the SCPI of vna_fetch, ZND and FieldFox dialects)
+            latency: [s] per command; transfer_rate: [bytes/s] of the data blocks
+            overhead: [s] per sweep on top of points/IF bandwidth; noise: relative to the line transmission
+        '''
+        self.sample = SAMPLE if sample is None else sample
+        self.dev = self # vna_fetch talks to the resource behind the driver
+        self.latency = latency
+        self.transfer_rate = transfer_rate
+        self.overhead = overhead
+        self.noise = noise
+        self.start, self.stop, self.points = 4e9, 8e9, 201
+        self.ifbw = 1e3
+        self.power = -10.
+        self.sweep_time = None # None: auto
+        self.averages = 1
+        self.traces = [('Trc1', 'S21')]
+        self.selected = 'Trc1'
+        self.binary = False
+        self.continuous = True # sweeping on its own, as after a preset
+        self.data = {}
+        self.sweeps = 0
+
+    def frequency(self):
+        return np.linspace(self.start, self.stop, self.points)
+
+    def SweepDuration(self):
+        auto = self.points/self.ifbw
+        return self.overhead + max(auto, self.sweep_time or 0.)*self.averages
+
+    def _sweep(self):
+        _sleep(self.SweepDuration())
+        frequency = self.frequency()
+        scale = self.noise*10**(self.sample.attenuation/20)/np.sqrt(self.averages)
+        self.data = {parameter: self.sample.S(frequency, parameter) + self.sample.noise(scale, self.points) + 1j*self.sample.noise(scale, self.points)
+            for _, parameter in self.traces}
+        self.sweeps += 1
+
+    def _transfer(self, size):
+        _sleep(self.latency + size/self.transfer_rate)
+
+    def _selected(self):
+        return dict(self.traces)[self.selected]
+
+    def write(self, command):
+        _sleep(self.latency)
+        upper = command.upper()
+        if re.search(r'FREQ:STAR', upper):
+            self.start = _number(command)
+        elif re.search(r'FREQ:STOP', upper):
+            self.stop = _number(command)
+        elif re.search(r'SWE\w*:POIN', upper):
+            self.points = int(_number(command))
+        elif re.search(r'(BAND|BWID)', upper):
+            self.ifbw = _number(command)
+        elif re.search(r'SWE\w*:TIME', upper):
+            self.sweep_time = _number(command)
+        elif re.search(r'POW', upper):
+            self.power = _number(command)
+        elif re.search(r'AVER:COUN', upper):
+            self.averages = max(1, int(_number(command)))
+        elif re.search(r'FORM\w*:DATA', upper):
+            self.binary = 'REAL' in upper
+        elif re.search(r'INIT\d*:IMM', upper):
+            self._sweep() # *OPC? returns right after
+        elif re.search(r'INIT\d*:CONT', upper):
+            self.continuous = bool(re.search(r'CONT\w* +(ON|1)', upper))
+        elif re.search(r'CALC\d*:PAR\w*:SEL', upper):
+            name = re.search(r"'([^']*)'", command)
+            number = re.search(r'CALC:PAR(\d+):SEL', upper)
+            self.selected = name.group(1) if name else self.traces[int(number.group(1)) - 1][0]
+
+    def query(self, command):
+        upper = command.upper()
+        if re.search(r'DATA\W? *SDAT', upper) or 'DATA:SDATA?' in upper:
+            S = self.data[self._selected()]
+            text = ','.join('%.10e,%.10e' % (z.real, z.imag) for z in S)
+            self._transfer(len(text))
+            return text
+        _sleep(self.latency)
+        if '*IDN?' in upper:
+            return 'Rohde-Schwarz,ZND,SIM,1.0'
+        if '*OPC?' in upper:
+            return '1'
+        if 'FREQ:STAR?' in upper:
+            return '%.10e' % self.start
+        if 'FREQ:STOP?' in upper:
+            return '%.10e' % self.stop
+        if re.search(r'SWE\w*:POIN\?', upper):
+            return '%d' % self.points
+        if re.search(r'SWE\w*:TIME\?', upper):
+            return '%.10e' % max(self.points/self.ifbw, self.sweep_time or 0.)
+        if 'PAR:CAT?' in upper:
+            return "'%s'" % ','.join(name + ',' + parameter for name, parameter in self.traces)
+        if 'PAR:COUN?' in upper:
+            return '%d' % len(self.traces)
+        definition = re.search(r'CALC:PAR(\d+):DEF\?', upper)
+        if definition:
+            return '"%s"' % self.traces[int(definition.group(1)) - 1][1]
+        if 'POW' in upper:
+            return '%.10e' % self.power
+        if re.search(r'INIT\d*:CONT\w*\?', upper):
+            return '1' if self.continuous else '0'
+        return '0'
+
+    def query_binary_values(self, command, datatype = 'f', is_big_endian = False, container = list):
+        ''' Interleaved re, im of the selected trace '''
+        S = self.data[self._selected()]
+        values = np.empty(2*len(S), dtype = '>' + datatype if is_big_endian else '<' + datatype)
+        values[0::2], values[1::2] = S.real, S.imag
+        self._transfer(values.nbytes)
+        return container(values)
+
+    def SetStart(self, x):
+        self.write('SENS1:FREQ:STAR %.10e' % x)
+
+    def SetEnd(self, x):
+        self.write('SENS1:FREQ:STOP %.10e' % x)
+
+    def SetPoints(self, x):
+        self.write('SENS1:SWE:POIN %d' % x)
+
+    def SetSweepfrequency(self, start, stop, points):
+        ''' start, stop [GHz] '''
+        self.SetStart(start*1e9)
+        self.SetEnd(stop*1e9)
+        self.SetPoints(points)
+
+    def SetIFBW(self, x):
+        self.write('SENS1:BAND %.10e' % x)
+
+    def SetSweepTime(self, x):
+        self.write('SENS1:SWE:TIME %.10e' % x)
+
+    def SetPower(self, x):
+        self.write('SOUR1:POW %.10e' % x)
+
+    def GetPower(self):
+        return float(self.query('SOUR1:POW?'))
+
+    def SinglePort(self):
+        _sleep(self.latency)
+        self.traces = [('Trc1', 'S11')]
+        self.selected = 'Trc1'
+
+    def TwoPort(self):
+        _sleep(self.latency)
+        self.traces = [('Trc1', 'S11'), ('Trc2', 'S21'), ('Trc3', 'S12'), ('Trc4', 'S22')]
+        self.selected = 'Trc1'
+
+    def AutoScale(self):
+        _sleep(self.latency)
+
+    def ClearAll(self):
+        _sleep(self.latency)
+
+    def MeasureScreen_pd(self):
+        ''' Single sweep, every trace in ASCII, as a pandas DataFrame '''
+        self._sweep()
+        S = {}
+        for name, parameter in self.traces:
+            self.write("CALC1:PAR:SEL '%s'" % name)
+            text = self.query('CALC1:DATA? SDAT')
+            values = np.array(text.split(','), dtype = float)
+            S[parameter] = values[0::2] + 1j*values[1::2]
+        return VNA_trace(self.frequency(), S).to_pd()
+
+    def close(self):
+        pass
+
+
+class SimDMM:
+    def __init__(self, addr = None, reset = True, verb = True, read_termination = '\n', sample = None, reading = None,
+            model = 'DMM6500', latency = 2e-3, nplc = 1., line_frequency = 50., noise = 1e-6):
+        ''' Keithley DMM6500 / 2000 opened with stlab.adi
+            reading: function returning the measured voltage (default: the S1h current monitor of the
+                gate leakage, 1 V/uA); noise: [V]
+            latency: [s] per command; nplc: integration time in power line cycles of line_frequency [Hz]
+        '''
+        self.sample = SAMPLE if sample is None else sample
+        self.reading = reading if reading is not None else lambda: self.sample.leakage()/1e-6
+        self.model = model
+        self.latency = latency
+        self.nplc = nplc
+        self.line_frequency = line_frequency
+        self.noise = noise
+        self.count = 1 # readings per READ? or TRAC:TRIG
+        self.buffer = []
+
+    def _read(self, count):
+        _sleep(count*self.nplc/self.line_frequency)
+        return [self.reading() + self.sample.noise(self.noise) for _ in range(count)]
+
+    def write(self, command):
+        _sleep(self.latency)
+        upper = command.upper()
+        if 'NPLC' in upper:
+            self.nplc = _number(command)
+        elif re.match(r':?(SAMP:)?COUN', upper) or re.match(r':?SENS\w*:COUN', upper):
+            self.count = int(_number(command))
+        elif 'TRAC:CLE' in upper:
+            self.buffer = []
+        elif 'TRAC:TRIG' in upper:
+            self.buffer += self._read(self.count)
+
+    def query(self, command):
+        _sleep(self.latency)
+        upper = command.upper()
+        if '*IDN?' in upper:
+            return 'KEITHLEY INSTRUMENTS,MODEL %s,SIM,1.0' % self.model
+        if 'TRAC:DATA?' in upper:
+            readings = self.buffer
+        elif 'READ?' in upper:
+            readings = self._read(self.count if self.model == '2000' else 1)
+        elif 'MEAS' in upper:
+            readings = self._read(1)
+        else:
+            return '0'
+        return ','.join('%.10e' % value for value in readings)
+
+    def close(self):
+        pass
+
+
+def adi(addr = None, reset = True, verb = False, **kwargs):
+    ''' stlab.adi: the instrument at addr, here a multimeter '''
+    return SimDMM(addr, reset = reset, verb = verb, **kwargs)
+
+
+class SimDAQ:
+    def __init__(self, sample = None, device = 'dev352', bias_resistor = 1e8, clockbase = 210e6, latency = 1e-3, noise = 1e-3):
+        ''' zhinst ziDAQServer of an HF2LI; the demodulator reads R of the sample through bias_resistor [Ohm]
+            latency: [s] per set/get/sync; noise: relative, of x and y
+        '''
+        self.sample = SAMPLE if sample is None else sample
+        self.device = device
+        self.bias_resistor = bias_resistor
+        self.clockbase = clockbase
+        self.latency = latency
+        self.noise = noise
+        self.nodes = {}
+        self.paths = set()
+        self.time = 0. # [s] device clock
+        self.last_poll = None
+
+    def set(self, settings, value = None):
+        _sleep(self.latency)
+        settings = [(settings, value)] if value is not None else settings
+        for node, value in settings:
+            self.nodes[node.lower()] = value
+
+    def setInt(self, node, value):
+        self.set(node, value)
+
+    def setDouble(self, node, value):
+        self.set(node, value)
+
+    def getInt(self, node):
+        return int(self.getDouble(node))
+
+    def getDouble(self, node):
+        _sleep(self.latency)
+        if node.lower().endswith('clockbase'):
+            return self.clockbase
+        return float(self.nodes.get(node.lower(), 0))
+
+    def sync(self):
+        _sleep(self.latency)
+
+    def subscribe(self, path):
+        self.paths.add(path.lower())
+        self.last_poll = time.time()
+
+    def unsubscribe(self, path):
+        if path == '*':
+            self.paths.clear()
+        self.paths.discard(path.lower())
+
+    def _amplitude(self):
+        for node, value in self.nodes.items():
+            output = re.match(r'/\w+/sigouts/(\d+)/amplitudes/\d+$', node)
+            if output and value:
+                return value*self.nodes.get('/%s/sigouts/%s/range' % (self.device, output.group(1)), 1.)
+        return 0.1
+
+    def poll(self, length, timeout = 500, flags = 0, flat = True):
+        ''' The samples since the subscription or the previous poll, after recording length [s] more '''
+        _sleep(length)
+        now = time.time()
+        elapsed = length if self.last_poll is None or TIME_SCALE <= 0 else max(length, (now - self.last_poll)/TIME_SCALE)
+        self.last_poll = now
+        data = {}
+        for path in self.paths:
+            demod = re.match(r'/\w+/demods/(\d+)/sample', path)
+            if not demod:
+                continue
+            rate = float(self.nodes.get('/%s/demods/%s/rate' % (self.device, demod.group(1)), 1717.))
+            samples = np.arange(np.floor(self.time*rate) + 1, np.floor((self.time + elapsed)*rate) + 1) # on the sample clock
+            if not len(samples):
+                continue
+            x = self.sample.resistance()*self._amplitude()/self.bias_resistor
+            data[path] = {'timestamp': (samples/rate*self.clockbase).astype(np.uint64),
+                'x': x*(1 + self.sample.noise(self.noise, len(samples))),
+                'y': x*self.sample.noise(self.noise, len(samples))}
+        self.time += elapsed
+        return data
+
+
+def _zhinst_utils(sample, **options):
+    ''' Module with the functions of zhinst.utils the scripts use, on a SimDAQ '''
+    utils = types.ModuleType('zhinst.utils')
+    def create_api_session(device_serial, api_level, required_devtype = None, required_options = None, required_err_msg = None):
+        return SimDAQ(sample, device = device_serial.lower(), **options), device_serial.lower(), {'devicetype': 'HF2LI', 'options': ''}
+    def disable_everything(daq, device):
+        daq.set([('/%s/demods/*/enable' % device, 0), ('/%s/sigouts/*/on' % device, 0)])
+        return []
+    utils.create_api_session = create_api_session
+    utils.api_server_version_check = lambda daq: None
+    utils.disable_everything = disable_everything
+    utils.default_output_mixer_channel = lambda props, output_channel = 0: 6 if props['devicetype'].startswith('HF2') else 0
+    return utils
+
+
+class SimCryocon:
+    def __init__(self, addr = 'TCPIP::192.168.1.4::5000::SOCKET', reset = True, verb = True, sample = None,
+            latency = 5e-3, noise = 1e-3):
+        ''' Cryocon_44C; latency: [s] per command, noise: relative '''
+        self.sample = SAMPLE if sample is None else sample
+        self.latency = latency
+        self.noise = noise
+
+    def GetTemperature(self, channel = 'A'):
+        _sleep(self.latency)
+        return self.sample.temperature(channel)*(1 + self.sample.noise(self.noise))
+
+    def write(self, command):
+        _sleep(self.latency)
+
+    def query(self, command):
+        _sleep(self.latency)
+        return '0'
+
+    def close(self):
+        pass
+
+
+class SimTENMA:
+    def __init__(self, address_string = 'ASRL8::INSTR', sample = None, gate = True, latency = 0.05, noise = 1e-4):
+        ''' TENMA power supply (Resonatores/TENMA.py, or the raw serial resource)
+            gate: the output drives the gate of the sample; latency: [s] per serial command; noise: [A]
+        '''
+        self.sample = SAMPLE if sample is None else sample
+        self.gate = gate
+        self.latency = latency
+        self.noise = noise
+        self.voltage = None # last setpoint, as TENMA
+        self.output_voltage = 0.
+        self.on = True
+
+    def write(self, command):
+        _sleep(self.latency)
+        upper = command.upper()
+        if upper.startswith('VSET1:') or upper.startswith('VOLT '):
+            self.output_voltage = _number(command)
+            if self.gate:
+                self.sample.gate = self.output_voltage
+        elif upper.startswith('OUT'):
+            self.on = upper.strip() == 'OUT1'
+
+    def query(self, command):
+        _sleep(self.latency)
+        upper = command.upper()
+        if '*IDN?' in upper:
+            return 'TENMA 72-2540 V2.1 SIM'
+        if 'VOUT1?' in upper:
+            return '%.3f' % (self.output_voltage if self.on else 0.)
+        if 'IOUT1?' in upper:
+            return '%.4f' % (self.sample.leakage() + self.sample.noise(self.noise) if self.on else 0.)
+        return '0'
+
+    def WhoIsIt(self):
+        return self.query('*IDN?')
+
+    def SetVoltage(self, Vol):
+        self.write('VSET1:%20.15e' % Vol)
+        self.voltage = Vol
+
+    def GetVoltage(self):
+        return float(self.query('VOUT1?'))
+
+    def GetCurrent(self):
+        return float(self.query('IOUT1?'))
+
+    def RampVoltage(self, mvoltage, tt = 5., steps = 100):
+        v0 = self.voltage if self.voltage is not None else self.GetVoltage()
+        if np.abs(mvoltage - v0) < 1e-2:
+            self.SetVoltage(mvoltage)
+            return
+        for vv in np.linspace(v0, mvoltage, steps):
+            self.SetVoltage(vv)
+            _sleep(tt/steps)
+
+    def TurnOn(self):
+        self.write('OUT1')
+
+    def TurnOff(self):
+        self.write('OUT0')
+
+    def Close(self):
+        self.close()
+
+    def close(self):
+        pass
+
+
+# module of the driver -> (name in the module, simulator)
+DRIVERS = {
+    'stlab.devices.IVVI': ('IVVI_DAC', SimIVVI),
+    'stlab.devices.Keysight_B2901A': ('Keysight_B2901A', SimB2901A),
+    'stlab.devices.RS_ZND': ('RS_ZND', SimVNA),
+    'stlab.devices.Cryocon_44C': ('Cryocon_44C', SimCryocon),
+    'TENMA': ('TENMA', SimTENMA),
+    }
+
+
+def install(sample = None, time_scale = 1., **options):
+    ''' Replace the drivers by the simulators for everything imported afterwards
+        sample: SimSample shared by all of them (default SAMPLE)
+        time_scale: factor on all the waits of the simulators
+        options: keyword arguments of a simulator, by the name the scripts import:
+            IVVI_DAC, Keysight_B2901A, RS_ZND, Cryocon_44C, TENMA, adi, ziDAQServer
+    '''
+    global TIME_SCALE, SAMPLE
+    TIME_SCALE = time_scale
+    SAMPLE = SimSample() if sample is None else sample
+    for name in options:
+        if name not in [driver for driver, _ in DRIVERS.values()] + ['adi', 'ziDAQServer']:
+            raise ValueError('Unknown driver: %s' % name)
+
+    try:
+        import stlab
+    except ImportError: # the file functions are missing, the drivers are enough for scripts that do not save
+        stlab = types.ModuleType('stlab')
+        stlab.__path__ = []
+        sys.modules['stlab'] = stlab
+    if 'stlab.devices' not in sys.modules:
+        devices = types.ModuleType('stlab.devices')
+        devices.__path__ = []
+        sys.modules['stlab.devices'] = devices
+        stlab.devices = devices
+    stlab.adi = functools.partial(adi, sample = SAMPLE, **options.get('adi', {}))
+
+    for module_name, (name, simulator) in DRIVERS.items():
+        module = types.ModuleType(module_name)
+        setattr(module, name, functools.partial(simulator, sample = SAMPLE, **options.get(name, {})))
+        sys.modules[module_name] = module
+
+    zhinst = types.ModuleType('zhinst')
+    zhinst.__path__ = []
+    zhinst.utils = _zhinst_utils(SAMPLE, **options.get('ziDAQServer', {}))
+    sys.modules['zhinst'] = zhinst
+    sys.modules['zhinst.utils'] = zhinst.utils
+
+
+if __name__ == '__main__':
+    script = os.path.abspath(sys.argv[1])
+    install(time_scale = float(os.environ.get('SIM_TIME_SCALE', 1.)))
+    sys.path.insert(0, os.path.dirname(script)) # the helpers next to the script (gate_pattern, my_poll_v2, ...)
+    sys.argv = sys.argv[1:]
+    runpy.run_path(script, run_name = '__main__')
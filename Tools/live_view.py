@@ -0,0 +1,325 @@
+''' Incremental live plot of a 2D sweep map
+
+plt.contourf / plt.imshow on the whole accumulated array followed by plt.pause(0.1)
+redraws the full figure on every step, so the plotting time grows with the sweep.
+LiveView keeps one image artist per map on a preallocated (steps x points) canvas,
+writes only the new row into it and blits the changed artists at a capped frame rate,
+independent of how fast the rows come in.
+
+    Usage:
+        fig, (ax_trace, ax_map) = plt.subplots(2, 1)
+        live = LiveView(fig)
+        S_map = live.map(ax_map, frequency*1e-9, pattern['ramp_pattern'])
+        S_trace = live.trace(ax_trace, frequency*1e-9)
+        plt.show(block = False)
+        for count, gate_voltage in enumerate(pattern['ramp_pattern']):
+            ...
+            S_map.add_row(count, amp_data)
+            S_trace.set_data(amp_data)
+            live.draw() # returns immediately if the last frame is more recent than 1/max_fps
+        live.finish() # before plt.savefig
+
+The rows of a map are placed in the order of the sweep between y[0] and y[-1], so y
+should be monotonic. Full redraws only happen when a color or y scale has to grow.
+
+LiveDisplay runs the same view in a separate process fed through a pipe, so the
+acquisition loop does not wait for the drawing at all.
+'''
+
+import sys
+import time
+import queue
+import pickle
+import threading
+import subprocess
+import numpy as np
+
+
+class LiveMap:
+    def __init__(self, view, ax, x, y, vmin = None, vmax = None, cmap = 'seismic'):
+        self.view = view
+        self.ax = ax
+        self.canvas = np.full((len(y), len(x)), np.nan)
+        self.autoscale = vmin is None or vmax is None
+        self.vmin = vmin
+        self.vmax = vmax
+        self.artist = ax.imshow(self.canvas, origin = 'lower', aspect = 'auto', interpolation = 'nearest', cmap = cmap,
+            extent = [x[0], x[-1], y[0], y[-1]], vmin = vmin, vmax = vmax, animated = True)
+
+    def add_row(self, index, row):
+        ''' Write the row of sweep step index; nothing is drawn here '''
+        self.canvas[index] = row
+        self.artist.set_data(self.canvas)
+        if self.autoscale:
+            low, high = np.nanmin(row), np.nanmax(row)
+            if self.vmin is None or low < self.vmin or high > self.vmax:
+                self.vmin = low if self.vmin is None else min(low, self.vmin)
+                self.vmax = high if self.vmax is None else max(high, self.vmax)
+                self.artist.set_clim(self.vmin, self.vmax) # the image is redrawn anyway, no full redraw needed
+
+
+class LiveTrace:
+    def __init__(self, view, ax, x, ylim = None, **style):
+        self.view = view
+        self.ax = ax
+        self.ylim = ylim
+        self.y = np.full(len(x), np.nan)
+        self.artist, = ax.plot(x, self.y, animated = True, **style)
+        ax.set_xlim(np.min(x), np.max(x))
+        if ylim is not None:
+            ax.set_ylim(*ylim)
+
+    def set_data(self, y, x = None):
+        ''' New y on the same x, or new points (x, y) (e.g. an adaptive gate sweep) '''
+        self.y = np.array(y, dtype = float)
+        if x is None:
+            self.artist.set_ydata(self.y)
+        else:
+            self.artist.set_data(x, self.y)
+        self._scale(np.nanmin(y), np.nanmax(y))
+
+    def set_point(self, index, value):
+        ''' Fill one point, for 1D sweeps (R vs Vg) plotted on the full pattern '''
+        self.y[index] = value
+        self.artist.set_ydata(self.y)
+        self._scale(value, value)
+
+    def _scale(self, low, high):
+        if not (np.isfinite(low) and np.isfinite(high)): # a failed read (NaN) keeps the scale
+            return
+        if self.ylim is None or low < self.ylim[0] or high > self.ylim[1]:
+            margin = 0.05*(high - low) or 0.05*abs(high) or 1
+            self.ylim = (low - margin, high + margin) if self.ylim is None else (min(low - margin, self.ylim[0]), max(high + margin, self.ylim[1]))
+            self.ax.set_ylim(*self.ylim)
+            self.view.full_redraw = True # the tick labels change
+
+
+class LiveView:
+    def __init__(self, fig, max_fps = 4):
+        ''' fig: the matplotlib figure holding the maps and traces
+            max_fps: maximum number of redraws per second
+        '''
+        self.fig = fig
+        self.items = []
+        self.min_interval = 1./max_fps
+        self.last_draw = 0
+        self.backgrounds = None
+        self.blit = getattr(fig.canvas, 'supports_blit', False)
+        self.full_redraw = True
+        fig.canvas.mpl_connect('draw_event', self._on_draw)
+
+    def map(self, ax, x, y, vmin = None, vmax = None, cmap = 'seismic'):
+        ''' 2D map with one row per element of y; fixed color scale with vmin and vmax, otherwise it follows the data '''
+        item = LiveMap(self, ax, np.asarray(x), np.asarray(y), vmin, vmax, cmap)
+        self.items.append(item)
+        return item
+
+    def trace(self, ax, x, ylim = None, **style):
+        ''' Line showing the last row (or any 1D data on x); style goes to ax.plot '''
+        item = LiveTrace(self, ax, np.asarray(x), ylim, **style)
+        self.items.append(item)
+        return item
+
+    def _axes(self):
+        axes = []
+        for item in self.items:
+            if item.ax not in axes:
+                axes.append(item.ax)
+        return axes
+
+    def _on_draw(self, event):
+        ''' Save the static parts (axes, labels) after every full redraw '''
+        if self.blit:
+            self.backgrounds = [(ax, self.fig.canvas.copy_from_bbox(ax.bbox)) for ax in self._axes()]
+        self._draw_artists()
+
+    def _draw_artists(self):
+        for item in self.items:
+            if item.artist.get_animated(): # static after finish(), then the normal figure draw includes them
+                item.ax.draw_artist(item.artist)
+
+    def draw(self, force = False):
+        ''' Redraw if 1/max_fps has passed since the last frame (or if force); returns True if drawn '''
+        now = time.time()
+        if not force and now - self.last_draw < self.min_interval:
+            return False
+        self.last_draw = now
+
+        canvas = self.fig.canvas
+        if self.full_redraw or not self.blit or self.backgrounds is None:
+            self.full_redraw = False
+            canvas.draw() # triggers _on_draw, which saves the backgrounds and draws the artists
+        else:
+            for ax, background in self.backgrounds:
+                canvas.restore_region(background)
+            self._draw_artists()
+            for ax, background in self.backgrounds:
+                canvas.blit(ax.bbox)
+        canvas.flush_events() # keeps the window responsive, without the sleep of plt.pause
+        return True
+
+    def finish(self):
+        ''' Last frame with the artists made static again, so that plt.savefig includes them '''
+        for item in self.items:
+            item.artist.set_animated(False)
+        self.blit = False
+        self.full_redraw = True
+        self.draw(force = True)
+
+
+class LiveDisplay:
+    ''' The same live view, drawn by a separate python process
+
+    The acquisition loop only puts the new rows into a queue; a thread pipes them to
+    the display process, which draws at its own pace. Nothing in the measurement loop
+    waits for matplotlib (no plt.pause), and closing the window does not stop the
+    measurement.
+
+        Usage:
+            display = LiveDisplay(figsize = [16,9])
+            display.trace('amp', (2,2,1), frequency, ylabel = 'S11dB (dB)')
+            display.map('S11', (2,2,(2,4)), frequency, gate_pattern, vmin = -38, vmax = -22, ylabel = '$V_g$ (V)')
+            display.start()
+            for count, gate_voltage in enumerate(gate_pattern):
+                ...
+                display.add_row('S11', count, amp_data)
+                display.set_data('amp', amp_data)
+            display.savefig(filename) # the figure is saved by the display process
+            display.close()
+
+    The display is a subprocess running this file (not multiprocessing), so the
+    measurement script is not imported again on Windows.
+    '''
+    def __init__(self, figsize = None, max_fps = 4):
+        self.spec = {'figsize': figsize, 'max_fps': max_fps, 'items': []}
+        self.queue = queue.Queue() # unbounded: put() never blocks the acquisition
+        self.process = None
+        self.thread = None
+        self.alive = False
+
+    def map(self, name, position, x, y, vmin = None, vmax = None, cmap = 'seismic', **labels):
+        ''' position: arguments of fig.add_subplot, e.g. (2,2,(2,4)); labels: title, xlabel, ylabel '''
+        self.spec['items'].append(('map', name, position, np.asarray(x), np.asarray(y), {'vmin': vmin, 'vmax': vmax, 'cmap': cmap}, labels))
+
+    def trace(self, name, position, x, ylim = None, style = {}, **labels):
+        ''' style: keyword arguments of ax.plot, e.g. {'marker': '.', 'linestyle': '--'} '''
+        self.spec['items'].append(('trace', name, position, np.asarray(x), None, dict(style, ylim = ylim), labels))
+
+    def start(self):
+        self.process = subprocess.Popen([sys.executable, __file__], stdin = subprocess.PIPE)
+        self.alive = True
+        self.queue.put(('setup', self.spec))
+        self.thread = threading.Thread(target = self._send, daemon = True)
+        self.thread.start()
+
+    def _send(self):
+        while True:
+            message = self.queue.get()
+            if message is None:
+                break
+            if not self.alive:
+                continue
+            try:
+                pickle.dump(message, self.process.stdin, protocol = pickle.HIGHEST_PROTOCOL)
+                self.process.stdin.flush()
+            except (BrokenPipeError, OSError): # window closed: keep measuring without display
+                self.alive = False
+
+    def add_row(self, name, index, row):
+        self.queue.put(('row', name, index, np.array(row)))
+
+    def set_data(self, name, y, x = None):
+        self.queue.put(('data', name, np.array(y), None if x is None else np.array(x)))
+
+    def set_point(self, name, index, value):
+        self.queue.put(('point', name, index, float(value)))
+
+    def set_title(self, name, text):
+        ''' Title of the axes of item name (costs a full redraw in the display process) '''
+        self.queue.put(('title', name, text))
+
+    def savefig(self, filename):
+        self.queue.put(('savefig', filename))
+
+    def close(self, timeout = 60):
+        ''' Draw what is left, save the pending figures and stop the display process '''
+        if self.process is None:
+            return
+        self.queue.put(('close',))
+        self.queue.put(None)
+        self.thread.join()
+        try:
+            self.process.stdin.close()
+        except OSError:
+            pass
+        try:
+            self.process.wait(timeout)
+        except subprocess.TimeoutExpired:
+            self.process.kill()
+        self.process = None
+
+
+def _display_main():
+    ''' Display process of LiveDisplay: reads the messages from stdin and draws '''
+    import matplotlib.pyplot as plt
+
+    messages = queue.Queue()
+    def read():
+        stdin = sys.stdin.buffer
+        while True:
+            try:
+                messages.put(pickle.load(stdin))
+            except (EOFError, OSError, pickle.UnpicklingError):
+                messages.put(('close',))
+                return
+    threading.Thread(target = read, daemon = True).start()
+
+    setup = messages.get()[1]
+    fig = plt.figure(figsize = setup['figsize'])
+    live = LiveView(fig, setup['max_fps'])
+    items = {}
+    for kind, name, position, x, y, options, labels in setup['items']:
+        ax = fig.add_subplot(*position)
+        ax.set(**labels)
+        if kind == 'map':
+            items[name] = live.map(ax, x, y, **options)
+        else:
+            items[name] = live.trace(ax, x, **options)
+    plt.show(block = False)
+    live.draw(force = True)
+
+    while True:
+        try:
+            message = messages.get(timeout = live.min_interval)
+        except queue.Empty:
+            message = None
+        while message is not None: # apply everything that arrived before drawing once
+            kind = message[0]
+            if kind == 'row':
+                items[message[1]].add_row(message[2], message[3])
+            elif kind == 'data':
+                items[message[1]].set_data(message[2], message[3])
+            elif kind == 'point':
+                items[message[1]].set_point(message[2], message[3])
+            elif kind == 'title':
+                items[message[1]].ax.set_title(message[2])
+                live.full_redraw = True
+            elif kind == 'savefig':
+                live.finish()
+                fig.savefig(message[1])
+            elif kind == 'close':
+                live.finish()
+                plt.close(fig)
+                return
+            try:
+                message = messages.get_nowait()
+            except queue.Empty:
+                message = None
+        if plt.fignum_exists(fig.number):
+            live.draw()
+        else:
+            fig.canvas.flush_events()
+
+
+if __name__ == '__main__':
+    _display_main()
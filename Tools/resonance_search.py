@@ -0,0 +1,203 @@
+''' Coarse-to-fine search and tracking of narrow resonances
+
+Sweeping 3.5-11 GHz in fixed 1001-point windows at 100 Hz IF bandwidth for every gate
+voltage spends nearly all the VNA time far from any resonance. ResonanceSearch makes
+one fast wide sweep, picks the dips that stand out of the background, and then only
+sweeps narrow high-resolution windows around them. At the next gate step each window
+is centered on the frequency found at the previous step; a resonance that leaves its
+window is followed by widening the window, and if it is lost, a wide sweep looks for it
+near its last frequency (the other resonances keep their windows). Every resonance keeps
+the id it got when it was first found, whatever its depth later on; a lost resonance that
+is not found again is no longer followed.
+
+    Usage:
+        search = ResonanceSearch(VNA, 3.5e9, 11e9, parameter = 'S21', max_resonances = 3)
+        for count, gate_voltage in enumerate(pattern['ramp_pattern']):
+            ...
+            for resonance in search.Step():
+                resonance['id'] # 0, 1, ... in the order of the first wide sweep, the same at every step
+                resonance['f0'], resonance['linewidth'], resonance['depth'] # [Hz], [Hz], [dB]
+                resonance['data'] # stlab data frame of the narrow sweep, for saving
+            search.points # VNA points measured so far
+
+The VNA is set with SCPI commands common to the ZND, ZNB and FieldFox
+(SENS:FREQ:STAR/STOP, SENS:SWE:POIN) and read with MeasureScreen_pd().
+find_dips and dip_center work on any trace, without an instrument.
+'''
+
+import numpy as np
+
+
+def _running_median(y, window):
+    window = max(3, window | 1) # odd
+    padded = np.pad(y, window//2, mode = 'edge')
+    return np.median(np.lib.stride_tricks.sliding_window_view(padded, window), axis = 1)
+
+
+def find_dips(frequency, amp_dB, prominence = 3., count = None, background_window = None, min_separation = None):
+    ''' Frequencies of the dips deeper than prominence [dB] below the running-median background,
+    deepest first; returns (frequencies, depths)
+    background_window: points of the running median (default len/20), wider than the dips
+    min_separation: [Hz] dips closer than this are counted once (default: 2 points)
+    '''
+    frequency = np.asarray(frequency, dtype = float)
+    amp_dB = np.asarray(amp_dB, dtype = float)
+    if background_window is None:
+        background_window = max(5, len(amp_dB)//20)
+    if min_separation is None:
+        min_separation = 2*np.abs(frequency[1] - frequency[0])
+    residual = amp_dB - _running_median(amp_dB, background_window)
+
+    minima = np.flatnonzero((residual[1:-1] <= residual[:-2]) & (residual[1:-1] < residual[2:])) + 1
+    minima = minima[residual[minima] < -prominence]
+    minima = minima[np.argsort(residual[minima])] # deepest first
+
+    dips = []
+    for index in minima:
+        if all(np.abs(frequency[index] - frequency[other]) >= min_separation for other in dips):
+            dips.append(index)
+        if count is not None and len(dips) == count:
+            break
+    return frequency[dips], -residual[dips]
+
+
+def dip_center(frequency, amp_dB):
+    ''' Center, full width at half depth (in linear power) and depth [dB] of the deepest dip of a narrow sweep '''
+    frequency = np.asarray(frequency, dtype = float)
+    power = 10**(np.asarray(amp_dB, dtype = float)/10)
+    index = int(np.argmin(power))
+    background = np.median(np.concatenate((power[:len(power)//10 + 1], power[-(len(power)//10) - 1:])))
+    depth = 10*np.log10(background/power[index])
+
+    center = frequency[index]
+    if 0 < index < len(power) - 1: # parabola through the 3 lowest points
+        y0, y1, y2 = power[index - 1:index + 2]
+        curvature = y0 - 2*y1 + y2
+        if curvature > 0:
+            center += 0.5*(y0 - y2)/curvature*(frequency[index + 1] - frequency[index])
+
+    half = 0.5*(background + power[index])
+    left = index
+    while left > 0 and power[left] < half:
+        left -= 1
+    right = index
+    while right < len(power) - 1 and power[right] < half:
+        right += 1
+    def crossing(a, b): # linear interpolation of the half level between the points a and b
+        if power[a] == power[b]:
+            return frequency[a]
+        return frequency[a] + (half - power[a])/(power[b] - power[a])*(frequency[b] - frequency[a])
+    linewidth = crossing(right - 1, right) - crossing(left + 1, left)
+    return center, abs(linewidth), depth
+
+
+class ResonanceSearch:
+    def __init__(self, VNA, start, stop, parameter = 'S21', wide_points = 4001, wide_ifbw = 1e3,
+            zoom_points = 101, zoom_ifbw = 100., zoom_linewidths = 10, min_span = 1e6, max_span = 50e6,
+            max_resonances = 3, prominence = 3., max_shift = 200e6):
+        ''' VNA: stlab VNA (RS_ZND, FieldFox through stlab.adi, ...)
+            start, stop: [Hz] range of the wide sweep
+            parameter: 'S21' or 'S11', column of the data frame
+            wide_points, wide_ifbw: the fast sweep looking for the resonances
+            zoom_points, zoom_ifbw: the narrow sweeps around each resonance
+            zoom_linewidths: span of a narrow sweep in linewidths of the resonance, within [min_span, max_span] [Hz]
+            max_resonances: number of dips followed (deepest of the wide sweep)
+            prominence: [dB] depth below the background for a dip to count
+            max_shift: [Hz] farthest a lost resonance is looked for from its last frequency
+        '''
+        self.VNA = VNA
+        self.start = start
+        self.stop = stop
+        self.parameter = parameter
+        self.wide_points = wide_points
+        self.wide_ifbw = wide_ifbw
+        self.zoom_points = zoom_points
+        self.zoom_ifbw = zoom_ifbw
+        self.zoom_linewidths = zoom_linewidths
+        self.min_span = min_span
+        self.max_span = max_span
+        self.max_resonances = max_resonances
+        self.prominence = prominence
+        self.max_shift = max_shift
+        self.tracked = [] # [id, center, span] of the followed resonances
+        self.next_id = 0
+        self.points = 0
+        self.wide_sweeps = 0
+        self.wide = None # data frame of the last wide sweep
+
+    def Sweep(self, start, stop, points, ifbw):
+        self.VNA.write('SENS:FREQ:STAR ' + str(start))
+        self.VNA.write('SENS:FREQ:STOP ' + str(stop))
+        self.VNA.write('SENS:SWE:POIN ' + str(int(points)))
+        self.VNA.SetIFBW(ifbw)
+        self.points += points
+        return self.VNA.MeasureScreen_pd()
+
+    def _wide_dips(self, count = None):
+        ''' Fast sweep of the whole range; (dips, deepest first, and the span of a window on one of them) '''
+        self.wide = self.Sweep(self.start, self.stop, self.wide_points, self.wide_ifbw)
+        self.wide_sweeps += 1
+        frequency = np.array(self.wide['Frequency (Hz)'])
+        centers, depths = find_dips(frequency, np.array(self.wide[self.parameter + 'dB (dB)']), self.prominence, count)
+        return centers, np.clip(4*np.abs(frequency[1] - frequency[0]), self.min_span, self.max_span)
+
+    def Wide(self):
+        ''' Fast sweep of the whole range; starts following its deepest dips, with new ids '''
+        centers, span = self._wide_dips(self.max_resonances)
+        self.tracked = [[self.next_id + n, f, span] for n, f in enumerate(centers)]
+        self.next_id += len(centers)
+        return centers
+
+    def Reacquire(self, lost, kept):
+        ''' Wide sweep for the lost resonances ([id, center, span]): each one takes the free dip nearest to its
+        last center, within max_shift, away from the windows of the resonances kept; returns the ones found again
+        '''
+        centers, span = self._wide_dips()
+        free = [f for f in centers if all(abs(f - center) > window/2 for _, center, window in kept)]
+        found = []
+        for resonance in sorted(lost, key = lambda resonance: min([abs(f - resonance[1]) for f in free] or [np.inf])):
+            if not free:
+                break
+            nearest = min(free, key = lambda f: abs(f - resonance[1]))
+            if abs(nearest - resonance[1]) <= self.max_shift:
+                free.remove(nearest)
+                found.append([resonance[0], nearest, span])
+        return found
+
+    def Zoom(self, center, span):
+        ''' Narrow sweep; returns the resonance found in it (None if no dip) '''
+        data = self.Sweep(center - span/2, center + span/2, self.zoom_points, self.zoom_ifbw)
+        frequency = np.array(data['Frequency (Hz)'])
+        f0, linewidth, depth = dip_center(frequency, np.array(data[self.parameter + 'dB (dB)']))
+        edge = 0.1*span
+        found = depth > self.prominence and frequency[0] + edge < f0 < frequency[-1] - edge
+        return {'f0': f0, 'linewidth': linewidth, 'depth': depth, 'data': data, 'found': found}
+
+    def Follow(self, resonance):
+        ''' Narrow sweep of a followed resonance [id, center, span], widened while the resonance is not in it '''
+        identity, center, span = resonance
+        result = self.Zoom(center, span)
+        while not result['found'] and span < self.max_span: # moved out of the window or too wide for it
+            span = min(4*span, self.max_span)
+            result = self.Zoom(result['f0'] if result['depth'] > self.prominence else center, span)
+        if result['found']:
+            resonance[1] = result['f0']
+            resonance[2] = np.clip(self.zoom_linewidths*result['linewidth'], self.min_span, self.max_span)
+        result['id'] = identity
+        return result
+
+    def Step(self):
+        ''' One gate step: narrow sweeps around the followed resonances (a wide sweep first if none),
+        in the order of their ids; a lost resonance is looked for in a wide sweep and dropped if not there
+        '''
+        if not self.tracked:
+            self.Wide()
+        results = {resonance[0]: self.Follow(resonance) for resonance in self.tracked}
+        lost = [resonance for resonance in self.tracked if not results[resonance[0]]['found']]
+        if lost:
+            kept = [resonance for resonance in self.tracked if results[resonance[0]]['found']]
+            found = self.Reacquire(lost, kept)
+            for resonance in found:
+                results[resonance[0]] = self.Follow(resonance)
+            self.tracked = sorted(kept + [resonance for resonance in found if results[resonance[0]]['found']])
+        return [results[identity] for identity in sorted(results)]
@@ -0,0 +1,333 @@
+''' Circle fit of notch and reflection resonators, in the measurement loop
+
+f0, Q_i and Q_c were only fitted offline, after the run. fit_resonator does the circle
+fit of one trace in numpy (a few ms for 1000 points): cable delay, algebraic circle fit,
+phase vs frequency fit for f0 and Q_l, then the environment (amplitude and phase of the
+off-resonant point) is divided out and Q_c and Q_i follow from the circle diameter
+and rotation. ResonatorFitter runs the fits in a separate python process, so the sweep
+goes on while the previous trace is fitted.
+
+    Usage:
+        fitter = ResonatorFitter('notch', span = 20e6, max_residual = 0.05) # fit +-10 MHz around the deepest point
+        fitter.start()
+        for count, gate_voltage in enumerate(gate_pattern):
+            trace = fetch.Measure()
+            fitter.submit(count, trace.frequency, trace.S['S21'])
+            for index, fit in fitter.results(): # the fits finished so far, never waits
+                fit['f0'], fit['kappa'], fit['Qi'], fit['residual']
+            if fitter.drifted: # 5 bad fits in a row
+                break
+        for index, fit in fitter.close(): # the last ones
+            ...
+
+    Model (Probst et al., Rev. Sci. Instrum. 86, 024706 (2015)):
+        notch       S21 = a e^(i alpha) e^(-2 pi i f delay) [1 - (Ql/|Qc|) e^(i phi) / (1 + 2i Ql (f/f0 - 1))]
+        reflection  S11 = a e^(i alpha) e^(-2 pi i f delay) [1 - 2 (Ql/|Qc|) e^(i phi) / (1 + 2i Ql (f/f0 - 1))]
+        1/Qi = 1/Ql - cos(phi)/|Qc|;  kappa = f0/Ql, kappa_i = f0/Qi, kappa_c = f0/|Qc| [Hz]
+
+residual is the rms distance of the points to the fitted circle model, relative to the
+off-resonant amplitude a: the noise and the ripple of the background for a good fit, and
+much more while the resonance is at the window edge. It does not tell a good fit from a
+flat trace or a resonance entirely outside the window (the circle then fits the ripple,
+with the same small residual): 'problem' holds the reasons a fit is implausible (circle
+too small, f0 too close to the edge, linewidth not within the window, f0 undetermined,
+negative Qi), and ResonatorFitter counts those fits as bad.
+'''
+
+import sys
+import queue
+import pickle
+import threading
+import subprocess
+import numpy as np
+
+
+def circle_fit(z):
+    ''' Algebraic (Kasa) circle fit: center (complex), radius, rms distance of the points to the circle '''
+    x, y = z.real, z.imag
+    A = np.column_stack((x, y, np.ones(len(z))))
+    (D, E, F), *_ = np.linalg.lstsq(A, -(x**2 + y**2), rcond = None)
+    center = -D/2 - 1j*E/2
+    radius = np.sqrt(max(np.abs(center)**2 - F, 0.))
+    return center, radius, np.sqrt(np.mean((np.abs(z - center) - radius)**2))
+
+
+def _phase_model(frequency, theta0, Ql, f0):
+    return theta0 + 2*np.arctan(2*Ql*(1 - frequency/f0))
+
+
+def _fit_phase(frequency, theta, p, iterations = 50):
+    ''' Levenberg-Marquardt fit of theta(f) = theta0 + 2 arctan(2 Ql (1 - f/f0)); p = [theta0, Ql, f0]
+    returns the parameters and their covariance matrix
+    '''
+    p = np.array(p, dtype = float)
+    damping = 1e-3
+    def residual(p):
+        return np.angle(np.exp(1j*(theta - _phase_model(frequency, *p)))) # wrapped to +-pi
+    def jacobian(p):
+        theta0, Ql, f0 = p
+        u = 2*Ql*(1 - frequency/f0)
+        du = 2/(1 + u**2)
+        J = np.column_stack((np.ones(len(frequency)), du*2*(1 - frequency/f0), du*2*Ql*frequency/f0**2))
+        scale = np.sqrt(np.sum(J**2, axis = 0)) + 1e-300 # the parameters differ by 10 orders of magnitude
+        return J/scale, scale
+    r = residual(p)
+    cost = np.sum(r**2)
+    for i in range(iterations):
+        Js, scale = jacobian(p)
+        H = Js.T @ Js
+        g = Js.T @ r
+        while damping <= 1e10:
+            step = np.linalg.solve(H + damping*np.diag(np.diag(H) + 1e-12), g)/scale
+            trial = p + step
+            r_trial = residual(trial)
+            cost_trial = np.sum(r_trial**2)
+            if cost_trial < cost:
+                damping = max(damping/10, 1e-12)
+                break
+            damping *= 10
+        else:
+            break
+        converged = cost - cost_trial < 1e-12*cost
+        p, r, cost = trial, r_trial, cost_trial
+        if converged or not frequency[0] <= p[2] <= frequency[-1]: # f0 left the trace: not a resonance
+            break
+    Js, scale = jacobian(p)
+    covariance = np.linalg.pinv(Js.T @ Js)/np.outer(scale, scale)*cost/max(len(frequency) - 3, 1)
+    return p, covariance
+
+
+def _delay_guess(frequency, S):
+    ''' Slope of the phase over the first and last 10% of the points, where the resonance hardly turns it
+    (each edge on its own: an overcoupled resonance turns the phase by 2 pi in between)
+    '''
+    n = max(3, len(frequency)//10)
+    phase = np.unwrap(np.angle(S))
+    slopes = [np.polyfit(frequency[edge], phase[edge], 1)[0] for edge in (slice(0, n), slice(-n, None))]
+    return -np.mean(slopes)/(2*np.pi)
+
+
+def _delay_refine(frequency, S, delay, iterations = 30, grid = 25, width = 0.25):
+    ''' Delay for which the corrected points lie best on a circle: grid scan over +-width/span
+    (the residual has several minima, a wrong delay bends the background into a circle too)
+    then golden section
+    '''
+    span = frequency[-1] - frequency[0]
+    def cost(delay):
+        return circle_fit(S*np.exp(2j*np.pi*frequency*delay))[2]
+    delays = delay + np.linspace(-width, width, grid)/span
+    best = int(np.argmin([cost(d) for d in delays]))
+    low, high = delays[max(best - 1, 0)], delays[min(best + 1, grid - 1)]
+    golden = (np.sqrt(5) - 1)/2
+    a, b = high - golden*(high - low), low + golden*(high - low)
+    cost_a, cost_b = cost(a), cost(b)
+    for i in range(iterations):
+        if cost_a < cost_b:
+            high, b, cost_b = b, a, cost_a
+            a = high - golden*(high - low)
+            cost_a = cost(a)
+        else:
+            low, a, cost_a = a, b, cost_b
+            b = low + golden*(high - low)
+            cost_b = cost(b)
+    return (low + high)/2
+
+
+def fit_resonator(frequency, S, kind = 'notch', span = None, delay = None, guess = None, min_depth = 0.05, edge = 2., max_f0_error = 0.1):
+    ''' Circle fit of a single resonance; returns a dict with f0, Ql, Qi, Qc, phi, kappa, kappa_i, kappa_c,
+    a, alpha, delay and residual (see the module docstring), and the standard errors f0_err, Ql_err,
+    Qi_err and Qc_err (of the phase fit and the circle radius; the delay and the circle center are taken
+    as exact, so they are lower bounds, 2-3 times below the scatter of repeated fits)
+    kind: 'notch' (S21 of a side-coupled resonator) or 'reflection' (S11)
+    span: [Hz] only the points within span/2 of the deepest point are fitted (None: the whole trace)
+    delay: [s] cable delay if known (None: fitted)
+    guess: starting point, e.g. the fit of the neighbouring trace: its delay is only refined
+        in a narrow range, its f0 and Ql start the phase fit (missing keys are estimated)
+    min_depth, edge, max_f0_error: plausibility checks, see plausibility; the reasons a fit fails
+        them are in 'problem' ('' for a plausible fit)
+    '''
+    guess = {} if guess is None else guess
+    if kind not in ['notch', 'reflection']:
+        raise ValueError('Unknown resonator kind: %s' % kind)
+    frequency = np.asarray(frequency, dtype = float)
+    S = np.asarray(S, dtype = complex)
+    if span is not None:
+        center = frequency[np.argmin(np.abs(S))]
+        window = np.abs(frequency - center) <= span/2
+        frequency, S = frequency[window], S[window]
+
+    if delay is None and 'delay' in guess:
+        delay = _delay_refine(frequency, S, guess['delay'], iterations = 15, grid = 5, width = 0.02)
+    elif delay is None:
+        delay = _delay_refine(frequency, S, _delay_guess(frequency, S))
+    z = S*np.exp(2j*np.pi*frequency*delay)
+    zc, r, circle_residual = circle_fit(z)
+
+    # starting point: f0 farthest from the off-resonant point (the edges), Ql from the width at half power
+    n = max(3, len(z)//20)
+    distance = np.abs(z - np.mean(np.r_[z[:n], z[-n:]]))
+    smooth = max(1, len(z)//100)
+    distance = np.convolve(distance, np.ones(smooth)/smooth, mode = 'same')
+    k = int(np.argmax(distance))
+    if frequency[0] < guess.get('f0', -np.inf) < frequency[-1]:
+        k = int(np.argmin(np.abs(frequency - guess['f0'])))
+    f0 = frequency[k]
+    width = np.sum(distance**2 > distance[k]**2/2)*np.abs(frequency[1] - frequency[0])
+    Ql = guess.get('Ql', f0/max(width, 2*np.abs(frequency[1] - frequency[0])))
+    w = z - zc
+    turn = np.angle(w[1:]/w[:-1])[max(k - n, 0):k + n]
+    Ql = abs(Ql)*(1 if np.sum(turn) < 0 else -1) # the sign follows the phase convention of the VNA
+    (theta0, Ql, f0), covariance = _fit_phase(frequency, np.angle(w), [np.angle(w[k]), Ql, f0])
+    model = zc + r*np.exp(1j*_phase_model(frequency, theta0, Ql, f0))
+
+    off_resonance = zc + r*np.exp(1j*(theta0 + np.pi))
+    a, alpha = np.abs(off_resonance), np.angle(off_resonance)
+    zc_n = zc/off_resonance
+    diameter = 2*r/a
+    phi = np.angle(1 - zc_n)
+    Ql = np.abs(Ql)
+    Qc = Ql/diameter if kind == 'notch' else 2*Ql/diameter
+    Qi = 1/(1/Ql - np.cos(phi)/Qc)
+    residual = np.sqrt(np.mean(np.abs(z - model)**2))/a
+
+    # standard errors: f0 and Ql from the phase fit, the diameter from the scatter around the circle
+    f0_err, Ql_err = np.sqrt(np.abs(covariance[2, 2])), np.sqrt(np.abs(covariance[1, 1]))
+    diameter_err = 2*circle_residual/np.sqrt(len(z))/a
+    Qc_err = Qc*np.hypot(Ql_err/Ql, diameter_err/diameter)
+    Qi_err = Qi**2*np.hypot(Ql_err/Ql**2, np.cos(phi)*Qc_err/Qc**2)
+
+    fit = {'f0': f0, 'Ql': Ql, 'Qi': Qi, 'Qc': Qc, 'phi': phi,
+        'kappa': f0/Ql, 'kappa_i': f0/Qi, 'kappa_c': f0/Qc,
+        'a': a, 'alpha': alpha, 'delay': delay, 'residual': residual, 'depth': diameter,
+        'f0_err': f0_err, 'Ql_err': Ql_err, 'Qi_err': Qi_err, 'Qc_err': Qc_err}
+    fit['problem'] = plausibility(fit, frequency, min_depth, edge, max_f0_error)
+    return fit
+
+
+def plausibility(fit, frequency, min_depth = 0.05, edge = 2., max_f0_error = 0.1):
+    ''' '' if the fit looks like a resonance inside the fitted window, else the reasons it does not
+    min_depth: smallest circle diameter 2r/a (a flat trace or a ripple gives a small circle)
+    edge: f0 at least this many linewidths kappa inside the window
+    max_f0_error: largest f0_err, relative to kappa
+    The linewidth must also lie between the point spacing and a quarter of the window.
+    '''
+    step = np.abs(frequency[1] - frequency[0])
+    window = frequency[-1] - frequency[0]
+    problems = []
+    if not fit['depth'] >= min_depth:
+        problems.append('depth %.3g below %g' % (fit['depth'], min_depth))
+    if not min(fit['f0'] - frequency[0], frequency[-1] - fit['f0']) >= edge*fit['kappa']:
+        problems.append('f0 within %g linewidths of the window edge' % edge)
+    if not step <= fit['kappa'] <= window/4:
+        problems.append('linewidth %.3g Hz outside %.3g-%.3g Hz' % (fit['kappa'], step, window/4))
+    if not fit['f0_err'] <= max_f0_error*fit['kappa']:
+        problems.append('f0 error %.2g linewidths' % (fit['f0_err']/fit['kappa']))
+    if not fit['Qi'] > 0:
+        problems.append('negative Qi')
+    return '; '.join(problems)
+
+
+FIT_COLUMNS = {'f0 (Hz)': 'f0', 'Ql ()': 'Ql', 'Qi ()': 'Qi', 'Qc ()': 'Qc', 'phi (rad)': 'phi',
+    'kappa (Hz)': 'kappa', 'kappa_i (Hz)': 'kappa_i', 'kappa_c (Hz)': 'kappa_c', 'fit residual ()': 'residual'}
+
+
+def fit_columns(fit):
+    ''' The fit as columns for stlab files (NaN for a failed fit) '''
+    return {column: fit.get(key, np.nan) for column, key in FIT_COLUMNS.items()}
+
+
+class ResonatorFitter:
+    ''' fit_resonator in a separate python process (this file run as a script, like live_view.LiveDisplay)
+    max_residual, patience: drifted becomes True once patience fits in a row failed, were implausible
+        (fit['problem']) or had a residual above max_residual (the resonance left the window),
+        so the run can be stopped early
+    checks: min_depth, edge, max_f0_error of fit_resonator
+    '''
+    def __init__(self, kind = 'notch', span = None, delay = None, max_residual = None, patience = 5, **checks):
+        self.options = dict(kind = kind, span = span, delay = delay, **checks)
+        self.max_residual = max_residual
+        self.patience = patience
+        self.bad_fits = 0 # in a row
+        self.process = None
+        self.done = queue.Queue()
+        self.submitted = 0
+        self.received = 0
+
+    @property
+    def drifted(self):
+        return self.max_residual is not None and self.bad_fits >= self.patience
+
+    def start(self):
+        self.process = subprocess.Popen([sys.executable, __file__], stdin = subprocess.PIPE, stdout = subprocess.PIPE)
+        self.lock = threading.Lock()
+        self.reader = threading.Thread(target = self._read, daemon = True)
+        self.reader.start()
+
+    def _read(self):
+        while True:
+            try:
+                self.done.put(pickle.load(self.process.stdout))
+            except (EOFError, OSError, pickle.UnpicklingError):
+                self.done.put(None)
+                return
+
+    def submit(self, index, frequency, S):
+        ''' Fit the trace S(frequency) of sweep step index (the index comes back with the result) '''
+        with self.lock:
+            pickle.dump((index, np.asarray(frequency), np.asarray(S), self.options), self.process.stdin, protocol = pickle.HIGHEST_PROTOCOL)
+            self.process.stdin.flush()
+            self.submitted += 1
+
+    def results(self, wait = False):
+        ''' [(index, fit)] of the fits finished since the last call; a failed fit is {'error': message} '''
+        results = []
+        while self.received < self.submitted:
+            try:
+                result = self.done.get(block = wait and not results)
+            except queue.Empty:
+                break
+            if result is None: # worker gone
+                self.submitted = self.received
+                break
+            self.received += 1
+            results.append(result)
+            fit = result[1]
+            bad = 'error' in fit or fit['problem'] or (self.max_residual is not None and fit['residual'] > self.max_residual)
+            self.bad_fits = self.bad_fits + 1 if bad else 0
+            if wait and self.received == self.submitted:
+                break
+        return results
+
+    def close(self):
+        ''' Wait for the pending fits and stop the worker; returns their results '''
+        if self.process is None:
+            return []
+        results = []
+        while self.received < self.submitted:
+            batch = self.results(wait = True)
+            if not batch:
+                break
+            results += batch
+        self.process.stdin.close()
+        self.process.wait()
+        self.process = None
+        return results
+
+
+def _worker_main():
+    stdin, stdout = sys.stdin.buffer, sys.stdout.buffer
+    while True:
+        try:
+            index, frequency, S, options = pickle.load(stdin)
+        except (EOFError, OSError):
+            return
+        try:
+            fit = fit_resonator(frequency, S, **options)
+        except Exception as error: # the sweep goes on, the fit of this step is missing
+            fit = {'error': repr(error)}
+        pickle.dump((index, fit), stdout, protocol = pickle.HIGHEST_PROTOCOL)
+        stdout.flush()
+
+
+if __name__ == '__main__':
+    _worker_main()
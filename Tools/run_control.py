@@ -0,0 +1,173 @@
+''' Stop / pause / faster / slower control of a running measurement
+
+The scripts open a 100x100 pygame window and poll pygame.event.get() inside the
+measurement loop (some of them a thousand times after every step). RunControl
+watches the keyboard window, and optionally a local TCP socket for headless or
+remote runs, in a background thread and exposes the commands as thread-safe flags,
+so checking them in the loop costs nothing.
+
+    Usage:
+        control = RunControl(keys = {'e': 'stop'}) # key -> command, the default is 's' for stop
+        control.start()
+        for count, V_bias in enumerate(V_bias_list):
+            if control.stopped:
+                break
+            control.wait_if_paused()
+            ...
+            control.sleep(tdelay*control.slowdown) # returns early when stop is requested
+        control.close()
+
+    Remote control (with RunControl(port = 50007)):
+        echo stop | nc localhost 50007        # stop, pause, resume, faster, slower, status
+
+The commands are stop, pause (toggles), resume, faster (halves slowdown) and slower (doubles it).
+'''
+
+import time
+import socket
+import threading
+
+
+COMMANDS = ['stop', 'pause', 'resume', 'faster', 'slower', 'status']
+
+
+class RunControl:
+    def __init__(self, keys = None, window = True, port = None, poll_interval = 0.05, verbose = True):
+        ''' keys: {'s': 'stop', ...} key of the pygame window -> command
+            window: open the pygame window (False for headless runs)
+            port: listen for commands on localhost:port (None: no socket)
+            poll_interval: [s] how often the window events are read, in the background thread
+        '''
+        self.keys = {'s': 'stop'} if keys is None else keys
+        for command in self.keys.values():
+            if command not in COMMANDS:
+                raise ValueError('Unknown command: %s' % command)
+        self.window = window
+        self.port = port
+        self.poll_interval = poll_interval
+        self.verbose = verbose
+
+        self.lock = threading.Lock()
+        self.stop_event = threading.Event()
+        self.running = threading.Event() # cleared while paused
+        self.running.set()
+        self.speed = 0 # slowdown = 2**speed
+        self.closing = threading.Event()
+        self.threads = []
+        self.server = None
+
+    def start(self):
+        if self.window:
+            ready = threading.Event()
+            self._thread(self._watch_window, ready)
+            ready.wait(5) # the window exists before the measurement starts
+        if self.port is not None:
+            self.server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+            self.server.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+            self.server.bind(('127.0.0.1', self.port))
+            self.server.listen(1)
+            self.server.settimeout(self.poll_interval*10)
+            self._thread(self._watch_socket)
+        return self
+
+    def _thread(self, target, *args):
+        thread = threading.Thread(target = target, args = args, daemon = True)
+        thread.start()
+        self.threads.append(thread)
+
+    def _watch_window(self, ready):
+        ''' The window is created and polled in this thread, SDL wants both on the same thread '''
+        import pygame
+        pygame.init()
+        pygame.display.set_mode((100,100))
+        pygame.display.set_caption(' '.join('%s:%s' % item for item in self.keys.items()))
+        ready.set()
+        try:
+            while not self.closing.is_set():
+                for event in pygame.event.get():
+                    if event.type == pygame.QUIT: # closing the window stops the measurement
+                        self.request('stop')
+                    elif event.type == pygame.KEYDOWN:
+                        command = self.keys.get(pygame.key.name(event.key))
+                        if command is not None:
+                            self.request(command)
+                time.sleep(self.poll_interval)
+        finally:
+            pygame.display.quit()
+
+    def _watch_socket(self):
+        while not self.closing.is_set():
+            try:
+                connection, address = self.server.accept()
+            except socket.timeout:
+                continue
+            except OSError: # closed
+                return
+            self._thread(self._serve, connection)
+
+    def _serve(self, connection):
+        with connection:
+            for line in connection.makefile('r'):
+                command = line.strip().lower()
+                if not command:
+                    continue
+                if command not in COMMANDS:
+                    connection.sendall(b'unknown command\n')
+                    continue
+                self.request(command)
+                connection.sendall((self.status() + '\n').encode())
+
+    def request(self, command):
+        ''' Apply a command (also callable from the script) '''
+        with self.lock:
+            if command == 'stop':
+                self.stop_event.set()
+                self.running.set() # release wait_if_paused
+            elif command == 'pause':
+                if self.running.is_set():
+                    self.running.clear()
+                else:
+                    self.running.set()
+            elif command == 'resume':
+                self.running.set()
+            elif command == 'faster':
+                self.speed -= 1
+            elif command == 'slower':
+                self.speed += 1
+        if self.verbose and command != 'status':
+            print('--------------------------------')
+            print('%s requested (%s)' % (command, self.status()))
+            print('--------------------------------')
+
+    def status(self):
+        state = 'stopped' if self.stopped else 'paused' if self.paused else 'running'
+        return '%s, slowdown x%g' % (state, self.slowdown)
+
+    @property
+    def stopped(self):
+        return self.stop_event.is_set()
+
+    @property
+    def paused(self):
+        return not self.running.is_set()
+
+    @property
+    def slowdown(self):
+        ''' factor for the delays of the script: 2**(slower - faster requests) '''
+        return 2.**self.speed
+
+    def wait_if_paused(self):
+        ''' Block while paused; returns False if stop was requested '''
+        self.running.wait()
+        return not self.stopped
+
+    def sleep(self, seconds):
+        ''' time.sleep that returns early (True) when stop is requested '''
+        return self.stop_event.wait(seconds)
+
+    def close(self):
+        self.closing.set()
+        if self.server is not None:
+            self.server.close()
+        for thread in self.threads:
+            thread.join(1)
@@ -0,0 +1,108 @@
+''' Concurrent instrument I/O within one sweep step
+
+The scripts do everything in sequence: ramp the gate, read the leakage current, sleep,
+measure the VNA, read the temperature, write the file. Most of these do not depend on
+each other, so the step takes the sum of all the instrument times. StepScheduler runs
+them on a thread pool: calls on the same instrument are serialized in the order they
+were submitted (per-instrument lock), calls on different instruments overlap, and
+'after' adds the dependencies that are physical rather than per-instrument (the VNA
+waits for the gate to settle). The step then takes as long as its slowest chain.
+
+    Usage:
+        scheduler = StepScheduler()
+        written = None
+        for count, gate_voltage in enumerate(gate_pattern):
+            ramp = scheduler.submit(gate_dev, gate_dev.RampVoltage, gate_voltage, tt=ramp_time, steps = 5)
+            leakage = scheduler.submit(gate_dev, gate_dev.GetCurrent) # after the ramp: same instrument
+            temperature = scheduler.submit(tempdev, tempdev.GetTemperature, 'B') # during the ramp
+            settle = scheduler.submit(None, time.sleep, time_step, after = [ramp]) # None: no instrument
+            trace = scheduler.submit(VNA, fetch.Measure, after = [settle])
+            trace, leakage_current, temperature = scheduler.gather(trace, leakage, temperature)
+            ...
+            if written is not None:
+                written.result() # raises a failed write of the previous step here, not at the end
+            written = scheduler.submit(Data, stlab.savedict, Data, data) # written during the next step
+        scheduler.close() # waits for the pending writes
+
+submit returns a concurrent.futures.Future; an exception in a call is raised again by
+gather (or result()), and the calls depending on it fail with the same exception. A failed
+call nobody asked for the result of is kept until wait() or close() raises it.
+Calling an instrument directly from the script while calls on it may still be pending
+should be done inside 'with scheduler.lock(instrument):'.
+'''
+
+import threading
+from concurrent.futures import ThreadPoolExecutor, wait
+
+
+class StepScheduler:
+    def __init__(self, max_workers = 8):
+        ''' max_workers: number of calls running at the same time (threads of the pool) '''
+        self.pool = ThreadPoolExecutor(max_workers = max_workers)
+        self.instruments = {} # id(instrument): [instrument, lock, last future]
+        self.pending = []
+        self.guard = threading.Lock()
+
+    def _entry(self, instrument):
+        entry = self.instruments.get(id(instrument))
+        if entry is None or entry[0] is not instrument:
+            entry = [instrument, threading.Lock(), None] # the instrument is kept, so its id is not reused
+            self.instruments[id(instrument)] = entry
+        return entry
+
+    def lock(self, instrument):
+        ''' Lock of the instrument, for direct calls from the script '''
+        with self.guard:
+            return self._entry(instrument)[1]
+
+    def submit(self, instrument, func, *args, after = (), **kwargs):
+        ''' Run func(*args, **kwargs) once the previous calls on instrument and the futures in after are done
+            instrument: any object (the device, the data file, a name); None runs without serialization
+        '''
+        with self.guard:
+            depends = list(after)
+            lock = None
+            if instrument is not None:
+                entry = self._entry(instrument)
+                lock = entry[1]
+                if entry[2] is not None:
+                    depends.append(entry[2])
+            # the dependencies were submitted before, so they are started before this call takes a thread
+            future = self.pool.submit(self._run, depends, lock, func, args, kwargs)
+            if instrument is not None:
+                entry[2] = future
+            self.pending = [f for f in self.pending if not f.done() or f.exception() is not None] + [future] # failed: kept until reported
+        return future
+
+    @staticmethod
+    def _run(depends, lock, func, args, kwargs):
+        for future in depends:
+            future.result() # raises the exception of a failed dependency
+        if lock is None:
+            return func(*args, **kwargs)
+        with lock:
+            return func(*args, **kwargs)
+
+    def gather(self, *futures):
+        ''' Results of the futures, in the same order (a single result for a single future) '''
+        results = [future.result() for future in futures]
+        return results[0] if len(results) == 1 else results
+
+    def wait(self):
+        ''' Wait for all submitted calls; raises the first exception among them '''
+        with self.guard:
+            pending = list(self.pending)
+        wait(pending)
+        for future in pending:
+            future.result()
+
+    def close(self):
+        ''' Wait for all submitted calls and stop the threads; raises the first exception among them '''
+        try:
+            self.wait()
+        finally:
+            self.pool.shutdown()
+
+    def shutdown(self):
+        ''' Wait for the calls still queued, without raising their exceptions (clean-up after an error) '''
+        self.pool.shutdown()
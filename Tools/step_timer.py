@@ -0,0 +1,172 @@
+''' Time spent in each phase of the steps of a sweep
+
+The scripts print the elapsed time and nothing tells whether a gate step goes into the
+ramp, the VNA sweep, the transfer, the fit, the file or the plot. StepTimer times named
+phases with context managers (a perf_counter pair and a dict update, negligible next to
+an instrument call), closes a step with step(), appends the times of every step to a
+sidecar log (one JSON line per step) and sums them up in percentiles and histograms.
+
+    Usage:
+        timer = StepTimer()
+        timer.log_to(os.path.splitext(Data.name)[0] + '_timing.jsonl') # optional, also after the first steps
+        for count, gate_voltage in enumerate(gate_pattern):
+            with timer('ramp'):
+                gate.RampVoltage(gate_voltage)
+            measured = scheduler.submit(VNA, timer.wrap('acquire', fetch.Measure)) # in a worker thread
+            ...
+            timer.step(gate = gate_voltage) # extra values go to the log
+            data.update(timer.columns()) # or as extra columns of the previous step: 't_ramp (s)', ...
+        timer.report() # per phase: mean, median, 90%, max, share of the run, histogram
+        timer.close()
+
+Phases running in parallel (scheduler threads) are each counted fully, so their shares
+can add up to more than 100 %. Phases of the same name in one step are added up.
+'''
+
+import json
+import time
+import threading
+import numpy as np
+
+PHASES = ['ramp', 'settle', 'acquire', 'transfer', 'fit', 'write', 'plot'] # usual names, any other name works
+_BARS = ' .:-=+*#%@'
+
+
+class _Phase:
+    def __init__(self, timer, name):
+        self.timer = timer
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exception):
+        self.timer.add(self.name, time.perf_counter() - self.start)
+        return False
+
+
+class _NoPhase:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exception):
+        return False
+
+
+class StepTimer:
+    def __init__(self, log = None, enabled = True):
+        ''' log: filename of the sidecar log (None: kept in memory only)
+            enabled: False turns every timer into a no-op (for helpers timed only on request)
+        '''
+        self.enabled = enabled
+        self.lock = threading.Lock()
+        self.current = {}
+        self.steps = [] # times of every closed step, {phase: s, 'time': wall time of the step}
+        self.names = []
+        self.log = None
+        self.t_step = time.perf_counter()
+        self.t_start = self.t_step
+        if log is not None:
+            self.log_to(log)
+
+    def __call__(self, name):
+        ''' Context manager timing the phase name '''
+        return _Phase(self, name) if self.enabled else _NoPhase()
+
+    def wrap(self, name, func):
+        ''' func timed as the phase name at every call (for functions submitted to a StepScheduler) '''
+        if not self.enabled:
+            return func
+        def timed(*args, **kwargs):
+            with _Phase(self, name):
+                return func(*args, **kwargs)
+        return timed
+
+    def add(self, name, seconds):
+        with self.lock:
+            self.current[name] = self.current.get(name, 0.) + seconds
+            if name not in self.names:
+                self.names.append(name)
+
+    def step(self, **info):
+        ''' Close the step: returns its times, appended to the log with the values of info '''
+        if not self.enabled:
+            return {}
+        now = time.perf_counter()
+        with self.lock:
+            times, self.current = self.current, {}
+        times['time'] = now - self.t_step
+        self.t_step = now
+        self.steps.append(times)
+        if self.log is not None:
+            self._write(len(self.steps) - 1, times, info)
+        return times
+
+    def _write(self, index, times, info = {}):
+        line = dict(step = index, **info)
+        line.update({name: round(seconds, 6) for name, seconds in times.items()})
+        self.log.write(json.dumps(line) + '\n')
+        self.log.flush()
+
+    def log_to(self, filename):
+        ''' Write the steps so far and the next ones to filename '''
+        self.log = open(filename, 'w')
+        for index, times in enumerate(self.steps):
+            self._write(index, times)
+
+    def columns(self, unit = 's'):
+        ''' Times of the last closed step as data columns: {'t_ramp (s)': ..., 't_step (s)': ...} '''
+        if not self.steps:
+            return {}
+        last = self.steps[-1]
+        columns = {'t_%s (%s)' % (name, unit): last.get(name, 0.) for name in self.names}
+        columns['t_step (%s)' % unit] = last['time']
+        return columns
+
+    def times(self, name):
+        ''' (steps,) array of the time of phase name ('time': the whole step) in every closed step '''
+        return np.array([step.get(name, 0.) for step in self.steps])
+
+    def totals(self):
+        ''' {phase: total seconds} of the closed steps and the open one '''
+        with self.lock:
+            totals = dict(self.current)
+        for step in self.steps:
+            for name in self.names:
+                totals[name] = totals.get(name, 0.) + step.get(name, 0.)
+        return totals
+
+    def histogram(self, name, bins = 10):
+        ''' (counts, edges) of the times of phase name over the steps '''
+        return np.histogram(self.times(name), bins = bins)
+
+    def summary(self):
+        ''' {phase: {'mean', 'median', 'p90', 'max', 'total', 'share'}} over the closed steps, 'time' for the whole steps '''
+        wall = np.sum(self.times('time'))
+        summary = {}
+        for name in self.names + ['time']:
+            t = self.times(name)
+            if not len(t):
+                continue
+            summary[name] = {'mean': np.mean(t), 'median': np.median(t), 'p90': np.percentile(t, 90), 'max': np.max(t),
+                'total': np.sum(t), 'share': np.sum(t)/wall if wall > 0 else np.nan}
+        return summary
+
+    def report(self, bins = 10):
+        ''' Print the summary, with a text histogram of every phase between its min and max '''
+        summary = self.summary()
+        if not summary:
+            return
+        print('%d steps in %.1f s' % (len(self.steps), summary['time']['total']))
+        print('%-10s %10s %10s %10s %10s %7s  histogram' % ('phase', 'mean', 'median', '90%', 'max', 'share'))
+        for name, s in summary.items():
+            counts, edges = self.histogram(name, bins)
+            bars = ''.join(_BARS[int(np.ceil(c/counts.max()*(len(_BARS) - 1)))] for c in counts)
+            print('%-10s %8.1fms %8.1fms %8.1fms %8.1fms %6.1f%%  |%s| %.1f-%.1fms' % (name if name != 'time' else 'step',
+                1e3*s['mean'], 1e3*s['median'], 1e3*s['p90'], 1e3*s['max'], 100*s['share'], bars, 1e3*edges[0], 1e3*edges[-1]))
+
+    def close(self):
+        if self.log is not None:
+            self.log.close()
+            self.log = None
@@ -0,0 +1,212 @@
+''' Containers for the data collected during a sweep
+
+np.vstack / np.append copy the whole accumulated array on every step, which makes an
+N-step sweep O(N^2). SweepBuffer preallocates the (steps x points) array when the
+number of steps is known (gate and power patterns) and otherwise grows it by doubling
+(time and temperature runs), so adding a step only writes the new row.
+
+    Usage:
+        S_amp = SweepBuffer(steps=len(gate_pattern)) # points are taken from the first row
+        for count, gate_voltage in enumerate(gate_pattern):
+            ...
+            S_amp.append(amp_data)
+            plt.imshow(S_amp.data, ...) # view on the measured rows, no copy
+
+SweepStore keeps the steps of long (overnight, multi-day) runs on disk instead of in memory.
+'''
+
+import os
+import json
+import time
+import numpy as np
+
+
+def _retry(func, *args, attempts=50, wait=0.01):
+    ''' func(*args), tried again for up to attempts*wait [s] on PermissionError: on Windows a file
+    cannot be replaced while a reader has it open, nor opened while it is being replaced
+    '''
+    for attempt in range(attempts):
+        try:
+            return func(*args)
+        except PermissionError:
+            if attempt == attempts - 1:
+                raise
+            time.sleep(wait)
+
+
+class SweepBuffer:
+    def __init__(self, points=None, steps=None, dtype=float, initial_steps=64):
+        ''' points: length of a row (None for scalar steps, or taken from the first appended row)
+            steps: expected number of steps; None for open-ended sweeps
+            initial_steps: first allocation of an open-ended sweep
+        '''
+        self.points = points
+        self.steps = steps
+        self.dtype = dtype
+        self.initial_steps = initial_steps
+        self.count = 0
+        self.array = None
+        if points is not None or steps is not None:
+            self._allocate(() if points is None else (points,))
+
+    def _allocate(self, row_shape):
+        rows = self.steps if self.steps is not None else self.initial_steps
+        self.array = np.full((max(rows, 1),) + tuple(row_shape), np.nan, dtype=self.dtype)
+
+    def _grow(self):
+        new = np.full((2*self.array.shape[0],) + self.array.shape[1:], np.nan, dtype=self.dtype)
+        new[:self.count] = self.array[:self.count]
+        self.array = new
+
+    def append(self, row):
+        if self.array is None or (self.count == 0 and self.points is None and self.array.shape[1:] != np.shape(row)):
+            self._allocate(np.shape(row))
+        if self.count == self.array.shape[0]: # more steps than planned, or open-ended
+            self._grow()
+        self.array[self.count] = row
+        self.count += 1
+
+    @property
+    def data(self):
+        ''' view on the rows measured so far '''
+        if self.array is None:
+            return np.array([])
+        return self.array[:self.count]
+
+    @property
+    def last(self):
+        return self.array[self.count-1]
+
+    def __len__(self):
+        return self.count
+
+    def __array__(self, dtype=None, copy=None):
+        return self.data if dtype is None else self.data.astype(dtype)
+
+
+class SweepStore:
+    ''' Chunked on-disk store for long runs (frequency x time/temperature maps)
+
+    Every field (S21dB, temperature, ...) is kept in fixed-size .npy chunks that are
+    memory-mapped while they are written, so only the current chunk is in memory and
+    the rest lives on disk. The number of complete steps is written to index.json
+    (atomically, after the row is flushed), so if the script dies the store stays
+    readable up to the last complete step, and it can be opened with
+    SweepStore(path, mode='r') while the run is still writing.
+
+        Usage:
+            store = SweepStore(os.path.join(path, prefix+'.sweep'), axis=frequency)
+            while not STOP:
+                ...
+                store.append(S21dB=amp_data, S21Ph=phase_data, Temperature=temperature, Time=t)
+            store.close()
+
+            store = SweepStore(path_to_store, mode='r') # also from another process, during the run
+            S21dB = store.read('S21dB', start=-500) # the last 500 steps
+    '''
+    def __init__(self, path, axis=None, chunk_steps=256, mode='w', dtype=float):
+        ''' path: directory of the store (created for mode='w')
+            axis: the x axis of the rows (frequency), saved once as axis.npy
+            chunk_steps: steps per chunk file
+            mode: 'w' new store, 'a' continue an existing one, 'r' read only
+        '''
+        self.path = path
+        self.mode = mode
+        self.chunk = None # (chunk number, {field: memmap}) being written
+        if mode == 'w':
+            os.makedirs(path)
+            self.fields = None # field name -> (row shape, dtype), set on the first append
+            self.chunk_steps = int(chunk_steps)
+            self.dtype = np.dtype(dtype).str
+            self.count = 0
+            if axis is not None:
+                np.save(os.path.join(path, 'axis.npy'), np.asarray(axis))
+            self._write_index()
+        elif mode in ['a', 'r']:
+            self.refresh()
+        else:
+            raise ValueError('Unknown mode: %s' % mode)
+
+    @property
+    def axis(self):
+        name = os.path.join(self.path, 'axis.npy')
+        return np.load(name) if os.path.exists(name) else None
+
+    def refresh(self):
+        ''' Re-read the index (number of steps written so far) '''
+        with _retry(open, os.path.join(self.path, 'index.json')) as f:
+            index = json.load(f)
+        self.fields = None if index['fields'] is None else {name: (tuple(shape), dtype) for name, (shape, dtype) in index['fields'].items()}
+        self.chunk_steps = index['chunk_steps']
+        self.dtype = index['dtype']
+        self.count = index['count']
+
+    def _write_index(self):
+        fields = None if self.fields is None else {name: [list(shape), dtype] for name, (shape, dtype) in self.fields.items()}
+        index = {'fields': fields, 'chunk_steps': self.chunk_steps, 'dtype': self.dtype, 'count': self.count}
+        tmp = os.path.join(self.path, 'index.json.tmp')
+        with open(tmp, 'w') as f:
+            json.dump(index, f)
+            f.flush()
+            os.fsync(f.fileno())
+        _retry(os.replace, tmp, os.path.join(self.path, 'index.json')) # atomic: readers see the old or the new count
+
+    def _filename(self, name, number):
+        return os.path.join(self.path, '%s_%05d.npy' % (name, number))
+
+    def _open_chunk(self, number):
+        if self.chunk is not None:
+            self._close_chunk()
+        arrays = {}
+        for name, (shape, dtype) in self.fields.items():
+            filename = self._filename(name, number)
+            if os.path.exists(filename): # continuing after a restart
+                arrays[name] = np.load(filename, mmap_mode='r+')
+            else:
+                arrays[name] = np.lib.format.open_memmap(filename, mode='w+', dtype=dtype, shape=(self.chunk_steps,)+shape)
+                arrays[name][:] = np.nan
+        self.chunk = (number, arrays)
+
+    def _close_chunk(self):
+        for array in self.chunk[1].values():
+            array.flush()
+        self.chunk = None # drops the memmaps, the pages go back to the OS
+
+    def append(self, **row):
+        ''' Write one step; every call must give the same fields '''
+        assert self.mode != 'r', 'the store is opened read only'
+        if self.fields is None:
+            self.fields = {name: (np.shape(value), self.dtype) for name, value in row.items()}
+        assert set(row) == set(self.fields), 'fields of a step must be %s' % sorted(self.fields)
+
+        number, position = divmod(self.count, self.chunk_steps)
+        if self.chunk is None or self.chunk[0] != number:
+            self._open_chunk(number)
+        for name, value in row.items():
+            array = self.chunk[1][name]
+            array[position] = value
+            array.flush()
+        self.count += 1
+        self._write_index()
+
+    def read(self, name, start=0, stop=None):
+        ''' Copy of the steps start..stop of a field (negative values count from the end) '''
+        if self.mode == 'r':
+            self.refresh()
+        start, stop, _ = slice(start, stop).indices(self.count)
+        shape, dtype = self.fields[name]
+        parts = []
+        for number in range(start//self.chunk_steps, (max(stop, start)-1)//self.chunk_steps + 1):
+            first = number*self.chunk_steps
+            chunk = np.load(self._filename(name, number), mmap_mode='r')
+            parts.append(np.array(chunk[max(start-first, 0):min(stop-first, self.chunk_steps)]))
+        if not parts:
+            return np.empty((0,)+shape, dtype=dtype)
+        return np.concatenate(parts)
+
+    def __len__(self):
+        return self.count
+
+    def close(self):
+        if self.chunk is not None:
+            self._close_chunk()
@@ -0,0 +1,301 @@
+''' Declarative sweep: axes, readouts and safety limits in, the measurement loop out
+
+Every measurement script repeats the same loop (ramp, wait, read, append, plot, save,
+check the keyboard) with its own copy of each fix. Sweep runs that loop once for all:
+the axes move in the order of sweep_order (no return ramps on maps), readouts of
+different instruments run concurrently through a StepScheduler, the scalar results go
+into preallocated (steps x points) arrays, the rows are written in binary by DatWriter
+while the next point is measured, and LiveDisplay draws in its own process.
+
+    Usage:
+        gate = GateRamp.ivvi(ivvi, DAC, s1h_gain, voltage = 0, max_rate = 1, resolution = 0.01, tau = 0.5)
+        sweep = Sweep(
+            axes = [Axis.gate('Gate Voltage (V)', pattern['ramp_pattern'], gate, device = ivvi)],
+            readouts = [
+                Readout('Leakage Current (A)', lambda: 1e-6*float(vmeasure.query('READ?')), device = vmeasure),
+                Readout(['Resistance (Ohm)', 'Phase ()', 'Duration (s)'], measure_R, device = lockin),
+                ],
+            limits = [Limit('Leakage Current (A)', maximum = 2.5e-6)],
+            plots = ['Resistance (Ohm)', 'Leakage Current (A)'],
+            control = RunControl(keys = {'s': 'stop', 'p': 'pause'}))
+        Data = stlab.newfile(prefix, '_', autoindex = True, mypath = path)
+        sweep.run(Data) # the .dat text file is exported at the end
+        sweep.data['Resistance (Ohm)'] # (gate steps,) array, NaN where not measured
+
+    axes: one axis (a line) or two (outer, inner: a map, stored as (outer x inner))
+    readouts: read() returns a number, a sequence of numbers (one per name), or a dict of
+        columns; a dict with arrays (VNA_trace.to_dict()) is a trace, saved as one block
+        per point with the axis and scalar values repeated, like the VNA scripts do
+    limits: checked on the columns of every readout as soon as it is read; a violation stops the
+        sweep without waiting for the other readouts of the point
+Maps are written row by row of the outer axis, each in the order of the inner axis (not in the
+order of the sweep), once the row is complete.
+At the end (also after a limit or an exception) the axes with a final value go there.
+sweep.timer (step_timer.StepTimer) has the ramp, settle, acquire, write and plot times
+of every point, logged next to the data file (name_timing.jsonl). sweep.plan() is the
+sweep_plan.SweepPlan of the gate axes and the readout durations: printed before the run,
+checked against time_slot, and refined by the measured times for the remaining time.
+'''
+
+import os
+import numpy as np
+from concurrent.futures import as_completed
+from step_scheduler import StepScheduler
+from sweep_order import sweep_order
+from dat_writer import DatWriter
+from live_view import LiveDisplay
+from step_timer import StepTimer
+from sweep_plan import SweepPlan, ETA
+
+
+class Axis:
+    def __init__(self, name, values, set, settle = None, device = None, final = None, ramp = None):
+        ''' name: column name; values: setpoints in the order of the axis
+            set(value): moves the axis; settle(): waits until it is there (optional)
+            device: instrument behind set (calls on the same device are serialized)
+            final: value the axis goes to at the end (None: stays)
+            ramp: gate_ramp.GateRamp behind set, for the planned ramp and settling times
+        '''
+        self.name = name
+        self.values = np.asarray(values, dtype = float)
+        self.set = set
+        self.settle = settle
+        self.device = device
+        self.final = final
+        self.ramp = ramp
+
+    @classmethod
+    def gate(cls, name, values, ramp, device = None, final = 0.):
+        ''' Axis driven by a gate_ramp.GateRamp; goes back to 0 V at the end '''
+        return cls(name, values, ramp.RampVoltage, ramp.Settle, device = device, final = final, ramp = ramp)
+
+
+class Readout:
+    def __init__(self, names, read, device = None, duration = 0.):
+        ''' names: column name, list of names of the values read() returns, or None for a dict of columns
+            device: instrument behind read (readouts of different devices run at the same time)
+            duration: [s] expected time of read (demodulation, VNA sweep), for the plan
+        '''
+        self.names = names
+        self.read = read
+        self.device = device
+        self.duration = duration
+
+    def columns(self, value):
+        ''' The value read as a dict of columns '''
+        if self.names is None:
+            return dict(value)
+        if isinstance(self.names, str):
+            return {self.names: value}
+        assert len(value) == len(self.names), '%d values for the columns %s' % (len(value), self.names)
+        return dict(zip(self.names, value))
+
+
+class Limit:
+    def __init__(self, name, maximum = None, minimum = None, absolute = True):
+        ''' The sweep stops when the column name goes above maximum or below minimum
+            absolute: compare |value| (leakage currents of either sign)
+        '''
+        self.name = name
+        self.maximum = maximum
+        self.minimum = minimum
+        self.absolute = absolute
+
+    def check(self, row):
+        ''' None if within the limit, else a message '''
+        if self.name not in row:
+            return None
+        value = np.abs(row[self.name]) if self.absolute else row[self.name]
+        if np.any(np.isnan(value)):
+            return None
+        if self.maximum is not None and np.max(value) > self.maximum:
+            return '%s = %g above the limit %g' % (self.name, np.max(value), self.maximum)
+        if self.minimum is not None and np.min(value) < self.minimum:
+            return '%s = %g below the limit %g' % (self.name, np.min(value), self.minimum)
+        return None
+
+
+class Sweep:
+    def __init__(self, axes, readouts, limits = (), order = 'serpentine', plots = (), control = None,
+            figsize = [16,9], verbose = True, timer = None, time_slot = None):
+        ''' order: point order of a map (sweep_order.ORDERS)
+            plots: scalar columns drawn live, vs the axis (line) or as a map
+            control: run_control.RunControl for stop/pause (started and closed by run)
+            timer: step_timer.StepTimer of the phases (None: a new one)
+            time_slot: [h] run refuses to start if the planned time is longer (None: no check)
+        '''
+        assert len(axes) in [1, 2], 'one axis (line) or two (outer, inner: map)'
+        self.axes = list(axes)
+        self.readouts = list(readouts)
+        self.limits = list(limits)
+        self.order = order
+        self.plots = list(plots)
+        self.control = control
+        self.figsize = figsize
+        self.verbose = verbose
+        self.timer = StepTimer() if timer is None else timer
+        self.time_slot = time_slot
+        self.shape = tuple(len(axis.values) for axis in self.axes)
+        self.data = {} # column -> array of self.shape, for the scalar columns
+        self.count = 0
+        self.stopped_by = None # message of the limit that stopped the sweep
+
+    def points(self):
+        ''' (N, number of axes) indices in the order of the sweep '''
+        if len(self.axes) == 1:
+            return np.arange(self.shape[0])[:, None]
+        return sweep_order(self.shape[0], self.shape[1], self.order)
+
+    def plan(self):
+        ''' sweep_plan.SweepPlan of the points: ramps of the gate axes, readouts of a device one after the other '''
+        points = self.points()
+        plan = SweepPlan(len(points))
+        for position, axis in enumerate(self.axes):
+            if axis.ramp is not None:
+                plan.gate(axis.values[points[:, position]], axis.ramp)
+        durations = {}
+        for readout in self.readouts:
+            durations[id(readout.device)] = durations.get(id(readout.device), 0.) + readout.duration
+        plan.add('acquire', max(durations.values(), default = 0.))
+        return plan
+
+    def _display(self):
+        display = LiveDisplay(figsize = self.figsize)
+        for n, name in enumerate(self.plots):
+            position = (len(self.plots), 1, n + 1)
+            if len(self.axes) == 1:
+                display.trace(name, position, self.axes[0].values, style = {'marker': '.'}, ylabel = name, xlabel = self.axes[0].name)
+            else:
+                display.map(name, position, self.axes[1].values, self.axes[0].values, title = name, ylabel = self.axes[0].name, xlabel = self.axes[1].name)
+        display.start()
+        return display
+
+    def _store(self, index, row):
+        for name, value in row.items():
+            if np.ndim(value) != 0:
+                continue
+            if name not in self.data:
+                self.data[name] = np.full(self.shape, np.nan)
+            self.data[name][tuple(index)] = value
+
+    def _show(self, display, index):
+        for name in self.plots:
+            if name not in self.data:
+                continue
+            if len(self.axes) == 1:
+                display.set_point(name, index[0], self.data[name][index[0]])
+            else:
+                display.add_row(name, index[0], self.data[name][index[0]]) # the whole row, NaN where not yet measured
+
+    def _write_rows(self, scheduler, writer, rows, next_row, complete = True):
+        ''' Submit the buffered rows of a map from next_row on, each in the order of the inner axis, while they
+        are complete (complete False: all of them, at the end); returns the next row to write
+        '''
+        while rows and (complete or next_row < self.shape[0]):
+            if next_row not in rows or (complete and len(rows[next_row]) < self.shape[1]):
+                if complete:
+                    break
+                next_row += 1
+                continue
+            row = rows.pop(next_row)
+            for inner in sorted(row):
+                trace, write, value = row[inner]
+                scheduler.submit(writer, write, value)
+            if not trace: # a trace is a block per point already
+                scheduler.submit(writer, writer.end_block) # a block per outer step, as the map scripts write
+            next_row += 1
+        return next_row
+
+    def run(self, data_file = None):
+        ''' Measure all the points; data_file: the file of stlab.newfile (None: nothing saved)
+        returns self.data
+        '''
+        plan = self.plan()
+        if self.verbose:
+            plan.report(self.time_slot)
+        if self.time_slot is not None and not plan.fits(self.time_slot):
+            raise ValueError('Planned time longer than the time slot of %g h: %.1f h' % (self.time_slot, plan.total()/3600))
+        display = self._display() if self.plots else None
+        scheduler = StepScheduler()
+        writer = None
+        current = [None]*len(self.axes)
+        points = self.points()
+        if self.control is not None:
+            self.control.start()
+        eta = ETA(plan, self.timer)
+        rows = {} # outer index -> {inner index: write} of a map, until the row is complete
+        next_row = 0
+        try:
+            for count, index in enumerate(points):
+                moved = []
+                for axis, i, position in zip(self.axes, index, range(len(index))):
+                    if current[position] != i: # outer first, then inner
+                        move = scheduler.submit(axis.device, self.timer.wrap('ramp', axis.set), axis.values[i], after = moved)
+                        moved.append(scheduler.submit(None, self.timer.wrap('settle', axis.settle), after = [move]) if axis.settle else move)
+                        current[position] = i
+                reads = [scheduler.submit(readout.device, self.timer.wrap('acquire', readout.read), after = moved) for readout in self.readouts]
+
+                row = {axis.name: axis.values[i] for axis, i in zip(self.axes, index)}
+                columns = {}
+                violations = []
+                for read in as_completed(reads): # the limits of a readout are checked as soon as it is read
+                    readout = self.readouts[reads.index(read)]
+                    columns[readout] = readout.columns(read.result())
+                    violations = [message for message in (limit.check(columns[readout]) for limit in self.limits) if message]
+                    if violations:
+                        break
+                for readout in self.readouts: # in the order of the readouts, whichever came first
+                    row.update(columns.get(readout, {}))
+                self._store(index, row)
+                self.count = count + 1
+                if violations: # the other readouts of the point are not waited for, nor written
+                    self.stopped_by = violations[0]
+                    print('STOPPED:', ', '.join(violations))
+                    break
+
+                if data_file is not None:
+                    trace = any(np.ndim(value) != 0 for value in row.values())
+                    if writer is None:
+                        writer = DatWriter(data_file, colnames = list(row))
+                        self.timer.log_to(os.path.splitext(writer.filename[:-4])[0] + '_timing.jsonl')
+                    if trace:
+                        write = (trace, self.timer.wrap('write', writer.savedict), row)
+                    else:
+                        write = (trace, self.timer.wrap('write', writer.writeline), list(row.values()))
+                    if len(self.axes) == 1:
+                        scheduler.submit(writer, *write[1:]) # written while the next point runs
+                    else: # a serpentine row is measured backwards every other time
+                        rows.setdefault(index[0], {})[index[1]] = write
+                        next_row = self._write_rows(scheduler, writer, rows, next_row)
+
+                if display is not None:
+                    with self.timer('plot'):
+                        self._show(display, index)
+                self.timer.step(point = count)
+
+                if self.control is not None and not self.control.wait_if_paused():
+                    break
+
+                if self.verbose:
+                    print(eta.status())
+        finally:
+            try:
+                if rows: # the rows left incomplete by a stop, in the order of the axes
+                    self._write_rows(scheduler, writer, rows, next_row, complete = False)
+                scheduler.close() # pending reads and writes
+            finally:
+                for axis in self.axes: # also when a read or a write failed
+                    if axis.final is not None:
+                        axis.set(axis.final)
+                if self.control is not None:
+                    self.control.close()
+                if writer is not None:
+                    writer.close() # the .dat text file
+                self.timer.close()
+                if self.verbose:
+                    self.timer.report()
+                if display is not None:
+                    if writer is not None:
+                        display.savefig(os.path.splitext(writer.filename[:-4])[0])
+                    display.close()
+        return self.data
@@ -0,0 +1,112 @@
+''' Point order of 2D sweeps (gate x bias, gate x power, ...)
+
+The mapping scripts sweep the inner axis always in the same direction, so after every
+row the source ramps back from the last point to the first one. These functions return
+the order in which the points of a (rows x columns) grid are visited, as an (N, 2) array
+of (row, column) indices; the data are stored by index, so the map comes out the same
+whatever the order.
+
+    raster      every row from column 0 to the end (the present behavior)
+    serpentine  odd rows backwards: no return ramp, the rows stay whole
+    hilbert     generalized Hilbert curve: every move is to a neighbouring point
+                (also for grids that are not a power of 2), for maps where both axes
+                are equally slow to move
+
+    Usage:
+        order = sweep_order(len(Vglist), len(V_bias_list), 'serpentine')
+        for gate_count, bias_indices in row_runs(order):
+            gate.RampVoltage(Vglist[gate_count])
+            for count in bias_indices:
+                ivvi.RampVoltage(S3b_dac, V_bias_list[count]/S3b_range*1e3, tt=0.1, steps = 5)
+                ...
+                I_map[gate_count, count] = I
+
+        travel(order, row_cost = time_per_gate_volt*deltaVg, column_cost = ...) # compare orders
+'''
+
+import numpy as np
+
+
+def raster(rows, columns):
+    return np.array([(i, j) for i in range(rows) for j in range(columns)], dtype = int).reshape(-1, 2)
+
+
+def serpentine(rows, columns):
+    return np.array([(i, j) for i in range(rows) for j in (range(columns) if i % 2 == 0 else range(columns - 1, -1, -1))], dtype = int).reshape(-1, 2)
+
+
+def hilbert(rows, columns):
+    ''' Generalized Hilbert ("gilbert") curve of J. Cervený: starts at (0, 0), ends on an
+    edge, only steps to neighbouring points except for a single diagonal step on odd grids
+    '''
+    points = []
+    if columns >= rows:
+        _gilbert(points, 0, 0, columns, 0, 0, rows)
+    else:
+        _gilbert(points, 0, 0, 0, rows, columns, 0)
+    return np.array([(y, x) for x, y in points], dtype = int).reshape(-1, 2)
+
+
+def _sign(x):
+    return (x > 0) - (x < 0)
+
+
+def _gilbert(points, x, y, ax, ay, bx, by):
+    ''' Fill the rectangle at (x, y) of major axis (ax, ay) and minor axis (bx, by) '''
+    width = abs(ax + ay)
+    height = abs(bx + by)
+    dax, day = _sign(ax), _sign(ay)
+    dbx, dby = _sign(bx), _sign(by)
+
+    if height == 1: # a line along the major axis
+        for i in range(width):
+            points.append((x + i*dax, y + i*day))
+        return
+    if width == 1:
+        for i in range(height):
+            points.append((x + i*dbx, y + i*dby))
+        return
+
+    ax2, ay2 = ax//2, ay//2
+    bx2, by2 = bx//2, by//2
+    width2 = abs(ax2 + ay2)
+    height2 = abs(bx2 + by2)
+
+    if 2*width > 3*height: # long rectangle: split in two along the major axis
+        if width2 % 2 and width > 2:
+            ax2, ay2 = ax2 + dax, ay2 + day # even halves keep the end on the right corner
+        _gilbert(points, x, y, ax2, ay2, bx, by)
+        _gilbert(points, x + ax2, y + ay2, ax - ax2, ay - ay2, bx, by)
+    else: # up, across, down
+        if height2 % 2 and height > 2:
+            bx2, by2 = bx2 + dbx, by2 + dby
+        _gilbert(points, x, y, bx2, by2, ax2, ay2)
+        _gilbert(points, x + bx2, y + by2, ax, ay, bx - bx2, by - by2)
+        _gilbert(points, x + (ax - dax) + (bx2 - dbx), y + (ay - day) + (by2 - dby), -bx2, -by2, -(ax - ax2), -(ay - ay2))
+
+
+ORDERS = {'raster': raster, 'serpentine': serpentine, 'hilbert': hilbert}
+
+
+def sweep_order(rows, columns, order = 'serpentine'):
+    ''' (N, 2) array of the (row, column) indices in the order of the sweep; order: raster, serpentine or hilbert '''
+    if order not in ORDERS:
+        raise ValueError('Unknown order: %s (use one of %s)' % (order, ', '.join(ORDERS)))
+    return ORDERS[order](rows, columns)
+
+
+def row_runs(order):
+    ''' (row, column indices) for every run of consecutive points on the same row '''
+    start = 0
+    for stop in range(1, len(order) + 1):
+        if stop == len(order) or order[stop, 0] != order[start, 0]:
+            yield int(order[start, 0]), order[start:stop, 1]
+            start = stop
+
+
+def travel(order, row_cost = 1., column_cost = 1.):
+    ''' Cost of the moves between the points: sum of |row steps|*row_cost + |column steps|*column_cost
+    (e.g. the costs in seconds per index step, to compare the orders of a map)
+    '''
+    steps = np.abs(np.diff(order, axis = 0))
+    return np.sum(steps[:, 0])*row_cost + np.sum(steps[:, 1])*column_cost
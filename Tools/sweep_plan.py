@@ -0,0 +1,160 @@
+''' Run time of a sweep before it starts, refined while it runs
+
+The scripts print REMAINING TIME = elapsed/steps done*steps left, as if every step took
+the same time, while a gate step takes longer the larger it is (the first step from 0 V,
+the return ramp of a double pattern), the VNA sweep follows from the points and the IF
+bandwidth, and the demodulation from its duration. SweepPlan adds up the time of every
+step from the sweep itself before it starts, so the parameters can be chosen to fit the
+fridge time. ETA then corrects every planned phase with the times step_timer.StepTimer
+measures and applies the corrections to the steps still to come.
+
+    Usage:
+        plan = SweepPlan(len(gate_pattern))
+        plan.gate(gate_pattern, gate) # ramp and settling of every step, from the gate_ramp.GateRamp (not moved)
+        plan.vna(fetch.SweepTime(), points = freq_points, traces = 1) # or plan.vna(points = 1001, ifbw = 1e3)
+        plan.add('acquire', demodulation_duration) # [s] any time, the same for every step or one per step
+        plan.add('write', 5e-3)
+        plan.report(time_slot = 12) # total and per phase, and whether it fits in 12 h
+        eta = ETA(plan, timer)
+        for count, gate_voltage in enumerate(gate_pattern):
+            ...
+            timer.step()
+            print(eta.status()) # steps, elapsed and remaining time, expected end
+
+    Trying parameters, nothing is measured:
+        for points in [201, 501, 1001]:
+            plan = SweepPlan(steps)
+            plan.gate(pattern, gate)
+            plan.vna(points = points, ifbw = 1e3)
+            print(points, 'points:', plan.total()/3600, 'h')
+
+A phase of the plan is corrected by the ratio of its measured to its planned time over the
+steps done, pulled towards 1 while few steps are done (a phase the timer does not time is
+taken as planned). The time of the steps that is not in a planned phase (other phases,
+latencies, phases overlapping in scheduler threads) is taken per step from the measurements.
+'''
+
+import time
+import numpy as np
+from gate_ramp import GateRamp
+
+
+def _duration(seconds):
+    ''' 1 h 23 min, 4.5 min or 12.3 s '''
+    if seconds >= 3600:
+        return '%d h %02d min' % (seconds//3600, seconds % 3600//60)
+    if seconds >= 60:
+        return '%.1f min' % (seconds/60)
+    return '%.1f s' % seconds
+
+
+class SweepPlan:
+    def __init__(self, steps):
+        ''' steps: number of steps of the sweep, in the order they are measured '''
+        self.steps = steps
+        self.phases = {} # phase -> (steps,) planned seconds
+
+    def add(self, name, seconds):
+        ''' seconds (a number or one per step) added to the phase name of every step '''
+        seconds = np.broadcast_to(np.asarray(seconds, dtype = float), (self.steps,))
+        self.phases[name] = self.phases.get(name, np.zeros(self.steps)) + seconds
+
+    def gate(self, setpoints, ramp, start = None):
+        ''' 'ramp' and 'settle' of the steps to setpoints (one per step, in the order of the sweep)
+            ramp: the gate_ramp.GateRamp of the sweep; its rate, resolution and settling
+            start: [V] setpoint before the first step (None: the present setpoint of ramp)
+        '''
+        assert len(setpoints) == self.steps, '%d setpoints for %d steps' % (len(setpoints), self.steps)
+        model = GateRamp(lambda v: None, ramp.max_rate, ramp.resolution, tau = ramp.tau, tolerance = ramp.tolerance,
+            voltage = ramp.voltage if start is None else start)
+        times = np.zeros((self.steps, 2))
+        for count, target in enumerate(setpoints):
+            times[count] = model.StepTime(target)
+            model.voltage = target
+        self.add('ramp', times[:, 0])
+        self.add('settle', times[:, 1])
+
+    def vna(self, sweep_time = None, points = None, ifbw = None, averages = 1, traces = 1, overhead = 0.02,
+            transfer_rate = 5e6, real64 = False):
+        ''' 'acquire' and 'transfer' of a VNA trace at every step
+            sweep_time: [s] of a single sweep (vna_fetch.VNA_fetch.SweepTime()); None: points/ifbw
+            averages: sweeps per step; overhead: [s] per sweep (retrace, trigger, *OPC?)
+            traces: S-parameters transferred; transfer_rate: [bytes/s] of the binary blocks
+        '''
+        if sweep_time is None:
+            assert points and ifbw, 'give the sweep time, or the points and the IF bandwidth'
+            sweep_time = points/ifbw
+        self.add('acquire', averages*(sweep_time + overhead))
+        if points:
+            self.add('transfer', traces*points*2*(8 if real64 else 4)/transfer_rate)
+
+    def demodulation(self, duration, settle = 0., overhead = 0.):
+        ''' 'acquire' of a lock-in demodulation of duration [s] at every step, after settle [s] of samples discarded '''
+        self.add('acquire', settle + duration + overhead)
+
+    def per_step(self):
+        ''' (steps,) planned seconds of every step '''
+        return sum(self.phases.values(), np.zeros(self.steps))
+
+    def total(self, start = 0):
+        ''' [s] planned time of the steps from start on '''
+        return float(np.sum(self.per_step()[start:]))
+
+    def fits(self, time_slot):
+        ''' True if the sweep fits in time_slot [h] '''
+        return self.total() <= time_slot*3600
+
+    def report(self, time_slot = None):
+        ''' Print the planned time, per phase, and whether it fits in time_slot [h] '''
+        total = self.total()
+        print('planned: %d steps in %s' % (self.steps, _duration(total)))
+        for name, seconds in self.phases.items():
+            print('    %-10s %10s %6.1f%%  (%.1f-%.1f ms per step)' % (name, _duration(np.sum(seconds)),
+                100*np.sum(seconds)/total if total > 0 else 0., 1e3*np.min(seconds), 1e3*np.max(seconds)))
+        if time_slot is not None:
+            print('fits in the %g h slot' % time_slot if self.fits(time_slot) else
+                'DOES NOT FIT in the %g h slot: %s too long' % (time_slot, _duration(total - time_slot*3600)))
+
+
+class ETA:
+    def __init__(self, plan, timer, prior = 3):
+        ''' plan: SweepPlan of the sweep; timer: the step_timer.StepTimer closing its steps
+            prior: weight, in steps, of the plan against the measured corrections
+        '''
+        self.plan = plan
+        self.timer = timer
+        self.prior = prior
+        self.t_start = time.time()
+
+    def corrections(self):
+        ''' {phase: measured/planned ratio} over the steps done, and the unplanned [s] per step '''
+        done = min(len(self.timer.steps), self.plan.steps)
+        corrections = {}
+        unplanned = self.timer.times('time')[:done]
+        for name, planned in self.plan.phases.items():
+            if name not in self.timer.names: # not timed: taken as planned
+                corrections[name] = 1.
+                unplanned = unplanned - planned[:done]
+                continue
+            spent = self.timer.times(name)[:done]
+            weight = self.prior*np.mean(planned)
+            expected = np.sum(planned[:done]) + weight
+            corrections[name] = (np.sum(spent) + weight)/expected if expected > 0 else 1.
+            unplanned = unplanned - spent
+        if done == 0:
+            return corrections, 0.
+        return corrections, float(np.mean(unplanned[1:] if done > 1 else unplanned)) # the first step also has the time before the loop
+
+    def remaining(self):
+        ''' [s] expected time of the steps still to come '''
+        done = min(len(self.timer.steps), self.plan.steps)
+        corrections, unplanned = self.corrections()
+        remaining = sum(corrections[name]*np.sum(planned[done:]) for name, planned in self.plan.phases.items())
+        return max(0., remaining + unplanned*(self.plan.steps - done))
+
+    def status(self):
+        ''' 'measured steps: 12 of 500, ELAPSED TIME: ..., REMAINING TIME: ..., END: 14:05' '''
+        remaining = self.remaining()
+        return 'measured steps: %d of %d, ELAPSED TIME: %.2f min, REMAINING TIME: %.2f min, END: %s' % (
+            len(self.timer.steps), self.plan.steps, (time.time() - self.t_start)/60, remaining/60,
+            time.strftime('%a %H:%M', time.localtime(time.time() + remaining)))
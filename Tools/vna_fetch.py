@@ -0,0 +1,154 @@
+''' Fast trace readout for the R&S ZND/ZNB and Keysight FieldFox VNAs
+
+VNA.MeasureScreen_pd() transfers every trace as ASCII and builds the full
+table (re, im, dB, phase) on every step. VNA_fetch switches the data format
+to binary REAL,32 (or REAL,64) blocks once, reads the (linear) frequency
+axis once and returns the traces as complex numpy arrays that are views on the
+received buffer. dB and phase are only computed when they are asked for
+(for plotting or saving).
+
+    Usage:
+        VNA = RS_ZND('TCPIP::192.168.1.149::INSTR', reset=False)
+        fetch = VNA_fetch(VNA)
+        # fetch = VNA_fetch(VNA, timer=timer) # step_timer.StepTimer: sweep and transfer times of every Measure
+        trace = fetch.Measure()
+        fetch.SweepTime()       # [s] of a sweep, for sweep_plan.SweepPlan.vna
+        trace.S['S21']          # complex array
+        trace.dB('S21')         # computed on the first call, then cached
+        data = trace.to_pd()    # same columns as VNA.MeasureScreen_pd(), for stlab.savedict
+        fetch.Close()           # back to ASCII and continuous sweeps, so the stlab methods and the screen keep working
+
+After changing the sweep (frequencies, points, traces) call fetch.Reset().
+'''
+
+import numpy as np
+from step_timer import StepTimer
+
+
+class VNA_trace:
+    def __init__(self, frequency, S):
+        self.frequency = frequency # [Hz]
+        self.S = S # dict: S-parameter name -> complex numpy array
+        self._dB = {}
+        self._phase = {}
+
+    def dB(self, name):
+        if name not in self._dB:
+            self._dB[name] = 20*np.log10(np.abs(self.S[name]))
+        return self._dB[name]
+
+    def phase(self, name):
+        ''' unwrapped phase [rad] '''
+        if name not in self._phase:
+            self._phase[name] = np.unwrap(np.angle(self.S[name]))
+        return self._phase[name]
+
+    def to_dict(self):
+        ''' Columns named like MeasureScreen_pd: Frequency (Hz), S21re (), S21im (), S21dB (dB), S21Ph (rad), ... '''
+        data = {'Frequency (Hz)': self.frequency}
+        for name, S in self.S.items():
+            data[name+'re ()'] = S.real
+            data[name+'im ()'] = S.imag
+            data[name+'dB (dB)'] = self.dB(name)
+            data[name+'Ph (rad)'] = self.phase(name)
+        return data
+
+    def to_pd(self):
+        import pandas as pd
+        return pd.DataFrame(self.to_dict())
+
+
+class VNA_fetch:
+    def __init__(self, vna, model='ZND', real64=False, channel=1, timer=None):
+        ''' vna: RS_ZND or stlab.adi device (ZND, ZNB or FieldFox)
+            model: 'ZND' (also for the ZNB) or 'FieldFox'
+            real64: transfer float64 instead of float32 values
+            timer: step_timer.StepTimer timing the sweep ('acquire') and the blocks ('transfer')
+        '''
+        if model not in ['ZND', 'FieldFox']:
+            raise ValueError('Unknown VNA model: %s' % model)
+        self.vna = vna
+        self.dev = getattr(vna, 'dev', vna) # the pyvisa resource behind the stlab device
+        self.model = model
+        self.channel = channel
+        self.datatype = 'd' if real64 else 'f'
+        self.complex_type = np.complex128 if real64 else np.complex64
+        self.timer = timer if timer is not None else StepTimer(enabled=False)
+
+        self.dev.write('FORM:DATA REAL,%d' % (64 if real64 else 32))
+        self.dev.write('FORM:BORD SWAP') # little endian
+        self.init = 'INIT%d' % channel if model == 'ZND' else 'INIT'
+        self.continuous = self.dev.query(self.init + ':CONT?').strip().upper() in ['1', 'ON'] # restored by Close
+        self.dev.write(self.init + ':CONT OFF') # single sweeps: *OPC? after INIT:IMM waits for a new, complete sweep
+        self.Reset()
+
+    def Reset(self):
+        ''' Re-read the frequency axis and the list of traces '''
+        self.frequency = None
+        self.traces = None
+
+    def GetTraces(self):
+        ''' [(trace name, S-parameter), ...]; raises if two traces measure the same S-parameter (trace.S is keyed by it) '''
+        if self.traces is None:
+            if self.model == 'ZND':
+                catalog = self.dev.query('CALC%d:PAR:CAT?' % self.channel).strip().strip("'").split(',')
+                self.traces = list(zip(catalog[0::2], catalog[1::2]))
+            else:
+                count = int(self.dev.query('CALC:PAR:COUN?'))
+                self.traces = [(str(i+1), self.dev.query('CALC:PAR%d:DEF?' % (i+1)).strip().strip('"'))
+                    for i in range(count)]
+            parameters = [parameter for _, parameter in self.traces]
+            for parameter in set(parameters):
+                if parameters.count(parameter) > 1:
+                    names = [name for name, other in self.traces if other == parameter]
+                    self.traces = None
+                    raise ValueError('Traces %s all measure %s: keep one trace per S-parameter' % (', '.join(names), parameter))
+        return self.traces
+
+    def GetFrequency(self):
+        ''' Frequency axis of a linear sweep [Hz], queried once (ASCII, unaffected by FORM:DATA) '''
+        if self.frequency is None:
+            prefix = 'SENS%d:' % self.channel if self.model == 'ZND' else ''
+            start = float(self.dev.query(prefix+'FREQ:STAR?'))
+            stop = float(self.dev.query(prefix+'FREQ:STOP?'))
+            points = int(float(self.dev.query(prefix+'SWE:POIN?')))
+            self.frequency = np.linspace(start, stop, points)
+        return self.frequency
+
+    def SweepTime(self):
+        ''' [s] duration of a single sweep, as the VNA computes it from the points, IF bandwidth and sweep time setting '''
+        prefix = 'SENS%d:' % self.channel if self.model == 'ZND' else ''
+        return float(self.dev.query(prefix+'SWE:TIME?'))
+
+    def Measure(self):
+        ''' Single sweep, then all traces in binary blocks '''
+        frequency = self.GetFrequency()
+        traces = self.GetTraces()
+
+        with self.timer('acquire'):
+            if self.model == 'ZND':
+                self.dev.write('INIT%d:IMM' % self.channel)
+            else:
+                self.dev.write('INIT:IMM')
+            self.dev.query('*OPC?') # waits for the end of the sweep
+
+        S = {}
+        with self.timer('transfer'):
+            for trace, parameter in traces:
+                if self.model == 'ZND':
+                    self.dev.write("CALC%d:PAR:SEL '%s'" % (self.channel, trace))
+                    block = self._query_block('CALC%d:DATA? SDAT' % self.channel)
+                else:
+                    self.dev.write('CALC:PAR%s:SEL' % trace)
+                    block = self._query_block('CALC:DATA:SDATA?')
+                S[parameter] = block.view(self.complex_type) # interleaved re, im -> complex, no copy
+        return VNA_trace(frequency, S)
+
+    def _query_block(self, command):
+        return self.dev.query_binary_values(command, datatype=self.datatype, is_big_endian=False,
+            container=np.array)
+
+    def Close(self):
+        ''' Back to ASCII transfers for the stlab driver, and to the sweep mode the VNA had before (continuous on the screen) '''
+        self.dev.write('FORM:DATA ASCII')
+        self.dev.write(self.init + ':CONT ' + ('ON' if self.continuous else 'OFF'))